@@ -0,0 +1,243 @@
+"""
+Synthetic data resembling PubMed documents and the inputs of the indexing tools.
+
+The texts are made of random words with a fraction of concept labels,
+annotated in the format written by the indexing tools for search results,
+or plain for the inputs of the tagger. Nothing is downloaded.
+"""
+
+import random
+from typing import Dict, List, Sequence, Set
+from xml.sax.saxutils import escape
+
+WORDS = (
+    "groundwater aquifer bacteria microbial community sediment carbon nitrogen "
+    "oxidation limestone hillslope recharge archaea soil water flow transport "
+    "diversity sequencing analysis sample depth well surface subsurface organic "
+    "matter dissolved oxygen nitrate sulfate iron metabolism gene abundance"
+).split()
+CONCEPTS = [
+    ("bacteria", "NCBITaxon%3A2"),
+    ("archaea", "NCBITaxon%3A2157"),
+    ("groundwater", "ENVO%3A01001004"),
+    ("aquifer", "ENVO%3A00012408"),
+    ("limestone", "ENVO%3A00002053"),
+    ("humans", "NCBITaxon%3A9606"),
+]
+JOURNALS = [
+    "Frontiers in Microbiology",
+    "Environmental Microbiology",
+    "The ISME Journal",
+    "Water Research",
+    "Geobiology",
+]
+
+
+def annotated_text(rng: random.Random, words: int, density: float = 0.05) -> str:
+    """A text of words, of which a fraction of density are annotated concepts."""
+    tokens = []
+    for _ in range(words):
+        if rng.random() < density:
+            label, concept = rng.choice(CONCEPTS)
+            tokens.append(f"[{label}]({concept})")
+        else:
+            tokens.append(rng.choice(WORDS))
+    return " ".join(tokens).capitalize() + "."
+
+
+def document(rng: random.Random, pmid: int) -> Dict:
+    """The _source of an indexed document."""
+    year = rng.randint(1990, 2021)
+    month = rng.randint(1, 12)
+    return {
+        "pmid": str(pmid),
+        "title": annotated_text(rng, rng.randint(8, 20)),
+        "abstract": annotated_text(rng, rng.randint(150, 350)),
+        "author": [
+            f"{rng.choice(WORDS).capitalize()} {chr(65 + rng.randint(0, 25))}"
+            for _ in range(rng.randint(1, 12))
+        ],
+        "journal": rng.choice(JOURNALS),
+        "volume": str(rng.randint(1, 300)),
+        "issue": str(rng.randint(1, 12)),
+        "pages": f"{rng.randint(1, 900)}-{rng.randint(901, 999)}",
+        "year": year,
+        "date": f"{year} {month:02d}",
+        "pubdate": f"{year}-{month:02d}-01",
+        "mesh": [rng.choice(WORDS) for _ in range(rng.randint(0, 8))],
+        "url": f"https://pubmed.ncbi.nlm.nih.gov/{pmid}/",
+    }
+
+
+def search_response(size: int, seed: int = 0) -> Dict:
+    """The raw answer of Elasticsearch for a page of size documents."""
+    rng = random.Random(seed)
+    hits: List[Dict] = []
+    for i in range(size):
+        pmid = 30000000 + i
+        hits.append(
+            {
+                "_index": "pubmed",
+                "_type": "_doc",
+                "_id": str(pmid),
+                "_score": 10.0 - i / size,
+                "_source": document(rng, pmid),
+            }
+        )
+    return {
+        "took": 12,
+        "timed_out": False,
+        "_shards": {"total": 1, "successful": 1, "skipped": 0, "failed": 0},
+        "hits": {
+            "total": {"value": size, "relation": "eq"},
+            "max_score": 10.0,
+            "hits": hits,
+        },
+    }
+
+
+SYLLABLES = "ba co de fi gu la me no pi ru sa te vi xo zu".split()
+MONTHS = "Jan Feb Mar Apr May Jun Jul Aug Sep Oct Nov Dec".split()
+
+
+def plain_text(
+    rng: random.Random, words: int, labels: Sequence[str] = (), density: float = 0.05
+) -> str:
+    """A text of words, of which a fraction of density are taken from labels."""
+    tokens = []
+    for _ in range(words):
+        if labels and rng.random() < density:
+            tokens.append(rng.choice(labels))
+        else:
+            tokens.append(rng.choice(WORDS))
+    return " ".join(tokens).capitalize() + "."
+
+
+def latin_name(rng: random.Random) -> str:
+    genus = "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+    species = "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+    return f"{genus.capitalize()} {species}"
+
+
+def taxonomy_dat(entries: int, seed: int = 0) -> str:
+    """Entries in the format of taxonomy.dat as provided by the EBI."""
+    rng = random.Random(seed)
+    lines: List[str] = []
+    for i in range(1, entries + 1):
+        fields = [
+            ("ID", str(i)),
+            ("PARENT ID", str(rng.randint(1, i - 1)) if i > 1 else "0"),
+            ("RANK", "species"),
+            ("GC ID", "11"),
+            ("SCIENTIFIC NAME", latin_name(rng)),
+        ]
+        for _ in range(rng.randint(0, 3)):
+            fields.append(("SYNONYM", latin_name(rng)))
+        if rng.random() < 0.2:
+            fields.append(("GENBANK COMMON NAME", rng.choice(WORDS) + " microbe"))
+        lines.extend(f"{name:<26}: {value}" for name, value in fields)
+        lines.append("//")
+    return "\n".join(lines) + "\n"
+
+
+def pubmed_xml(documents: int, seed: int = 0, labels: Sequence[str] = ()) -> str:
+    """
+    A PubMed archive of documents citations, followed by some deletions.
+    The titles and abstracts mention the given labels.
+    """
+    rng = random.Random(seed)
+    parts = ['<?xml version="1.0" encoding="UTF-8"?>', "<PubmedArticleSet>"]
+    for i in range(documents):
+        pmid = 30000000 + i
+        authors = "".join(f"""
+        <Author ValidYN="Y">
+          <LastName>{rng.choice(WORDS).capitalize()}</LastName>
+          <ForeName>{rng.choice(SYLLABLES).capitalize()}</ForeName>
+          <Initials>{chr(65 + rng.randint(0, 25))}</Initials>
+        </Author>""" for _ in range(rng.randint(1, 8)))
+        abstract = "".join(
+            f"""
+        <AbstractText Label="{label}">{escape(plain_text(rng, 60, labels))}</AbstractText>"""
+            for label in ("BACKGROUND", "METHODS", "RESULTS", "CONCLUSIONS")
+        )
+        mesh = "".join(f"""
+      <MeshHeading>
+        <DescriptorName UI="D{rng.randint(1, 99999):06d}">{rng.choice(WORDS)}</DescriptorName>
+      </MeshHeading>""" for _ in range(rng.randint(1, 8)))
+        parts.append(f"""<PubmedArticle>
+  <MedlineCitation Status="MEDLINE" Owner="NLM">
+    <PMID Version="1">{pmid}</PMID>
+    <Article PubModel="Print">
+      <Journal>
+        <JournalIssue CitedMedium="Internet">
+          <Volume>{rng.randint(1, 300)}</Volume>
+          <Issue>{rng.randint(1, 12)}</Issue>
+          <PubDate>
+            <Year>{rng.randint(1990, 2021)}</Year>
+            <Month>{rng.choice(MONTHS)}</Month>
+          </PubDate>
+        </JournalIssue>
+        <Title>{escape(rng.choice(JOURNALS))}</Title>
+      </Journal>
+      <ArticleTitle>{escape(plain_text(rng, rng.randint(8, 20), labels))}</ArticleTitle>
+      <Pagination>
+        <MedlinePgn>{rng.randint(1, 900)}-{rng.randint(901, 999)}</MedlinePgn>
+      </Pagination>
+      <Abstract>{abstract}
+      </Abstract>
+      <AuthorList CompleteYN="Y">{authors}
+      </AuthorList>
+      <Language>eng</Language>
+    </Article>
+    <MeshHeadingList>{mesh}
+    </MeshHeadingList>
+  </MedlineCitation>
+</PubmedArticle>""")
+    deleted = "".join(f"""
+  <PMID Version="1">{20000000 + i}</PMID>""" for i in range(documents // 100))
+    parts.append(f"<DeleteCitation>{deleted}\n</DeleteCitation>")
+    parts.append("</PubmedArticleSet>")
+    return "\n".join(parts) + "\n"
+
+
+def bibtex_entries(documents: int, seed: int = 0, labels: Sequence[str] = ()) -> str:
+    """A BibTeX file of documents articles with abstracts."""
+    rng = random.Random(seed)
+    entries = []
+    for i in range(documents):
+        authors = " and ".join(
+            f"{rng.choice(WORDS).capitalize()}, {rng.choice(SYLLABLES).capitalize()}"
+            for _ in range(rng.randint(1, 8))
+        )
+        entries.append(f"""@article{{Synthetic{i},
+    author = "{authors}",
+    title = "{plain_text(rng, rng.randint(8, 20), labels)}",
+    abstract = "{plain_text(rng, rng.randint(150, 350), labels)}",
+    journal = "{rng.choice(JOURNALS)}",
+    year = "{rng.randint(1990, 2021)}",
+    month = "{rng.choice(MONTHS).lower()}",
+    volume = "{rng.randint(1, 300)}",
+    pages = "{rng.randint(1, 900)}--{rng.randint(901, 999)}",
+    doi = "10.5555/synthetic.{i}"
+}}
+""")
+    return "\n".join(entries)
+
+
+def synthetic_concepts(concepts: int, seed: int = 0) -> Dict[str, Set[str]]:
+    """
+    Labels of concepts, e.g. for onto2trie.make_automaton.
+    Taxa get the name variants generated by ncbi_filter, like in a real automaton.
+    """
+    from preprocessing.ncbi_filter import make_variants
+
+    rng = random.Random(seed)
+    labels: Dict[str, Set[str]] = dict()
+    for i in range(concepts):
+        if i % 2 == 0:
+            names: Dict = {"SCIENTIFIC NAME": [latin_name(rng)]}
+            labels[f"NCBITaxon:{i}"] = make_variants(names)
+        else:
+            words = rng.sample(WORDS, rng.randint(1, 3))
+            labels[f"ENVO:{i:08d}"] = {" ".join(words)}
+    return labels
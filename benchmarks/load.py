@@ -0,0 +1,420 @@
+"""
+Load test of the search proxy against a stand-in for Elasticsearch.
+
+The stand-in answers every search with a canned page of synthetic documents
+after a configurable latency, so the measured times are those of the proxy
+itself and its behaviour with many concurrent requests. The requests are
+either replayed from the requests.log written by the proxy or drawn from
+a mix of synthetic concepts. The proxy is served by waitress or,
+if uvicorn is installed, as ASGI application.
+
+    python -m benchmarks.load --server waitress asgi --concurrency 1 8 32
+    python -m benchmarks.load --log requests.log --latency 0.05
+
+The admission control is switched off, unless --admission is given,
+because all requests come from the same client.
+"""
+
+import argparse
+import http.client
+import itertools
+import json
+import logging
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Optional
+from urllib.parse import quote, unquote, urlencode
+
+from elasticsearch import Elasticsearch
+from flask import Flask
+
+from benchmarks.data import CONCEPTS, WORDS, search_response
+from query_proxy.admission import AdmissionControl
+from query_proxy.app import create_app
+from query_proxy.app.asgi import AsgiApp
+
+# Searches logged by older versions of the proxy
+LOG_MATCHER = re.compile(r" - INFO - Original request: (.+)$")
+OBO = "http://purl.obolibrary.org/obo/"
+SERVERS = ("waitress", "asgi")
+
+
+class FakeElasticsearch(ThreadingHTTPServer):
+    """
+    Answers searches on any index with search_response() after latency seconds,
+    plus up to jitter seconds. A fraction of empty searches without any hits
+    lets the proxy run its fallback query.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self, latency: float = 0.01, jitter: float = 0.0, empty: float = 0.0
+    ) -> None:
+        super().__init__(("127.0.0.1", 0), FakeElasticsearchHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.empty = empty
+        self._responses: Dict[int, bytes] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def response(self, body: Dict[str, Any]) -> bytes:
+        size = body.get("size", 10)
+        if "aggs" in body or random.random() < self.empty:
+            answer = search_response(0)
+            answer["aggregations"] = {
+                name: {"buckets": []} for name in body.get("aggs", {})
+            }
+            return json.dumps(answer).encode()
+        with self._lock:
+            if size not in self._responses:
+                self._responses[size] = json.dumps(search_response(size)).encode()
+            return self._responses[size]
+
+
+class FakeElasticsearchHandler(BaseHTTPRequestHandler):
+    server: FakeElasticsearch
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately, Nagle's algorithm would delay the body
+    disable_nagle_algorithm = True
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def _send(self, status: int, body: bytes) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def do_HEAD(self) -> None:
+        self._send(200, b"")
+
+    def do_GET(self) -> None:
+        self.do_POST()
+
+    def do_POST(self) -> None:
+        length = int(self.headers.get("Content-Length") or 0)
+        request = self.rfile.read(length) if length else b""
+        if not self.path.split("?")[0].endswith("/_search"):
+            self._send(200, b'{"version": {"number": "7.11.0"}}')
+            return
+        body = json.loads(request) if request else {}
+        server = self.server
+        time.sleep(server.latency + random.uniform(0, server.jitter))
+        self._send(200, server.response(body))
+
+
+def replayed_parameter(value: Any) -> str:
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, list):
+        return ",".join(str(item) for item in value)
+    return str(value)
+
+
+def logged_requests(log_file: Path) -> List[str]:
+    """
+    The query strings of the searches logged in requests.log.
+    The JSON records of searches are replayed with their parameters,
+    the lines of older versions only carry the request.
+    """
+    requests = []
+    with log_file.open("rt", encoding="utf-8", errors="replace") as log:
+        for line in log:
+            if line.startswith("{"):
+                record = json.loads(line)
+                if record.get("message") != "search" or not record.get("request"):
+                    continue
+                parameters = {"request": record["request"]}
+                for key, value in record.get("parameters", {}).items():
+                    # 'end' has been turned into 'size' already
+                    if key != "end":
+                        parameters[key] = replayed_parameter(value)
+                requests.append(urlencode(parameters, quote_via=quote, safe=",;:/"))
+                continue
+            match = LOG_MATCHER.search(line.rstrip("\n"))
+            if match is not None:
+                requests.append("request=" + quote(match.group(1), safe=",;:/"))
+    return requests
+
+
+def synthetic_requests(n: int, seed: int = 0) -> List[str]:
+    """
+    Query strings of searches for one to three concepts, some with literal
+    strings. Popular concepts are requested more often than others,
+    so that some requests are identical like in a real stream.
+    """
+    rng = random.Random(seed)
+    iris = [OBO + unquote(concept).replace(":", "_") for _, concept in CONCEPTS]
+    weights = [1 / (rank + 1) for rank in range(len(iris))]
+    requests = []
+    for _ in range(n):
+        terms = rng.choices(iris, weights, k=rng.randint(1, 3))
+        if rng.random() < 0.2:
+            terms.append(rng.choice(WORDS))
+        query = "request=" + quote(",".join(dict.fromkeys(terms)), safe=",;:/")
+        query += f"&size={rng.choice((10, 10, 20, 50))}"
+        requests.append(query)
+    return requests
+
+
+def make_app(search_url: str, admission: bool) -> Flask:
+    app = create_app("production")
+    app.config["SEARCH"] = app.config["SEARCH"].using(Elasticsearch([search_url]))
+    app.config["CLIENT_OPTIONS"] = dict(
+        app.config["CLIENT_OPTIONS"], hosts=[search_url]
+    )
+    if not admission:
+        app.extensions["admission"] = AdmissionControl()
+    return app
+
+
+class Server(NamedTuple):
+    port: int
+    stop: Callable[[], None]
+
+
+def serve_waitress(app: Flask, threads: int) -> Server:
+    import waitress
+    from waitress import wasyncore
+
+    # Saturation shows in the latencies, not in a warning per queued request
+    logging.getLogger("waitress.queue").setLevel(logging.ERROR)
+    server = waitress.create_server(app, host="127.0.0.1", port=0, threads=threads)
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+
+    def stop() -> None:
+        server.task_dispatcher.shutdown(cancel_pending=False)
+        # The sockets may only be closed by the thread running the main loop
+        server.trigger.pull_trigger(lambda: wasyncore.close_all(server._map))
+        thread.join(timeout=5)
+
+    return Server(server.effective_port, stop)
+
+
+def serve_asgi(app: Flask) -> Server:
+    import socket
+
+    import uvicorn
+
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    # Like the sockets uvicorn binds itself, otherwise every answer waits
+    # for the delayed ACK of its headers
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    # The lifespan events let the application close its Elasticsearch client
+    server = uvicorn.Server(uvicorn.Config(AsgiApp(app), log_level="warning"))
+    thread = threading.Thread(
+        target=server.run, kwargs={"sockets": [sock]}, daemon=True
+    )
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+
+    def stop() -> None:
+        server.should_exit = True
+        thread.join(timeout=5)
+
+    return Server(sock.getsockname()[1], stop)
+
+
+class Level(NamedTuple):
+    """The results of the requests sent at a level of concurrency."""
+
+    concurrency: int
+    seconds: float
+    latencies: List[float]
+    errors: Dict[str, int]
+
+    @property
+    def throughput(self) -> float:
+        return len(self.latencies) / self.seconds if self.seconds > 0 else 0.0
+
+    def percentile(self, p: float) -> float:
+        """The latency below which p percent of the requests were answered."""
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        rank = max(0, min(len(ordered) - 1, round(p / 100 * len(ordered)) - 1))
+        return ordered[rank]
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "concurrency": self.concurrency,
+            "requests": len(self.latencies),
+            "errors": self.errors,
+            "seconds": self.seconds,
+            "requests_per_second": self.throughput,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+        }
+
+
+def run_level(
+    port: int, requests: Iterator[str], concurrency: int, total: int
+) -> Level:
+    """Send total requests over concurrency keep-alive connections."""
+    lock = threading.Lock()
+    sent = itertools.count()
+    latencies: List[float] = []
+    errors: Dict[str, int] = {}
+
+    def worker() -> None:
+        connection = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+        while next(sent) < total:
+            with lock:
+                query = next(requests)
+            start = time.perf_counter()
+            try:
+                connection.request("GET", "/?" + query)
+                response = connection.getresponse()
+                response.read()
+                elapsed = time.perf_counter() - start
+                error = None if response.status == 200 else str(response.status)
+            except (OSError, http.client.HTTPException) as e:
+                connection.close()
+                error = type(e).__name__
+            with lock:
+                if error is None:
+                    latencies.append(elapsed)
+                else:
+                    errors[error] = errors.get(error, 0) + 1
+        connection.close()
+
+    workers = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return Level(concurrency, time.perf_counter() - start, latencies, errors)
+
+
+def main(
+    servers: List[str],
+    concurrency: List[int],
+    requests_per_level: int,
+    log_file: Optional[Path],
+    latency: float,
+    jitter: float,
+    empty: float,
+    threads: int,
+    admission: bool,
+    output: Optional[Path],
+) -> None:
+    if log_file is not None:
+        requests = logged_requests(log_file)
+        if not requests:
+            sys.exit(f"No searches found in {log_file}")
+    else:
+        requests = synthetic_requests(max(requests_per_level, 1000))
+    elasticsearch = FakeElasticsearch(latency, jitter, empty)
+    threading.Thread(target=elasticsearch.serve_forever, daemon=True).start()
+    print(
+        f"{len(requests)} requests, Elasticsearch latency {latency * 1000:.0f} ms"
+        + (f" + up to {jitter * 1000:.0f} ms" if jitter else "")
+    )
+    results: Dict[str, List[Dict[str, Any]]] = {}
+    try:
+        for name in servers:
+            app = make_app(elasticsearch.url, admission)
+            if name == "asgi":
+                try:
+                    server = serve_asgi(app)
+                except ImportError:
+                    print("asgi: skipped, uvicorn is not installed")
+                    continue
+            else:
+                server = serve_waitress(app, threads)
+            try:
+                stream = itertools.cycle(requests)
+                # Warm up the connections and the caches of the proxy
+                run_level(server.port, stream, 1, 10)
+                results[name] = []
+                for level in concurrency:
+                    result = run_level(server.port, stream, level, requests_per_level)
+                    report = result.report()
+                    results[name].append(report)
+                    print(
+                        f"{name:>8} c={level:<4} {report['requests_per_second']:8.1f} req/s "
+                        f"p50 {report['p50'] * 1000:7.1f} ms "
+                        f"p95 {report['p95'] * 1000:7.1f} ms "
+                        f"p99 {report['p99'] * 1000:7.1f} ms"
+                        + (f" errors {report['errors']}" if report["errors"] else "")
+                    )
+            finally:
+                server.stop()
+    finally:
+        elasticsearch.shutdown()
+        elasticsearch.server_close()
+    if output is not None:
+        with output.open("wt", encoding="utf-8") as out:
+            json.dump(results, out, indent=2)
+
+
+if __name__ == "__main__":
+    PARSER = argparse.ArgumentParser(
+        description="Measure throughput and latency of the proxy at several concurrencies"
+    )
+    PARSER.add_argument(
+        "--server", nargs="+", choices=SERVERS, default=list(SERVERS), help="Servers"
+    )
+    PARSER.add_argument(
+        "--concurrency",
+        nargs="+",
+        type=int,
+        default=[1, 4, 16, 64],
+        help="Concurrent connections of the levels",
+    )
+    PARSER.add_argument("--requests", type=int, default=500, help="Requests per level")
+    PARSER.add_argument(
+        "--log", type=Path, help="Replay the searches of this requests.log"
+    )
+    PARSER.add_argument(
+        "--latency", type=float, default=0.01, help="Seconds Elasticsearch takes"
+    )
+    PARSER.add_argument(
+        "--jitter", type=float, default=0.0, help="Additional random seconds"
+    )
+    PARSER.add_argument(
+        "--empty",
+        type=float,
+        default=0.0,
+        help="Fraction of searches without hits, which cause fallback queries",
+    )
+    PARSER.add_argument(
+        "--threads", type=int, default=4, help="Threads of waitress, its default is 4"
+    )
+    PARSER.add_argument(
+        "--admission",
+        action="store_true",
+        help="Keep the rate and concurrency limits of config.json",
+    )
+    PARSER.add_argument("--output", type=Path, help="Write the results as JSON")
+    ARGS = PARSER.parse_args()
+    main(
+        ARGS.server,
+        ARGS.concurrency,
+        ARGS.requests,
+        ARGS.log,
+        ARGS.latency,
+        ARGS.jitter,
+        ARGS.empty,
+        ARGS.threads,
+        ARGS.admission,
+        ARGS.output,
+    )
@@ -0,0 +1,79 @@
+"""
+Time and size of serializing a page of search results.
+
+Compares the json module used by Flask with orjson and the bytes sent
+without compression, with gzip and with brotli, if it is installed.
+
+    python -m benchmarks.serialization --size 100
+"""
+
+import argparse
+import gzip
+import timeit
+from typing import Callable, List, Tuple
+
+from elasticsearch_dsl import Search
+from elasticsearch_dsl.response import Response as EsResponse
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+from benchmarks.data import search_response
+from query_proxy.app import create_app
+from query_proxy.app.compression import BROTLI_QUALITY, GZIP_LEVEL, brotli
+from query_proxy.app.main.views import make_answer, prepare_response
+from query_proxy.app.serialization import OrjsonProvider, orjson
+
+
+def measure(function: Callable[[], object], repeat: int) -> float:
+    """The best time of a call in milliseconds."""
+    return min(timeit.repeat(function, number=1, repeat=repeat)) * 1000
+
+
+def serializers(app: Flask) -> List[Tuple[str, Callable[[object], bytes]]]:
+    providers = [("json", DefaultJSONProvider(app))]
+    if orjson is not None:
+        providers.append(("orjson", OrjsonProvider(app)))
+    return [
+        (name, lambda answer, provider=provider: provider.response(answer).get_data())
+        for name, provider in providers
+    ]
+
+
+def main(size: int, repeat: int) -> None:
+    app = create_app("production")
+    raw = search_response(size)
+    with app.app_context():
+        es_response = EsResponse(Search(index="pubmed"), raw)
+        prepare = measure(lambda: prepare_response(es_response), repeat)
+        answer = make_answer(
+            {"size": size}, "bacteria", prepare_response(es_response), []
+        )
+        print(f"Page of {size} documents")
+        print(f"prepare_response: {prepare:8.2f} ms")
+        body = b""
+        for name, serialize in serializers(app):
+            body = serialize(answer)
+            elapsed = measure(lambda: serialize(answer), repeat)
+            print(f"{name:>16}: {elapsed:8.2f} ms {len(body):>10} bytes")
+        compressors = [
+            ("gzip", lambda: gzip.compress(body, compresslevel=GZIP_LEVEL)),
+        ]
+        if brotli is not None:
+            compressors.append(
+                ("br", lambda: brotli.compress(body, quality=BROTLI_QUALITY))
+            )
+        for name, compress in compressors:
+            elapsed = measure(compress, repeat)
+            print(f"{name:>16}: {elapsed:8.2f} ms {len(compress()):>10} bytes")
+
+
+if __name__ == "__main__":
+    PARSER = argparse.ArgumentParser(
+        description="Measure the serialization and compression of a page of results"
+    )
+    PARSER.add_argument("--size", type=int, default=100, help="Documents per page")
+    PARSER.add_argument(
+        "--repeat", type=int, default=20, help="Repetitions, the best is reported"
+    )
+    ARGS = PARSER.parse_args()
+    main(ARGS.size, ARGS.repeat)
@@ -0,0 +1,332 @@
+"""
+Offline benchmarks of the parsing and tagging done by the indexing tools.
+
+Synthetic PubMed archives, BibTeX files and taxonomy.dat files are generated
+in memory, so nothing is downloaded. The texts are tagged with the mini
+automaton of the tests and with a larger synthetic automaton.
+Every case reports documents per second and the peak of the memory
+allocated by Python. The results are compared with a stored baseline
+and the run fails, if a case is slower or uses more memory than
+the tolerance allows.
+
+    python -m benchmarks.suite
+    python -m benchmarks.suite --save
+
+The baseline depends on the machine, it has to be saved again on another one.
+The cases that need spaCy are skipped, if it is not installed.
+"""
+
+import argparse
+import io
+import json
+import pickle
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from functools import cmp_to_key
+from pathlib import Path
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence
+
+from ahocorasick import Automaton
+
+from benchmarks.data import (
+    bibtex_entries,
+    plain_text,
+    pubmed_xml,
+    synthetic_concepts,
+    taxonomy_dat,
+)
+from parsers import bibtex, pubmed
+from preprocessing.ncbi_filter import taxonomy2dict
+from preprocessing.onto2trie import make_automaton
+from query_proxy.lexicon import (
+    disambiguate,
+    entity_sort,
+    find_annotations,
+    remove_overlap,
+)
+
+BASELINE = Path(__file__).parent / "baseline.json"
+MINI_AUTOMATON = (
+    Path(__file__).parent.parent / "tests" / "resources" / "mini-automaton.pickle"
+)
+TOLERANCE = 0.3
+
+
+class Case(NamedTuple):
+    """
+    A benchmark. setup returns the function to measure, which returns
+    the number of documents it processed.
+    """
+
+    name: str
+    setup: Callable[[], Callable[[], int]]
+    needs_spacy: bool = False
+
+
+class Result(NamedTuple):
+    documents: int
+    seconds: float
+    peak_memory: int
+
+    @property
+    def documents_per_second(self) -> float:
+        return self.documents / self.seconds if self.seconds > 0 else 0.0
+
+
+def labels_of(automaton: Automaton, n: int, seed: int) -> List[str]:
+    """A sample of n labels known to the automaton."""
+    keys = sorted(automaton.keys())
+    return random.Random(seed).sample(keys, min(n, len(keys)))
+
+
+def texts(documents: int, labels: Sequence[str], seed: int) -> List[str]:
+    """Titles and abstracts like the ones of the archives."""
+    rng = random.Random(seed)
+    return [plain_text(rng, rng.randint(150, 350), labels) for _ in range(documents)]
+
+
+def tag_texts(automaton: Automaton, corpus: List[str]) -> int:
+    """The same steps as Tagger.__call__, without spaCy."""
+    key = cmp_to_key(entity_sort)
+    for text in corpus:
+        annotations = find_annotations(automaton, text)
+        annotations.sort(key=key)
+        disambiguate(remove_overlap(annotations))
+    return len(corpus)
+
+
+def make_cases(
+    documents: int, concepts: int, seed: int, work_dir: Path
+) -> Dict[str, Case]:
+    with MINI_AUTOMATON.open("rb") as trie:
+        mini = pickle.load(trie)
+    synthetic = make_automaton(synthetic_concepts(concepts, seed))
+    synthetic_file = work_dir / "synthetic-automaton.pickle"
+    with synthetic_file.open("wb") as out:
+        pickle.dump(synthetic, out)
+    mini_texts = texts(documents, labels_of(mini, 200, seed), seed)
+    synthetic_texts = texts(documents, labels_of(synthetic, 2000, seed), seed)
+
+    def pubmed_parse() -> Callable[[], int]:
+        archive = pubmed_xml(documents, seed, labels_of(mini, 200, seed))
+        return lambda: sum(1 for _ in pubmed.parse(io.StringIO(archive)))
+
+    def bibtex_parse() -> Callable[[], int]:
+        entries = bibtex_entries(documents, seed)
+        return lambda: sum(1 for _ in bibtex.parse(io.StringIO(entries)))
+
+    def taxonomy() -> Callable[[], int]:
+        taxonomy_file = work_dir / "taxonomy.dat"
+        taxonomy_file.write_text(taxonomy_dat(concepts, seed), encoding="utf-8")
+        return lambda: sum(1 for _ in taxonomy2dict(taxonomy_file))
+
+    def lexicon(automaton: Automaton, corpus: List[str]) -> Callable[[], int]:
+        return lambda: tag_texts(automaton, corpus)
+
+    def tagger(corpus: List[str]) -> Callable[[], int]:
+        import spacy
+
+        from query_proxy.tagger import Tagger
+
+        nlp = spacy.blank("en")
+        pipe = Tagger(synthetic_file)
+        return lambda: sum(1 for text in corpus if pipe(nlp.make_doc(text)))
+
+    def retokenize(corpus: List[str]) -> Callable[[], int]:
+        import spacy
+
+        from query_proxy.tagger import Tagger
+
+        nlp = spacy.blank("en")
+        pipe = Tagger(synthetic_file)
+        key = cmp_to_key(entity_sort)
+        prepared = []
+        for text in corpus:
+            annotations = find_annotations(synthetic, text)
+            annotations.sort(key=key)
+            prepared.append((text, disambiguate(remove_overlap(annotations))))
+        return lambda: sum(
+            1
+            for text, annotations in prepared
+            if pipe.retokenize(nlp.make_doc(text), annotations)
+        )
+
+    def annotate(corpus: List[str]) -> Callable[[], int]:
+        import spacy
+
+        from query_proxy.ncbi import annotate as annotate_doc
+        from query_proxy.tagger import Tagger
+
+        nlp = spacy.blank("en")
+        pipe = Tagger(synthetic_file)
+        docs = [pipe(nlp.make_doc(text)) for text in corpus]
+        return lambda: sum(1 for doc in docs if annotate_doc(doc))
+
+    cases = [
+        Case("pubmed_parse", pubmed_parse),
+        Case("bibtex_parse", bibtex_parse),
+        Case("taxonomy2dict", taxonomy),
+        Case("lexicon_mini", lambda: lexicon(mini, mini_texts)),
+        Case("lexicon_synthetic", lambda: lexicon(synthetic, synthetic_texts)),
+        Case("tagger", lambda: tagger(synthetic_texts), needs_spacy=True),
+        Case("retokenize", lambda: retokenize(synthetic_texts), needs_spacy=True),
+        Case("annotate", lambda: annotate(synthetic_texts), needs_spacy=True),
+    ]
+    return {case.name: case for case in cases}
+
+
+def measure(run: Callable[[], int], repeat: int) -> Result:
+    """The best time of repeat runs and the peak memory of a separate run."""
+    best = float("inf")
+    documents = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        documents = run()
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        run()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return Result(documents, best, peak)
+
+
+def spacy_available() -> bool:
+    try:
+        import spacy  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def compare(
+    results: Dict[str, Dict[str, Any]],
+    baseline: Dict[str, Any],
+    tolerance: float,
+) -> List[str]:
+    """The regressions of results with respect to the baseline."""
+    regressions = []
+    for name, result in results.items():
+        reference = baseline["results"].get(name)
+        if reference is None:
+            continue
+        minimum = reference["documents_per_second"] * (1 - tolerance)
+        if result["documents_per_second"] < minimum:
+            regressions.append(
+                f"{name}: {result['documents_per_second']:.1f} docs/s, "
+                f"baseline {reference['documents_per_second']:.1f} docs/s"
+            )
+        maximum = reference["peak_memory"] * (1 + tolerance)
+        if result["peak_memory"] > maximum:
+            regressions.append(
+                f"{name}: peak memory {result['peak_memory']} bytes, "
+                f"baseline {reference['peak_memory']} bytes"
+            )
+    return regressions
+
+
+def main(
+    documents: int,
+    concepts: int,
+    repeat: int,
+    baseline_file: Path,
+    tolerance: float,
+    save: bool,
+    only: Optional[List[str]] = None,
+    seed: int = 0,
+) -> int:
+    parameters = {"documents": documents, "concepts": concepts, "seed": seed}
+    has_spacy = spacy_available()
+    results: Dict[str, Dict[str, Any]] = dict()
+    with tempfile.TemporaryDirectory() as work_dir:
+        cases = make_cases(documents, concepts, seed, Path(work_dir))
+        for name in only or cases:
+            if name not in cases:
+                print(f"Unknown case {name}. Expected one of: " + ", ".join(cases))
+                return 2
+            case = cases[name]
+            if case.needs_spacy and not has_spacy:
+                print(f"{name:>18}: skipped, spaCy is not installed")
+                continue
+            result = measure(case.setup(), repeat)
+            print(
+                f"{name:>18}: {result.documents_per_second:12.1f} docs/s "
+                f"{result.peak_memory / 2**20:10.2f} MiB"
+            )
+            results[name] = {
+                "documents": result.documents,
+                "seconds": result.seconds,
+                "documents_per_second": result.documents_per_second,
+                "peak_memory": result.peak_memory,
+            }
+    if save:
+        with baseline_file.open("wt", encoding="utf-8") as out:
+            json.dump({"parameters": parameters, "results": results}, out, indent=2)
+            out.write("\n")
+        print(f"Baseline written to {baseline_file}")
+        return 0
+    if not baseline_file.exists():
+        print(f"No baseline at {baseline_file}, run with --save to create one")
+        return 0
+    with baseline_file.open("rt", encoding="utf-8") as source:
+        baseline = json.load(source)
+    if baseline["parameters"] != parameters:
+        # Throughput and memory depend on the size of the input
+        print(
+            f"The baseline was measured with {baseline['parameters']}, "
+            "run with the same parameters to compare"
+        )
+        return 0
+    regressions = compare(results, baseline, tolerance)
+    for regression in regressions:
+        print(f"Regression of {regression}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    PARSER = argparse.ArgumentParser(
+        description="Benchmark the parsers and the tagger on synthetic data"
+    )
+    PARSER.add_argument(
+        "--documents", type=int, default=1000, help="Documents per case"
+    )
+    PARSER.add_argument(
+        "--concepts",
+        type=int,
+        default=20000,
+        help="Concepts of the synthetic automaton and entries of taxonomy.dat",
+    )
+    PARSER.add_argument(
+        "--repeat", type=int, default=5, help="Repetitions, the best is reported"
+    )
+    PARSER.add_argument(
+        "--baseline", type=Path, default=BASELINE, help="JSON file of the baseline"
+    )
+    PARSER.add_argument(
+        "--tolerance",
+        type=float,
+        default=TOLERANCE,
+        help="Accepted fraction of slowdown or additional memory",
+    )
+    PARSER.add_argument(
+        "--save", action="store_true", help="Save the results as the new baseline"
+    )
+    PARSER.add_argument(
+        "--only", nargs="+", metavar="CASE", help="Run only the given cases"
+    )
+    ARGS = PARSER.parse_args()
+    sys.exit(
+        main(
+            ARGS.documents,
+            ARGS.concepts,
+            ARGS.repeat,
+            ARGS.baseline,
+            ARGS.tolerance,
+            ARGS.save,
+            ARGS.only,
+        )
+    )
@@ -12,6 +12,8 @@ from typing import Dict, Iterator, List, TextIO, Tuple, Union
 from pybtex.database.input.bibtex import Parser
 from pybtex.exceptions import PybtexError
 
+from parsers.dates import normalize_date
+
 
 def format_person(item: Tuple, datadict: Dict) -> None:
     """Format all authors and editors."""
@@ -45,6 +47,11 @@ def parse(
                 datadict[fieldname] = field[1]
             for item in entry.persons.items():
                 format_person(item, datadict)
+            pubdate = normalize_date(
+                datadict.get("year"), datadict.get("month"), datadict.get("day")
+            )
+            if pubdate is not None:
+                datadict["pubdate"] = pubdate
             yield datadict
     except PybtexError as p:
         logging.error(
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Tue Oct 20 13:15:40 2026
+
+Functions to turn the publication dates of bibliographic references
+into ISO 8601 dates (YYYY-MM-DD) that can be indexed as dates.
+Missing months and days are set to the first of the period.
+"""
+
+import calendar
+import re
+from typing import Optional, Union
+
+MONTHS = {
+    "jan": 1,
+    "feb": 2,
+    "mar": 3,
+    "apr": 4,
+    "may": 5,
+    "jun": 6,
+    "jul": 7,
+    "aug": 8,
+    "sep": 9,
+    "oct": 10,
+    "nov": 11,
+    "dec": 12,
+}
+
+# Seasons are mapped onto their first month (northern hemisphere)
+SEASONS = {
+    "spring": 3,
+    "summer": 6,
+    "fall": 9,
+    "autumn": 9,
+    "winter": 12,
+}
+
+YEAR = re.compile(r"\b(\d{4})\b")
+WORD = re.compile(r"[A-Za-z]+|\d+")
+
+
+def parse_month(month: Union[str, int, None]) -> Optional[int]:
+    """
+    Interpret a month given as number, name, abbreviation or season.
+    Returns None for anything else.
+    """
+    if month is None:
+        return None
+    if isinstance(month, int):
+        return month if 1 <= month <= 12 else None
+    month = month.strip().lower()
+    if month.isdigit():
+        number = int(month)
+        return number if 1 <= number <= 12 else None
+    if month in SEASONS:
+        return SEASONS[month]
+    return MONTHS.get(month[:3])
+
+
+def normalize_date(
+    year: Union[str, int, None],
+    month: Union[str, int, None] = None,
+    day: Union[str, int, None] = None,
+) -> Optional[str]:
+    """
+    Combine year, month and day into an ISO 8601 date.
+
+    Returns None, if the year is missing or invalid.
+    An invalid month or day is ignored.
+    """
+    try:
+        y = int(year)  # type: ignore
+    except (TypeError, ValueError):
+        return None
+    if not 1000 <= y <= 9999:
+        return None
+    m = parse_month(month)
+    if m is None:
+        return f"{y:04d}-01-01"
+    try:
+        d = int(day)  # type: ignore
+    except (TypeError, ValueError):
+        d = 1
+    if not 1 <= d <= calendar.monthrange(y, m)[1]:
+        d = 1
+    return f"{y:04d}-{m:02d}-{d:02d}"
+
+
+def parse_medline_date(text: str) -> Optional[str]:
+    """
+    Extract the beginning of the period given by a MedlineDate.
+
+    MedlineDate is free text, e.g. '1998 Dec-1999 Jan', '2000 Spring',
+    '1975 Jul-Aug', '1976-1977' or '2005 Jan 15-21'.
+    The first year is combined with the first month or season
+    and the first day following it. A season may also precede the year,
+    e.g. 'Summer 2003'.
+    """
+    match = YEAR.search(text)
+    if match is None:
+        return None
+    year = match.group(1)
+    month = None
+    day = None
+    for word in WORD.findall(text[match.end() :]):
+        if month is None:
+            if word.isdigit() or parse_month(word) is None:
+                break
+            month = word
+        else:
+            if word.isdigit() and len(word) <= 2:
+                day = word
+            break
+    if month is None:
+        preceding = WORD.findall(text[: match.start()])
+        if preceding and parse_month(preceding[-1]) is not None:
+            month = preceding[-1]
+    return normalize_date(year, month, day)
@@ -17,6 +17,8 @@ import logging
 from typing import Dict, Iterator, List, TextIO, Union
 from xml.etree.ElementTree import Element, iterparse
 
+from parsers.dates import normalize_date, parse_medline_date
+
 logger = logging.getLogger("ncbi.pubmed")
 
 
@@ -117,6 +119,7 @@ def extract_journaldata(journal: Element, pmid: str) -> Dict[str, str]:
         medline_date = pubdate.find("MedlineDate")
         if medline_date is not None and medline_date.text is not None:
             data["date"] = medline_date.text
+            normalized = parse_medline_date(medline_date.text)
         else:
             year = pubdate.find("Year")
             if year is not None and year.text is not None:
@@ -125,6 +128,18 @@ def extract_journaldata(journal: Element, pmid: str) -> Dict[str, str]:
             month = pubdate.find("Month")
             if month is not None and month.text is not None:
                 data["month"] = month.text.lower()
+            else:
+                month = pubdate.find("Season")
+            day = pubdate.find("Day")
+            normalized = normalize_date(
+                data.get("year"),
+                month.text if month is not None else None,
+                day.text if day is not None else None,
+            )
+        if normalized is not None:
+            data["pubdate"] = normalized
+        else:
+            logging.warning("Could not normalize publication date of article %s", pmid)
     else:
         logging.warning("Article %s should have had a publication date entry", pmid)
     title = journal.find("Title")
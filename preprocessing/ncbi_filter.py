@@ -11,7 +11,7 @@ Created on Wed May 15 13:10:06 2019
 import logging
 import re
 from pathlib import Path
-from typing import Dict, Iterator, List, Set, Union, cast
+from typing import Dict, Iterator, List, Optional, Set, Union, cast
 
 logger = logging.getLogger("ncbi")
 
@@ -148,7 +148,9 @@ def make_variants(tax_entry: Dict[str, Union[str, List[str]]]) -> Set[str]:
 
 
 def filter_ncbi_taxonomy(
-    file: Union[Path, str], ids: Union[List[str], Set[str]]
+    file: Union[Path, str],
+    ids: Union[List[str], Set[str]],
+    parents: Optional[Dict[str, str]] = None,
 ) -> Dict[str, Set[str]]:
     """
     Create a dictionary containing all name variants of specific entries.
@@ -159,6 +161,10 @@ def filter_ncbi_taxonomy(
         Path to taxonomy.dat
     ids : List[str]
         A list of all IDs of interest
+    parents : Dict[str, str], optional
+        If given, the parent IDs of all entries of the taxonomy are
+        added to it in the same pass, stored by ID.
+        The root of the taxonomy has no parent.
 
     Returns
     -------
@@ -169,6 +175,10 @@ def filter_ncbi_taxonomy(
     entries = dict()
     if ids is not None:
         for entry in taxonomy2dict(file):
+            if parents is not None and "PARENT ID" in entry:
+                parent = cast(str, entry["PARENT ID"])
+                if parent != entry["ID"] and parent != "0":
+                    parents[cast(str, entry["ID"])] = parent
             if not entry["ID"] in ids:
                 continue
             variants = make_variants(entry)
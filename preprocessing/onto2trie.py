@@ -12,7 +12,7 @@ import re
 import sys
 from collections import defaultdict
 from pathlib import Path
-from typing import Dict, Set, Tuple
+from typing import Dict, FrozenSet, Iterable, Set, Tuple
 
 import rdflib
 from ahocorasick import Automaton
@@ -29,6 +29,14 @@ def compact_id(iri: str) -> str:
     return iri
 
 
+def expand_id(compact: str) -> str:
+    """Turn a prefixed identifier back into an OBO IRI, see compact_id(str)."""
+    if compact.startswith("http://") or compact.startswith("https://"):
+        return compact
+    prefix, _, local = compact.partition(":")
+    return f"http://purl.obolibrary.org/obo/{prefix}_{local}"
+
+
 def triples2dict(triples: rdflib.graph.Graph) -> Tuple[Dict[str, Set[str]], Set[str]]:
     """
     Extract all labels and synonyms from a graph of RDF triples.
@@ -69,6 +77,70 @@ def triples2dict(triples: rdflib.graph.Graph) -> Tuple[Dict[str, Set[str]], Set[
     return concepts, taxon_keys
 
 
+def triples2parents(triples: rdflib.graph.Graph) -> Dict[str, Set[str]]:
+    """
+    Extract the direct superclasses of all classes from a graph of RDF triples.
+
+    Returns
+    -------
+    Dict[str, Set[str]]
+        The compacted IDs of the superclasses stored by the compacted ID
+        of the subclass. owl:Thing is left out.
+    """
+    parents: Dict[str, Set[str]] = defaultdict(set)
+    for s, o in triples.subject_objects(rdflib.RDFS.subClassOf):
+        if isinstance(s, rdflib.term.URIRef) and isinstance(o, rdflib.term.URIRef):
+            if o != rdflib.OWL.Thing:
+                parents[compact_id(str(s))].add(compact_id(str(o)))
+    return parents
+
+
+def ancestor_closure(
+    parents: Dict[str, Set[str]], concepts: Iterable[str]
+) -> Dict[str, Tuple[str, ...]]:
+    """
+    Compute all (transitive) ancestors of concepts.
+
+    Parameters
+    ----------
+    parents : Dict[str, Set[str]]
+        The direct parents of each concept.
+    concepts : Iterable[str]
+        The concepts of interest, e.g. all concepts of an automaton.
+
+    Returns
+    -------
+    Dict[str, Tuple[str, ...]]
+        The sorted ancestors of every concept that has at least one.
+        Cycles in the hierarchy are tolerated.
+    """
+    closure: Dict[str, FrozenSet[str]] = dict()
+
+    def ancestors(concept: str) -> FrozenSet[str]:
+        # Iterative depth-first search, as taxonomies are too deep for recursion
+        if concept in closure:
+            return closure[concept]
+        result: Set[str] = set()
+        stack = list(parents.get(concept, ()))
+        while stack:
+            parent = stack.pop()
+            if parent in result or parent == concept:
+                continue
+            result.add(parent)
+            if parent in closure:
+                result.update(closure[parent])
+            else:
+                stack.extend(parents.get(parent, ()))
+        closure[concept] = frozenset(result)
+        return closure[concept]
+
+    return {
+        concept: tuple(sorted(ancestors(concept)))
+        for concept in concepts
+        if ancestors(concept)
+    }
+
+
 def make_automaton(concepts: Dict[str, Set[str]]) -> Automaton:
     """Create an Aho-Corasick automaton out of dictionary entries."""
     automaton = Automaton()
@@ -103,6 +175,12 @@ if __name__ == "__main__":
     PARSER.add_argument(
         "-o", "--output", help="Where the automaton should be written to", type=str
     )
+    PARSER.add_argument(
+        "-a",
+        "--ancestors",
+        help="Where the ancestors of all concepts should be written to (optional)",
+        type=str,
+    )
     ARGS = PARSER.parse_args()
     NCBI = Path(ARGS.ncbi)
     if not NCBI.exists():
@@ -115,6 +193,10 @@ if __name__ == "__main__":
     if OUTPUT.exists():
         print(f"ERROR: Output file {OUTPUT} already exists.", file=sys.stdout)
         sys.exit(1)
+    ANCESTORS = Path(ARGS.ancestors) if ARGS.ancestors is not None else None
+    if ANCESTORS is not None and ANCESTORS.exists():
+        print(f"ERROR: Output file {ANCESTORS} already exists.", file=sys.stdout)
+        sys.exit(1)
     try:
         ontology = rdflib.Graph().parse(ARGS.input)
     except FileNotFoundError:
@@ -124,9 +206,19 @@ if __name__ == "__main__":
         print(f"ERROR: Input argument {ARGS.input} is not a file.", file=sys.stderr)
         sys.exit(1)
     concepts, taxon_keys = triples2dict(ontology)
-    variants = filter_ncbi_taxonomy(NCBI, taxon_keys)
+    taxon_parents: Dict[str, str] = dict()
+    variants = filter_ncbi_taxonomy(
+        NCBI, taxon_keys, taxon_parents if ANCESTORS is not None else None
+    )
     for key, values in variants.items():
         concepts["NCBITaxon:" + key] = values
     trie = make_automaton(concepts)
     with OUTPUT.open("wb") as output:
         pickle.dump(trie, output)
+    if ANCESTORS is not None:
+        parents = triples2parents(ontology)
+        for key, parent in taxon_parents.items():
+            parents["NCBITaxon:" + key].add("NCBITaxon:" + parent)
+        closure = ancestor_closure(parents, concepts.keys())
+        with ANCESTORS.open("wb") as output:
+            pickle.dump(closure, output)
@@ -0,0 +1,272 @@
+"""
+Admission control in front of the search.
+
+Every client, identified by its API key or its address, has a token bucket
+limiting the rate of its requests and may only run a few searches at the
+same time. Requests beyond that cap wait in a bounded queue for a while,
+all others are rejected at once, so that a single client can not occupy
+every thread of the server and the search threads of Elasticsearch.
+
+Only the API keys of the configuration identify a client. Any other key is
+ignored, as a client could otherwise get a new bucket with every request.
+"""
+
+import asyncio
+import threading
+import time
+from collections import Counter
+from contextlib import asynccontextmanager, contextmanager
+from typing import (
+    AsyncIterator,
+    Callable,
+    Collection,
+    Dict,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Tuple,
+)
+
+# Clients with a known API key in this header are identified by it,
+# all others by their address
+API_KEY_HEADER = "X-API-Key"
+
+
+class Rejected(Exception):
+    """The request has not been admitted and may be retried after retry_after seconds."""
+
+    def __init__(self, reason: str, retry_after: float) -> None:
+        super().__init__(reason)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float, now: float) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, now: float) -> float:
+        """
+        Take a token.
+
+        Returns
+        -------
+        float
+            0, if a token was available, otherwise the seconds until there is one.
+        """
+        self.refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class AdmissionControl:
+    """
+    Rate and concurrency limits per client, shared by all threads of a worker.
+
+    Parameters
+    ----------
+    rate : float, optional
+        Requests per second and client, unlimited if None.
+    burst : float, optional
+        Requests a client may send at once, defaults to rate.
+    concurrency : int, optional
+        Searches a client may run at the same time, unlimited if None.
+    queue_size : int
+        Requests of all clients that may wait for a free slot.
+    queue_timeout : float
+        Seconds a request waits for a free slot before it is rejected.
+    api_keys : Collection[str], optional
+        The API keys that identify a client.
+    """
+
+    # Idle clients are forgotten once there are more buckets than this
+    MAX_CLIENTS = 10000
+
+    def __init__(
+        self,
+        rate: Optional[float] = None,
+        burst: Optional[float] = None,
+        concurrency: Optional[int] = None,
+        queue_size: int = 0,
+        queue_timeout: float = 1.0,
+        api_keys: Optional[Collection[str]] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.rate = rate
+        self.burst = max(burst or rate or 1, 1)
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.api_keys = frozenset(api_keys or ())
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._released = threading.Condition(self._lock)
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._active: Counter = Counter()
+        self._waiting = 0
+        # Events of the asynchronous requests in the queue, set by release()
+        self._async_waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Event]] = []
+        # Number of requests that have been admitted, queued and rejected
+        self.counters: Counter = Counter(admitted=0, queued=0, rejected=0)
+
+    @classmethod
+    def from_config(cls, config: Mapping) -> "AdmissionControl":
+        return cls(
+            rate=config.get("RATE_LIMIT"),
+            burst=config.get("RATE_BURST"),
+            concurrency=config.get("CLIENT_CONCURRENCY"),
+            queue_size=config.get("QUEUE_SIZE") or 0,
+            queue_timeout=config.get("QUEUE_TIMEOUT") or 0.0,
+            api_keys=config.get("API_KEYS"),
+        )
+
+    def client_key(self, api_key: Optional[str], address: Optional[str]) -> str:
+        """The client of a request, unknown API keys are ignored."""
+        if api_key and api_key in self.api_keys:
+            return f"key:{api_key}"
+        return f"address:{address}"
+
+    def _reject(self, reason: str, retry_after: float) -> None:
+        self.counters["rejected"] += 1
+        raise Rejected(reason, retry_after)
+
+    def _take_token(self, key: str) -> None:
+        if self.rate is None:
+            return
+        now = self.clock()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= self.MAX_CLIENTS:
+                self._forget(now)
+            bucket = TokenBucket(self.rate, self.burst, now)
+            self._buckets[key] = bucket
+        wait = bucket.take(now)
+        if wait > 0:
+            self._reject("Too many requests.", wait)
+
+    def _forget(self, now: float) -> None:
+        """Drop the buckets of idle clients, a new bucket is full anyway."""
+        for key, bucket in list(self._buckets.items()):
+            bucket.refill(now)
+            if bucket.tokens >= bucket.burst and key not in self._active:
+                del self._buckets[key]
+
+    def _has_slot(self, key: str) -> bool:
+        return self.concurrency is None or self._active[key] < self.concurrency
+
+    def _admit(self, key: str) -> None:
+        self._active[key] += 1
+        self.counters["admitted"] += 1
+
+    def _enter(self, key: str) -> bool:
+        """Admit the request or put it into the queue, if it has to wait."""
+        has_slot = self._has_slot(key)
+        # Requests that can not even wait do not spend a token of the client
+        if not has_slot and self._waiting >= self.queue_size:
+            self._reject("Too many concurrent requests.", self.queue_timeout)
+        self._take_token(key)
+        if has_slot:
+            self._admit(key)
+            return True
+        self._waiting += 1
+        self.counters["queued"] += 1
+        return False
+
+    def _leave_queue(self, key: str, admitted: bool) -> None:
+        self._waiting -= 1
+        if admitted:
+            self._admit(key)
+        else:
+            self._reject("Too many concurrent requests.", self.queue_timeout)
+
+    def acquire(self, key: str) -> None:
+        """
+        Wait until the client may run another search.
+
+        Raises
+        ------
+        Rejected
+            If the client has exceeded its rate or no slot has become free in time.
+        """
+        with self._lock:
+            if self._enter(key):
+                return
+            admitted = self._released.wait_for(
+                lambda: self._has_slot(key), self.queue_timeout
+            )
+            self._leave_queue(key, admitted)
+
+    async def acquire_async(self, key: str) -> None:
+        """Same as acquire(str), without blocking the event loop while waiting."""
+        with self._lock:
+            if self._enter(key):
+                return
+            released = asyncio.Event()
+            waiter = (asyncio.get_running_loop(), released)
+            self._async_waiters.append(waiter)
+        deadline = self.clock() + self.queue_timeout
+        try:
+            while True:
+                with self._lock:
+                    admitted = self._has_slot(key)
+                    if admitted or self.clock() >= deadline:
+                        self._leave_queue(key, admitted)
+                        return
+                    # Cleared under the lock, so that no release() is missed
+                    released.clear()
+                try:
+                    await asyncio.wait_for(
+                        released.wait(), max(deadline - self.clock(), 0)
+                    )
+                except asyncio.TimeoutError:
+                    pass
+        except asyncio.CancelledError:
+            with self._lock:
+                self._waiting -= 1
+            raise
+        finally:
+            with self._lock:
+                self._async_waiters.remove(waiter)
+
+    def release(self, key: str) -> None:
+        with self._lock:
+            self._active[key] -= 1
+            if self._active[key] <= 0:
+                del self._active[key]
+            self._released.notify_all()
+            # release() may be called from another thread than the event loop
+            for loop, released in self._async_waiters:
+                loop.call_soon_threadsafe(released.set)
+
+    @contextmanager
+    def admit(self, key: str) -> Iterator[None]:
+        self.acquire(key)
+        try:
+            yield
+        finally:
+            self.release(key)
+
+    @asynccontextmanager
+    async def admit_async(self, key: str) -> AsyncIterator[None]:
+        await self.acquire_async(key)
+        try:
+            yield
+        finally:
+            self.release(key)
+
+    def statistics(self) -> Dict[str, int]:
+        """The counters together with the number of running and waiting requests."""
+        with self._lock:
+            statistics = dict(self.counters)
+            statistics["active"] = sum(self._active.values())
+            statistics["waiting"] = self._waiting
+        return statistics
@@ -8,6 +8,12 @@ def create_app(config_name: str) -> Flask:
     app.config.from_object(config[config_name])
     config[config_name].init_app(app)
 
+    from .compression import compress_response
+    from .serialization import init_serializer
+
+    init_serializer(app)
+    app.after_request(compress_response)
+
     from .main import main as main_blueprint
 
     app.register_blueprint(main_blueprint)
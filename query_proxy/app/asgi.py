@@ -0,0 +1,218 @@
+"""
+ASGI application serving the search API with the asynchronous Elasticsearch client.
+
+While waiting for Elasticsearch, a worker can serve other requests, so the number
+of concurrent searches is no longer limited by the number of threads.
+The asynchronous client requires aiohttp to be installed.
+
+Searches on '/' are handled natively, all other routes are passed on
+to the Flask application in a thread.
+"""
+
+import asyncio
+import functools
+import time
+from typing import Any, Awaitable, Callable, Dict
+from urllib.parse import parse_qsl
+
+import elasticsearch
+import flask
+from elasticsearch_dsl import Search
+from elasticsearch_dsl.response import Response as EsResponse
+from flask import Flask, abort, current_app
+from werkzeug.datastructures import Headers, MultiDict
+from werkzeug.exceptions import HTTPException, InternalServerError, MethodNotAllowed
+from werkzeug.test import EnvironBuilder
+from werkzeug.wrappers import Response
+
+from query_proxy.admission import API_KEY_HEADER, Rejected
+from query_proxy.metrics import Timings
+from query_proxy.singleflight import AsyncSingleFlight
+
+from .compression import compress
+from .main import views
+from .serialization import json_mimetype
+
+Scope = Dict[str, Any]
+Receive = Callable[[], Awaitable[Dict[str, Any]]]
+Send = Callable[[Dict[str, Any]], Awaitable[None]]
+
+
+class AsgiApp:
+    def __init__(self, app: Flask, client: Any = None) -> None:
+        """
+        Parameters
+        ----------
+        app : Flask
+            The application providing configuration, logging and all other routes.
+        client : AsyncElasticsearch, optional
+            Will be created from the CLIENT_OPTIONS of the application on first use,
+            if not given.
+        """
+        self.app = app
+        self.client = client
+        self.in_flight = AsyncSingleFlight()
+
+    def get_client(self) -> Any:
+        if self.client is None:
+            try:
+                from elasticsearch import AsyncElasticsearch
+            except ImportError:
+                raise ImportError(
+                    "The asynchronous Elasticsearch client requires aiohttp.\n"
+                    + "Please issue 'python -m pip install aiohttp' beforehand."
+                )
+            self.client = AsyncElasticsearch(**self.app.config["CLIENT_OPTIONS"])
+        return self.client
+
+    async def execute(self, prepared_search: Search) -> EsResponse:
+        """Asynchronous counterpart of Search.execute()."""
+        try:
+            raw = await self.get_client().search(
+                index=prepared_search._index,
+                body=prepared_search.to_dict(),
+                **prepared_search._params,
+            )
+        except elasticsearch.exceptions.NotFoundError as e:
+            current_app.logger.error(e)
+            abort(404, description="Index not found.")
+        return prepared_search._response_class(prepared_search, raw)
+
+    async def run(self, steps: views.Steps) -> bytes:
+        """Asynchronous counterpart of views.run(Steps)."""
+        try:
+            prepared_search = next(steps)
+            while True:
+                prepared_search = steps.send(await self.execute(prepared_search))
+        except StopIteration as result:
+            return result.value
+
+    async def index(self, args: MultiDict, key: str) -> flask.Response:
+        """Same as views.index() for the client identified by key."""
+        admission = self.app.extensions["admission"]
+        try:
+            await admission.acquire_async(key)
+        except Rejected as e:
+            raise views.too_many_requests(e)
+        timings = Timings()
+        begin = time.perf_counter()
+        profile = self.app.extensions["profiler"].sample()
+        shared = False
+        try:
+            with timings.measure("parse"):
+                query, warnings = views.prepare_query(args)
+            # answer_request replaces the request with the parsed queries
+            parameters = dict(query)
+            start = time.perf_counter()
+            body, shared = await self.in_flight.do(
+                views.query_key(query, warnings),
+                lambda: self.run(
+                    views.profiled(
+                        views.answer_request(query, warnings, timings), profile
+                    )
+                ),
+            )
+        finally:
+            admission.release(key)
+            if profile is not None:
+                views.finish_profile(profile, args, shared)
+        if shared:
+            timings.add("wait", time.perf_counter() - start)
+        views.record_search(parameters, timings, time.perf_counter() - begin, shared)
+        response = current_app.response_class(body, mimetype=json_mimetype())
+        response.headers["Server-Timing"] = timings.server_timing()
+        return response
+
+    async def forward(self, scope: Scope, receive: Receive) -> Response:
+        """Let the Flask application answer the request in a thread."""
+        body = b""
+        more_body = True
+        while more_body:
+            message = await receive()
+            body += message.get("body", b"")
+            more_body = message.get("more_body", False)
+        headers = [
+            (name.decode("latin-1"), value.decode("latin-1"))
+            for name, value in scope["headers"]
+        ]
+        environ = EnvironBuilder(
+            path=scope["path"],
+            method=scope["method"],
+            query_string=scope["query_string"].decode("latin-1"),
+            headers=headers,
+            data=body,
+        ).get_environ()
+        if scope.get("client"):
+            environ["REMOTE_ADDR"] = scope["client"][0]
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            None, functools.partial(Response.from_app, self.app, environ, True)
+        )
+
+    async def lifespan(self, receive: Receive, send: Send) -> None:
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                if self.client is not None:
+                    await self.client.close()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+        response: Response
+        if scope["path"] != "/":
+            response = await self.forward(scope, receive)
+        else:
+            with self.app.app_context():
+                try:
+                    if scope["method"] not in ("GET", "HEAD", "POST"):
+                        raise MethodNotAllowed(["GET", "HEAD", "OPTIONS", "POST"])
+                    args = MultiDict(
+                        parse_qsl(
+                            scope["query_string"].decode("latin-1"),
+                            keep_blank_values=True,
+                        )
+                    )
+                    headers = Headers(
+                        [
+                            (name.decode("latin-1"), value.decode("latin-1"))
+                            for name, value in scope["headers"]
+                        ]
+                    )
+                    address = scope["client"][0] if scope.get("client") else None
+                    key = self.app.extensions["admission"].client_key(
+                        headers.get(API_KEY_HEADER), address
+                    )
+                    response = compress(
+                        await self.index(args, key),
+                        headers.get("Accept-Encoding"),
+                        current_app.config.get("COMPRESSION_THRESHOLD"),
+                    )
+                except HTTPException as e:
+                    response = e.get_response()
+                except Exception:
+                    current_app.logger.exception("Exception on %s", scope["path"])
+                    response = InternalServerError().get_response()
+        await send(
+            {
+                "type": "http.response.start",
+                "status": response.status_code,
+                "headers": [
+                    (name.lower().encode("latin-1"), value.encode("latin-1"))
+                    for name, value in response.headers.items()
+                ],
+            }
+        )
+        await send(
+            {
+                "type": "http.response.body",
+                "body": b"" if scope["method"] == "HEAD" else response.get_data(),
+            }
+        )
@@ -0,0 +1,107 @@
+"""
+Compression of large answers with brotli or gzip, as accepted by the client.
+
+Pages of abstracts shrink to a fifth of their size and less, small answers
+are sent as they are, as compressing them would not pay off.
+brotli is only offered, if the brotli package is installed.
+"""
+
+import gzip
+from typing import Dict, Optional
+
+from flask import Response, current_app, request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None  # type: ignore
+
+# Level 6 takes twice as long for 10% fewer bytes on a page of 100 abstracts
+GZIP_LEVEL = 5
+# Quality 11 compresses best, but is far too slow for answering requests
+BROTLI_QUALITY = 5
+
+
+def available_encodings() -> Dict[str, float]:
+    """The supported encodings with their preference if accepted equally."""
+    encodings = {"gzip": 1.0}
+    if brotli is not None:
+        encodings["br"] = 2.0
+    return encodings
+
+
+def choose_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """
+    Negotiate the encoding of the answer.
+
+    Parameters
+    ----------
+    accept_encoding : str, optional
+        The Accept-Encoding header of the request, e.g. 'gzip, br;q=0.9'.
+
+    Returns
+    -------
+    Optional[str]
+        The encoding with the highest weight, None if the answer should not
+        be compressed.
+    """
+    if not accept_encoding:
+        return None
+    encodings = available_encodings()
+    weights: Dict[str, float] = dict()
+    for part in accept_encoding.split(","):
+        name, _, parameters = part.partition(";")
+        name = name.strip().lower()
+        weight = 1.0
+        parameter = parameters.strip()
+        if parameter.startswith("q="):
+            try:
+                weight = float(parameter[2:])
+            except ValueError:
+                continue
+        if name == "*":
+            for encoding in encodings:
+                weights.setdefault(encoding, weight)
+        elif name in encodings:
+            weights[name] = weight
+    candidates = [encoding for encoding, weight in weights.items() if weight > 0]
+    if not candidates:
+        return None
+    return max(
+        candidates, key=lambda encoding: (weights[encoding], encodings[encoding])
+    )
+
+
+def compress(
+    response: Response, accept_encoding: Optional[str], threshold: Optional[int]
+) -> Response:
+    """
+    Compress the body of the response in place, if it is at least threshold bytes.
+    Compression is switched off, if threshold is None.
+    """
+    if threshold is None or response.direct_passthrough:
+        return response
+    if response.status_code != 200 or "Content-Encoding" in response.headers:
+        return response
+    response.vary.add("Accept-Encoding")
+    body = response.get_data()
+    if len(body) < threshold:
+        return response
+    encoding = choose_encoding(accept_encoding)
+    if encoding is None:
+        return response
+    if encoding == "br":
+        response.set_data(brotli.compress(body, quality=BROTLI_QUALITY))
+    else:
+        response.set_data(gzip.compress(body, compresslevel=GZIP_LEVEL))
+    response.headers["Content-Encoding"] = encoding
+    return response
+
+
+def compress_response(response: Response) -> Response:
+    """Compress the answers of the Flask application, see compress."""
+    return compress(
+        response,
+        request.headers.get("Accept-Encoding"),
+        current_app.config.get("COMPRESSION_THRESHOLD"),
+    )
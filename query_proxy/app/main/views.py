@@ -5,24 +5,127 @@ Created on Thu Oct 8 11:29:27 2020
 
 @author: Bernd Kampe
 """
+import cProfile
+import logging
+import math
+import random
 import re
-from typing import Dict, List, Tuple
+import time
+from datetime import datetime
+from typing import Dict, Generator, Hashable, List, Optional, Sequence, Tuple
 
 import elasticsearch
-from elasticsearch_dsl import Q
+from elasticsearch_dsl import Q, Search
 from elasticsearch_dsl.query import Query
 from elasticsearch_dsl.response import Response as EsResponse
 from flask import Response, abort, current_app, jsonify, request
+from werkzeug.exceptions import TooManyRequests
 
-from preprocessing.onto2trie import compact_id
+from preprocessing.onto2trie import compact_id, expand_id
+from query_proxy.admission import API_KEY_HEADER, Rejected
+from query_proxy.concept_stats import (
+    ConceptCounts,
+    get_concept_counts,
+    get_cooccurrences,
+)
+from query_proxy.lexicon import get_prefix_index, load_automaton, resolve_term
+from query_proxy.metrics import Timings
+from query_proxy.singleflight import SingleFlight
 
+from ..serialization import json_mimetype
 from . import main
 
 MAX_DOCUMENTS = 100
 INDEX_LIMIT = 1000
+MAX_COMPLETIONS = 100
+MAX_RELATED = 100
+# Number of journals and MeSH terms counted for the facets of a request
+FACET_SIZE = 20
 
+PARAMETERS = (
+    "start",
+    "end",
+    "size",
+    "sort",
+    "from_date",
+    "to_date",
+    "expand",
+    "resolve",
+    "facets",
+    "fields",
+    "ids_only",
+    "total",
+    "budget",
+    "request",
+)
+FLAGS = {"true": True, "1": True, "yes": True, "false": False, "0": False, "no": False}
+DATE_MATCHER = re.compile(r"^\d{4}(-\d{2}(-\d{2})?)?$")
+DATE_FORMATS = {4: "%Y", 7: "%Y-%m", 10: "%Y-%m-%d"}
+# Date math rounding to the precision of a date, by its length
+DATE_ROUNDING = {4: "/y", 7: "/M", 10: "/d"}
 
-def parse_request(request: str) -> List[Query]:
+# Fields of the documents returned by default
+RESPONSE_FIELDS = (
+    "title",
+    "author",
+    "abstract",
+    "journal",
+    "volume",
+    "issue",
+    "pages",
+    "year",
+    "date",
+    "pubdate",
+    "url",
+)
+
+# Identical requests arriving at the same time share one search
+IN_FLIGHT = SingleFlight()
+
+# Answering a request yields searches and receives their responses
+Steps = Generator[Search, EsResponse, bytes]
+
+
+def literal_queries(
+    term: str, field: str, trie_file: Optional[str] = None
+) -> Tuple[List[Query], List[Query]]:
+    """
+    Turn a literal part of a request into queries.
+
+    Parameters
+    ----------
+    term : str
+        A part of the request that is not an IRI
+    field : str
+        The field holding the concepts of the documents
+    trie_file : Optional[str]
+        Path to the automaton of the tagger. If given, the concepts mentioned
+        in the term are searched for like IRIs and only the rest of the term
+        is searched for in the full text.
+
+    Returns
+    -------
+    Tuple[List[Query], List[Query]]
+        Queries for the recognized concepts and the full text query, if any.
+    """
+    concepts = []
+    if trie_file:
+        candidates, term = resolve_term(trie_file, term)
+        for ids in candidates:
+            if len(ids) == 1:
+                concepts.append(Q({"term": {field: ids[0]}}))
+            else:
+                concepts.append(Q({"terms": {field: list(ids)}}))
+        if not term:
+            return concepts, []
+    return concepts, [
+        Q({"multi_match": {"query": term, "fields": ["title", "abstract"]}})
+    ]
+
+
+def parse_request(
+    request: str, expand: bool = False, trie_file: Optional[str] = None
+) -> List[Query]:
     """
     Parse a request string with the format
     IRI1a;IRI1b,IRI2a;IRI2b (...)
@@ -38,75 +141,81 @@ def parse_request(request: str) -> List[Query]:
     Parts of the request string that don't start with 'http://' will be
     interpreted as literal strings instead of concepts.
 
+    Entities are matched as filters on the 'concepts' keyword field,
+    which Elasticsearch can cache. Only characteristics and literal strings
+    contribute to the score.
+
     Parameters
     ----------
     request : str
         A specifically formatted list of concept tuples
+    expand : bool
+        Entities also match documents mentioning any of their subclasses.
+        Uses the 'ancestors' field instead of the 'concepts' field.
+    trie_file : Optional[str]
+        Recognize concepts in literal strings with this automaton,
+        see literal_queries(str, str, Optional[str]).
 
     Returns
     -------
     List[Query]
         Elasticsearch queries for each tuple
     """
+    field = "ancestors" if expand else "concepts"
     query_parts = []
-    must = []
-    should = []
-    parts = request.split(",")
-    for part in parts:
-        iris = part.split(";")
+    for part in request.split(","):
+        concepts = []
+        must = []
+        should = []
         first = True
-        for iri in iris:
+        for iri in part.split(";"):
             iri = iri.strip()
             if iri.startswith("http://"):
                 iri = compact_id(iri)
                 if first:
-                    must.append(
-                        Q(
-                            {
-                                "bool": {
-                                    "should": [
-                                        {"term": {"title": iri}},
-                                        {"term": {"abstract": iri}},
-                                    ],
-                                    "minimum_should_match": 1,
-                                }
-                            }
-                        )
-                    )
+                    concepts.append(Q({"term": {field: iri}}))
                     first = False
                 else:
                     should.append(Q({"term": {"title": iri}}))
                     should.append(Q({"term": {"abstract": iri}}))
             else:
-                must.append(
-                    Q({"multi_match": {"query": iri, "fields": ["title", "abstract"]}})
-                )
-        else:
-            if should:
-                query_parts.append(Q({"bool": {"must": must, "should": should}}))
-                should.clear()
-            else:
-                query_parts.append(Q({"bool": {"must": must}}))
-            must.clear()
+                filters, full_text = literal_queries(iri, field, trie_file)
+                concepts.extend(filters)
+                must.extend(full_text)
+        clauses: Dict[str, List[Query]] = {}
+        if concepts:
+            clauses["filter"] = concepts
+        if must:
+            clauses["must"] = must
+        if should:
+            clauses["should"] = should
+        query_parts.append(Q({"bool": clauses}))
     return query_parts
 
 
-def parse_request_fallback(request: str) -> List[Query]:
+def parse_request_fallback(
+    request: str, expand: bool = False, trie_file: Optional[str] = None
+) -> List[Query]:
     """
     A more lenient formulation of the search request.
     Only entities are considered and each term is marked optional.
-    Contrast with parse_request(str).
+    Contrast with parse_request(str, bool, Optional[str]).
 
     Parameters
     ----------
     request : str
         A specifically formatted list of concept tuples
+    expand : bool
+        Entities also match documents mentioning any of their subclasses.
+    trie_file : Optional[str]
+        Recognize concepts in literal strings with this automaton.
 
     Returns
     -------
     List[Query]
         Elasticsearch queries for each concept
     """
+    field = "ancestors" if expand else "concepts"
     query_parts = []
     parts = request.split(",")
     for part in parts:
@@ -117,24 +226,11 @@ def parse_request_fallback(request: str) -> List[Query]:
             if iri.startswith("http://"):
                 iri = compact_id(iri)
                 if first:
-                    query_parts.append(
-                        Q(
-                            {
-                                "bool": {
-                                    "should": [
-                                        {"term": {"title": iri}},
-                                        {"term": {"abstract": iri}},
-                                    ],
-                                    "minimum_should_match": 1,
-                                }
-                            }
-                        )
-                    )
+                    query_parts.append(Q({"term": {field: iri}}))
                     first = False
             else:
-                query_parts.append(
-                    Q({"multi_match": {"query": iri, "fields": ["title", "abstract"]}})
-                )
+                filters, full_text = literal_queries(iri, field, trie_file)
+                query_parts.extend(filters + full_text)
     return query_parts
 
 
@@ -145,7 +241,7 @@ def parse_args(args: Dict) -> Tuple[Dict, List]:
     Parameters
     ----------
     args : Dict
-        The API accepts five parameters: "start", "end", "size", "sort" and "request"
+        The API accepts the parameters listed in PARAMETERS.
 
         The 'start' parameter is zero-indexed, so 0 means first document.
         It is mapped to the 'from' parameter in Elasticsearch.
@@ -160,6 +256,33 @@ def parse_args(args: Dict) -> Tuple[Dict, List]:
         'asc'ending or 'desc'ending order by date.
         If no 'sort' parameter is specified, the documents are ranked by score instead.
 
+        The 'from_date' and 'to_date' parameters restrict the publication date
+        of the documents. Both are inclusive and have the form YYYY, YYYY-MM
+        or YYYY-MM-DD, e.g. 'to_date=2020' includes all of 2020.
+
+        The 'expand' parameter ('true' or 'false') lets concepts also match
+        documents that only mention their subclasses.
+
+        The 'resolve' parameter ('true' or 'false') lets concepts named in
+        literal strings be searched for like IRIs.
+
+        The 'facets' parameter ('true' or 'false') returns the number of
+        matching documents per year, journal and MeSH term instead of the
+        documents themselves.
+
+        The 'fields' parameter is a comma separated list of the fields to return
+        for every document, each of them listed in the 'fields' of config.json.
+
+        The 'ids_only' parameter ('true' or 'false') returns only the IDs of the
+        documents.
+
+        The 'total' parameter ('true' or 'false') counts all matching documents.
+        As counting is expensive for common terms, it is off by default.
+
+        The 'budget' parameter is the time in milliseconds the searches may take.
+        It defaults to the 'time_budget' of config.json and is limited by its
+        'max_time_budget'.
+
         The 'request' parameter contains the search terms.
 
     Returns
@@ -173,10 +296,11 @@ def parse_args(args: Dict) -> Tuple[Dict, List]:
     query = {}
     warnings = []
     for key in args:
-        if key not in ("start", "end", "size", "sort", "request"):
+        if key not in PARAMETERS:
+            expected = ", ".join(f"'{parameter}'" for parameter in PARAMETERS[:-1])
             warnings.append(
-                f"Found unknown parameter '{key}'. Expected: 'start', 'end',"
-                + " 'size', 'sort' or 'request'."
+                f"Found unknown parameter '{key}'. Expected: {expected}"
+                + f" or '{PARAMETERS[-1]}'."
             )
             continue
         if key == "request":
@@ -244,52 +368,178 @@ def parse_args(args: Dict) -> Tuple[Dict, List]:
                 warnings.append(
                     f"Unknown sorting parameter '{sort}'. Expected 'asc' or 'desc'."
                 )
+            continue
+        if key in ("from_date", "to_date"):
+            try:
+                query[key] = parse_date(args[key])
+            except ValueError as e:
+                warnings.append(f"Could not parse '{key}' parameter: {e.args[0]}")
+            continue
+        if key == "budget":
+            try:
+                budget = int(args["budget"])
+                if budget <= 0:
+                    warnings.append(
+                        f"'budget' has to be at least 1, was: {budget}. Ignoring it."
+                    )
+                else:
+                    query["budget"] = budget
+            except ValueError as e:
+                warnings.append(f"Could not parse 'budget' parameter: {e.args[0]}")
+            continue
+        if key == "fields":
+            fields = []
+            for field in args["fields"].split(","):
+                field = field.strip()
+                if field in current_app.config["FIELDS"]:
+                    if field not in fields:
+                        fields.append(field)
+                elif field:
+                    warnings.append(f"Unknown field '{field}'. Ignoring it.")
+            if fields:
+                query["fields"] = tuple(fields)
+            else:
+                warnings.append("No valid field in 'fields' parameter.")
+            continue
+        if key in ("expand", "resolve", "facets", "ids_only", "total"):
+            flag = args[key].strip().lower()
+            if flag in FLAGS:
+                query[key] = FLAGS[flag]
+            else:
+                warnings.append(
+                    f"Unknown value of '{key}' parameter '{flag}'."
+                    + " Expected 'true' or 'false'."
+                )
     if "start" in query and "end" in query:
         if query["end"] < query["start"]:
             warnings.append(
                 f"'start' was larger than 'end': {start} > {end}. Switching values."
             )
             query["end"], query["start"] = query["start"], query["end"]
+    if query.get("ids_only") and "fields" in query:
+        warnings.append("'ids_only' and 'fields' specified. Ignoring 'fields'.")
+        del query["fields"]
+    if "from_date" in query and "to_date" in query:
+        # Dates of different precision are compared by their common prefix,
+        # e.g. from 2020-05 to 2020 is a valid range
+        length = min(len(query["from_date"]), len(query["to_date"]))
+        if query["to_date"][:length] < query["from_date"][:length]:
+            warnings.append(
+                f"'from_date' was later than 'to_date': {query['from_date']} > "
+                + f"{query['to_date']}. Switching values."
+            )
+            query["from_date"], query["to_date"] = query["to_date"], query["from_date"]
     return query, warnings
 
 
+def parse_date(date: str) -> str:
+    """
+    Check that a date has the form YYYY, YYYY-MM or YYYY-MM-DD.
+
+    Raises
+    ------
+    ValueError
+        If the date has a different form or does not exist.
+    """
+    date = date.strip()
+    if DATE_MATCHER.match(date) is None:
+        raise ValueError(f"Expected YYYY, YYYY-MM or YYYY-MM-DD, was: '{date}'")
+    try:
+        datetime.strptime(date, DATE_FORMATS[len(date)])
+    except ValueError:
+        raise ValueError(f"'{date}' is not a valid date")
+    return date
+
+
+def rounded_date(date: str) -> str:
+    """The date math expression of a date rounded to its own precision."""
+    return f"{date}||{DATE_ROUNDING[len(date)]}"
+
+
 def remove_annotations(text: str) -> str:
     annotation_matcher = current_app.config["ANNOTATION_MATCHER"]
     return re.subn(annotation_matcher, r"\g<1>", text)[0]
 
 
-def prepare_response(es_response: EsResponse) -> List[Dict[str, str]]:
+@main.route("/related", methods=["GET"])
+def related() -> Response:
+    """
+    The concepts most often mentioned together with the given ones.
+
+    The 'concepts' parameter is a comma separated list of IRIs.
+    The 'size' parameter limits the number of concepts, at most MAX_RELATED.
+    Every concept is returned with the number of documents it shares with
+    the given concepts, summed over all of them.
+    """
+    matrix_file = current_app.config["COOCCURRENCES"]
+    if not matrix_file:
+        abort(503, description="Related concepts have not been configured.")
+    if "concepts" not in request.args:
+        abort(400, description="Expected 'concepts' parameter.")
+    warnings: List[str] = []
+    size = parse_size(request.args, MAX_RELATED, "concepts", warnings)
+    concepts = [
+        iri.strip() for iri in request.args["concepts"].split(",") if iri.strip()
+    ]
+    if not concepts:
+        abort(400, description="Expected at least one concept.")
+    matrix = get_cooccurrences(matrix_file)
+    if matrix is None:
+        current_app.logger.error("Co-occurrence matrix %s not found", matrix_file)
+        abort(503, description="Related concepts are not available.")
+    known = []
+    for iri in concepts:
+        concept = compact_id(iri)
+        if concept in matrix.positions:
+            known.append(concept)
+        else:
+            warnings.append(f"Concept {iri} does not occur in any document.")
+    return jsonify(
+        {
+            "concepts": concepts,
+            "related": [
+                {"concept": expand_id(concept), "documents": documents}
+                for concept, documents in matrix.related(known, size)
+            ],
+            "warnings": warnings,
+        }
+    )
+
+
+def prepare_response(
+    es_response: EsResponse, fields: Sequence[str] = RESPONSE_FIELDS
+) -> List[Dict[str, str]]:
     hits = []
-    if es_response.hits.total.value != 0:
-        for r in es_response:
-            hit = {"id": r.meta.id}
-            if "title" in r:
-                hit["title"] = remove_annotations(r.title)
-            if "author" in r:
-                hit["author"] = "; ".join(r.author)
-            if "abstract" in r:
-                hit["abstract"] = remove_annotations(r.abstract)
-            if "journal" in r:
-                hit["journal"] = r.journal
-            if "volume" in r:
-                hit["volume"] = r.volume
-            if "issue" in r:
-                hit["issue"] = r.issue
-            if "pages" in r:
-                hit["pages"] = r.pages
-            if "year" in r:
-                hit["year"] = r.year
-            if "date" in r:
-                hit["date"] = r.date
-            if "url" in r:
-                hit["url"] = r.url
-            hits.append(hit)
+    for r in es_response:
+        hit = {"id": r.meta.id}
+        source = r.to_dict()
+        for field in fields:
+            if field not in source:
+                continue
+            if field in ("title", "abstract"):
+                hit[field] = remove_annotations(source[field])
+            elif field == "author":
+                hit[field] = "; ".join(source[field])
+            else:
+                hit[field] = source[field]
+        hits.append(hit)
     return hits
 
 
-@main.route("/", methods=["GET", "POST"])
-def index() -> Response:
-    query, warnings = parse_args(request.args)
+def prepare_query(args: Dict) -> Tuple[Dict, List]:
+    """
+    Parse the parameters of a request and resolve 'start', 'end' and 'size'
+    into a range of documents.
+
+    Aborts with 400: Bad Request, if the request is missing or
+    asks for more than MAX_DOCUMENTS documents.
+
+    Returns
+    -------
+    Tuple[Dict, List]
+        The parsed parameters and the warnings, see parse_args(Dict).
+    """
+    query, warnings = parse_args(args)
 
     # raise 400: Bad Request
     if "request" not in query:
@@ -354,14 +604,87 @@ def index() -> Response:
         if query["start"] == 0:  # This is the default anyway
             del query["start"]
 
-    original_request = query["request"]
-    current_app.logger.info("Original request: %s", original_request)
-    query["request"] = parse_request(query["request"])
-    current_app.logger.debug("Processed request: %s", query["request"])
+    max_budget = current_app.config["MAX_TIME_BUDGET"]
+    budget = query.get("budget", current_app.config["TIME_BUDGET"])
+    if max_budget and (budget is None or budget > max_budget):
+        if "budget" in query:
+            warnings.append(
+                "The time budget is not allowed to be larger than "
+                + f"{max_budget} ms. Set to {max_budget} ms."
+            )
+        budget = max_budget
+    if budget:
+        query["budget"] = budget
+
+    if query.get("resolve"):
+        trie_file = current_app.config["AUTOMATON"]
+        available = bool(trie_file)
+        if available:
+            try:
+                # Loaded once per process, later requests find it in memory
+                load_automaton(trie_file)
+            except OSError as e:
+                current_app.logger.error(e)
+                available = False
+        if not available:
+            warnings.append("Concepts in literal strings can not be recognized.")
+            del query["resolve"]
+
+    return query, warnings
+
+
+def build_search(
+    queries: List[Query],
+    operator: str,
+    query: Dict,
+    timeout: Optional[int] = None,
+    terminate_after: Optional[int] = None,
+) -> Search:
+    """
+    Combine the queries with the boolean operator ('must' or 'should')
+    and apply sorting and the range of documents of the parsed parameters.
+
+    The timeout in milliseconds and the number of documents per shard
+    after which the search stops are passed on to Elasticsearch.
+    """
+    clauses: Dict = {operator: queries}
+    if "from_date" in query or "to_date" in query:
+        # Dates are rounded to their precision, down for 'gte' and up for 'lte',
+        # so that both bounds are inclusive, e.g. 'lte' 2020 ends on 2020-12-31
+        date_range = {"format": "yyyy-MM-dd||yyyy-MM||yyyy"}
+        if "from_date" in query:
+            date_range["gte"] = rounded_date(query["from_date"])
+        if "to_date" in query:
+            date_range["lte"] = rounded_date(query["to_date"])
+        clauses["filter"] = [Q({"range": {"pubdate": date_range}})]
+        if operator == "should":
+            clauses["minimum_should_match"] = 1
     prepared_search = current_app.config["SEARCH"]
-    prepared_search = prepared_search.query(Q({"bool": {"must": query["request"]}}))
+    prepared_search = prepared_search.query(Q({"bool": clauses}))
+    if timeout is not None:
+        prepared_search = prepared_search.extra(timeout=f"{timeout}ms")
+    if terminate_after is not None:
+        prepared_search = prepared_search.extra(terminate_after=terminate_after)
+    if query.get("facets"):
+        # Only the aggregations are returned, the range of documents is ignored
+        # The aggregations visit every match anyway, so the total is exact
+        prepared_search = prepared_search.extra(size=0, track_total_hits=True)
+        # Elasticsearch caches the aggregations of identical requests per shard
+        # until the next refresh, e.g. for clients paging through the documents
+        prepared_search = prepared_search.params(request_cache=True)
+        prepared_search.aggs.bucket("year", "histogram", field="year", interval=1)
+        prepared_search.aggs.bucket(
+            "journal", "terms", field="journal.raw", size=FACET_SIZE
+        )
+        prepared_search.aggs.bucket("mesh", "terms", field="mesh", size=FACET_SIZE)
+        return prepared_search
+    prepared_search = prepared_search.extra(track_total_hits=query.get("total", False))
+    if query.get("ids_only"):
+        prepared_search = prepared_search.source(False)
+    elif "fields" in query:
+        prepared_search = prepared_search.source(list(query["fields"]))
     if "sort" in query:
-        prepared_search = prepared_search.sort({"date": {"order": query["sort"]}})
+        prepared_search = prepared_search.sort({"pubdate": {"order": query["sort"]}})
     if "start" in query and "size" in query:
         prepared_search = prepared_search[
             query["start"] : query["start"] + query["size"]
@@ -370,39 +693,51 @@ def index() -> Response:
         prepared_search = prepared_search[query["start"] : query["start"] + 10]
     elif "size" in query:
         prepared_search = prepared_search[: query["size"]]
+    return prepared_search
+
+
+def execute(prepared_search: Search) -> EsResponse:
     try:
-        es_response = prepared_search.execute()
+        return prepared_search.execute()
     except elasticsearch.exceptions.NotFoundError as e:
         current_app.logger.error(e)
         abort(404, description="Index not found.")
-    answer = {}
-    answer["hits"] = prepare_response(es_response)
 
-    # We switch to ORing queries, if ANDing did not result in any hits
-    if not answer["hits"]:
-        query["request"] = parse_request_fallback(original_request)
-        prepared_search = current_app.config["SEARCH"]
-        prepared_search = prepared_search.query(
-            Q({"bool": {"should": query["request"]}})
-        )
-        if "sort" in query:
-            prepared_search = prepared_search.sort({"date": {"order": query["sort"]}})
-        if "start" in query and "size" in query:
-            prepared_search = prepared_search[
-                query["start"] : query["start"] + query["size"]
-            ]
-        elif "start" in query:
-            prepared_search = prepared_search[query["start"] : query["start"] + 10]
-        elif "size" in query:
-            prepared_search = prepared_search[: query["size"]]
-        try:
-            es_response = prepared_search.execute()
-        except elasticsearch.exceptions.NotFoundError as e:
-            current_app.logger.error(e)
-            abort(404, description="Index not found.")
-        answer = {}
-        answer["hits"] = prepare_response(es_response)
 
+def prepare_facets(es_response: EsResponse) -> Dict[str, List[Dict]]:
+    """The number of documents per year, journal and MeSH term."""
+    facets = {}
+    for name in ("year", "journal", "mesh"):
+        facets[name] = [
+            {"value": bucket.key, "documents": bucket.doc_count}
+            for bucket in es_response.aggregations[name].buckets
+            if bucket.doc_count > 0
+        ]
+    # Years are bucketed as floating point numbers
+    for bucket in facets["year"]:
+        bucket["value"] = int(bucket["value"])
+    return facets
+
+
+def is_partial(es_response: EsResponse) -> bool:
+    """Whether Elasticsearch has stopped before finding all documents."""
+    return bool(
+        getattr(es_response, "timed_out", False)
+        or getattr(es_response, "terminated_early", False)
+    )
+
+
+def make_answer(
+    query: Dict,
+    original_request: str,
+    hits: List[Dict[str, str]],
+    warnings: List,
+    total: Optional[Dict] = None,
+) -> Dict:
+    answer: Dict = {}
+    answer["hits"] = hits
+    if total is not None:
+        answer["total"] = total
     # answer["parameters"] = query
     answer["request"] = original_request
     if "start" in query:
@@ -414,5 +749,385 @@ def index() -> Response:
     if "sort" in query:
         answer["sort"] = query["sort"]
     answer["warnings"] = warnings
+    return answer
+
+
+def make_facets_answer(
+    original_request: str, es_response: Optional[EsResponse], warnings: List
+) -> Dict:
+    answer: Dict = {}
+    if es_response is None:
+        # No search has run within the time budget
+        answer["facets"] = {"year": [], "journal": [], "mesh": []}
+        answer["documents"] = 0
+    else:
+        answer["facets"] = prepare_facets(es_response)
+        answer["documents"] = es_response.hits.total.value
+    answer["request"] = original_request
+    answer["warnings"] = warnings
+    return answer
+
+
+def query_key(query: Dict, warnings: List) -> Hashable:
+    """
+    The canonical form of a parsed request.
+    Requests with the same key receive the same answer.
+    """
+    request = ",".join(
+        ";".join(iri.strip() for iri in part.split(";"))
+        for part in query["request"].split(",")
+    )
+    parameters = tuple(
+        sorted((key, value) for key, value in query.items() if key != "request")
+    )
+    return (request, parameters, tuple(warnings))
+
+
+def order_by_selectivity(
+    request: str, counts: ConceptCounts, expand: bool = False
+) -> Tuple[str, Dict[str, int]]:
+    """
+    Reorder the parts of a request from the rarest to the most common entity.
+
+    Returns
+    -------
+    Tuple[str, Dict[str, int]]
+        The reordered request and the number of documents per entity.
+        Parts without an entity are moved to the end.
+    """
+    documents: Dict[str, int] = dict()
+    ranked = []
+    for part in request.split(","):
+        rank = float("inf")
+        for iri in part.split(";"):
+            iri = iri.strip()
+            if iri.startswith("http://"):
+                concept = compact_id(iri)
+                documents[concept] = counts.count(concept, expand)
+                rank = documents[concept]
+                break
+        ranked.append((rank, part))
+    ranked.sort(key=lambda pair: pair[0])
+    return ",".join(part for _, part in ranked), documents
+
+
+def sample_debug() -> bool:
+    """Whether this request dumps its queries, see DEBUG_QUERY_SAMPLE_RATE."""
+    rate = float(current_app.config.get("DEBUG_QUERY_SAMPLE_RATE") or 0.0)
+    return (
+        rate > 0
+        and current_app.logger.isEnabledFor(logging.DEBUG)
+        and random.random() < rate
+    )
+
+
+def record_search(
+    parameters: Dict, timings: Timings, seconds: float, shared: bool
+) -> None:
+    """
+    Add a search to the metrics, the request log and, if it was slow,
+    to the slow log.
+
+    Parameters
+    ----------
+    parameters : Dict
+        The parsed parameters of the request, before answer_request
+        replaced the request with the parsed queries.
+    shared : bool
+        Whether the answer of an identical request has been returned.
+    """
+    current_app.extensions["metrics"].observe(timings, shared)
+    if current_app.logger.isEnabledFor(logging.INFO):
+        current_app.logger.info(
+            "search",
+            extra={
+                "fields": {
+                    "request": parameters.get("request"),
+                    "parameters": {
+                        key: value
+                        for key, value in parameters.items()
+                        if key != "request"
+                    },
+                    "milliseconds": round(seconds * 1000, 1),
+                    "stages": {
+                        stage: round(value * 1000, 1)
+                        for stage, value in timings.stages.items()
+                    },
+                    "events": sorted(timings.events),
+                    "shared": shared,
+                }
+            },
+        )
+    slow_log = current_app.extensions["slow_log"]
+    if slow_log is not None and not shared:
+        slow_log.observe(parameters, timings, seconds)
+
+
+def timed_search(
+    prepared_search: Search, timings: Timings
+) -> Generator[Search, EsResponse, EsResponse]:
+    """Yield the search and measure the time until its response is sent back."""
+    start = time.perf_counter()
+    es_response = yield prepared_search
+    timings.add("elasticsearch", time.perf_counter() - start)
+    timings.add("took", getattr(es_response, "took", 0) / 1000)
+    timings.searches.append((prepared_search, es_response))
+    return es_response
+
+
+def answer_request(
+    query: Dict, warnings: List, timings: Optional[Timings] = None
+) -> Steps:
+    """
+    Search for the documents and return the serialized answer.
+
+    The searches are yielded and their responses are expected to be sent back,
+    so that the same steps can be executed by index() as well as
+    by the asynchronous application.
+    The durations of the stages are added to timings.
+    """
+    if timings is None:
+        timings = Timings()
+    original_request = query["request"]
+    expand = query.get("expand", False)
+    trie_file = current_app.config["AUTOMATON"] if query.get("resolve") else None
+
+    ordered_request = original_request
+    strict = True
+    counts = None
+    if current_app.config["CONCEPT_COUNTS"]:
+        counts = get_concept_counts(current_app.config["CONCEPT_COUNTS"])
+    if counts is not None:
+        ordered_request, documents = order_by_selectivity(
+            original_request, counts, expand
+        )
+        # The strict query can not have any hits, if all documents have been counted
+        if counts.complete and 0 in documents.values():
+            strict = False
+            frequencies = ", ".join(f"{c}: {n}" for c, n in documents.items())
+            warnings.append(
+                "No document contains all concepts. Documents per concept: "
+                + frequencies
+            )
 
-    return jsonify(answer)
+    fields: Sequence[str] = query.get("fields", RESPONSE_FIELDS)
+    if query.get("ids_only"):
+        fields = ()
+    # The strict query may take half of the budget, the fallback the rest
+    budget = query.get("budget")
+    deadline = None
+    if budget is not None:
+        deadline = time.monotonic() + budget / 1000
+    partial = False
+
+    hits: List[Dict[str, str]] = []
+    matched = False
+    # Stays None, if neither search has run
+    es_response: Optional[EsResponse] = None
+    if strict:
+        with timings.measure("build"):
+            query["request"] = parse_request(ordered_request, expand, trie_file)
+            if sample_debug():
+                current_app.logger.debug("Processed request: %s", query["request"])
+            timeout = None if budget is None else max(budget // 2, 1)
+            prepared_search = build_search(query["request"], "must", query, timeout)
+        es_response = yield from timed_search(prepared_search, timings)
+        partial = is_partial(es_response)
+        with timings.measure("serialize"):
+            hits = prepare_response(es_response, fields)
+        if query.get("facets"):
+            matched = es_response.hits.total.value > 0
+        else:
+            matched = len(hits) > 0
+
+    # We switch to ORing queries, if ANDing did not result in any hits
+    if not matched:
+        timeout = None
+        if deadline is not None:
+            timeout = int((deadline - time.monotonic()) * 1000)
+        if timeout is not None and timeout <= 0:
+            warnings.append(
+                "The time budget was used up before the fallback search could run."
+            )
+        else:
+            start = time.perf_counter()
+            timings.events.add("fallback")
+            with timings.measure("build"):
+                query["request"] = parse_request_fallback(
+                    original_request, expand, trie_file
+                )
+                prepared_search = build_search(
+                    query["request"],
+                    "should",
+                    query,
+                    timeout,
+                    current_app.config["TERMINATE_AFTER"],
+                )
+            es_response = yield from timed_search(prepared_search, timings)
+            timings.add("fallback", time.perf_counter() - start)
+            with timings.measure("serialize"):
+                hits = prepare_response(es_response, fields)
+            partial = is_partial(es_response)
+    if partial:
+        warnings.append(
+            "The search was stopped early to stay within the time budget."
+            + " The results may be incomplete."
+        )
+
+    if query.get("facets"):
+        if es_response is None or es_response.hits.total.value == 0:
+            timings.events.add("zero_hits")
+    elif not hits:
+        timings.events.add("zero_hits")
+    with timings.measure("serialize"):
+        if query.get("facets"):
+            answer = make_facets_answer(original_request, es_response, warnings)
+        else:
+            total = None
+            if query.get("total"):
+                total = (
+                    {"value": 0, "relation": "eq"}
+                    if es_response is None
+                    else es_response.hits.total.to_dict()
+                )
+            answer = make_answer(query, original_request, hits, warnings, total)
+        return jsonify(answer).get_data()
+
+
+def profiled(steps: Steps, profile: Optional[cProfile.Profile]) -> Steps:
+    """The same steps, profiled without the time spent waiting for the searches."""
+    if profile is None:
+        return (yield from steps)
+    es_response: Optional[EsResponse] = None
+    first = True
+    while True:
+        profile.enable()
+        try:
+            prepared_search = next(steps) if first else steps.send(es_response)
+        except StopIteration as result:
+            return result.value
+        finally:
+            profile.disable()
+        first = False
+        es_response = yield prepared_search
+
+
+def finish_profile(profile: cProfile.Profile, args: Dict, shared: bool) -> None:
+    """Save the profile of a sampled search, unless another request ran it."""
+    profiler = current_app.extensions["profiler"]
+    if shared:
+        profiler.discard(profile)
+    else:
+        profiler.save(profile, "request-" + args.get("request", ""))
+
+
+def run(steps: Steps) -> bytes:
+    """Execute the searches of answer_request(Dict, List) one after another."""
+    try:
+        prepared_search = next(steps)
+        while True:
+            prepared_search = steps.send(execute(prepared_search))
+    except StopIteration as result:
+        return result.value
+
+
+def too_many_requests(rejected: Rejected) -> TooManyRequests:
+    """429: Too Many Requests, with the seconds to wait in the Retry-After header."""
+    return TooManyRequests(
+        str(rejected), retry_after=max(math.ceil(rejected.retry_after), 1)
+    )
+
+
+@main.route("/", methods=["GET", "POST"])
+def index() -> Response:
+    admission = current_app.extensions["admission"]
+    key = admission.client_key(request.headers.get(API_KEY_HEADER), request.remote_addr)
+    try:
+        admission.acquire(key)
+    except Rejected as e:
+        raise too_many_requests(e)
+    timings = Timings()
+    begin = time.perf_counter()
+    profiler = current_app.extensions["profiler"]
+    profile = profiler.sample()
+    shared = False
+    try:
+        with timings.measure("parse"):
+            query, warnings = prepare_query(request.args)
+        # answer_request replaces the request with the parsed queries
+        parameters = dict(query)
+        start = time.perf_counter()
+        body, shared = IN_FLIGHT.do(
+            query_key(query, warnings),
+            lambda: run(profiled(answer_request(query, warnings, timings), profile)),
+        )
+    finally:
+        admission.release(key)
+        if profile is not None:
+            finish_profile(profile, request.args, shared)
+    if shared:
+        timings.add("wait", time.perf_counter() - start)
+    record_search(parameters, timings, time.perf_counter() - begin, shared)
+    response = current_app.response_class(body, mimetype=json_mimetype())
+    response.headers["Server-Timing"] = timings.server_timing()
+    return response
+
+
+@main.route("/metrics", methods=["GET"])
+def metrics() -> Response:
+    """The metrics of the searches in the text format of Prometheus."""
+    text = current_app.extensions["metrics"].render(
+        current_app.extensions["admission"].statistics()
+    )
+    return current_app.response_class(
+        text, content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+def parse_size(args: Dict, maximum: int, items: str, warnings: List[str]) -> int:
+    """Parse the 'size' parameter of the lookup endpoints, 10 by default."""
+    size = 10
+    if "size" in args:
+        try:
+            size = int(args["size"])
+            if size > maximum:
+                warnings.append(
+                    f"The number of {items} to return is not allowed to be larger "
+                    + f"than {maximum}. Set to {maximum}."
+                )
+                size = maximum
+            elif size <= 0:
+                warnings.append(f"'size' has to be at least 1, was: {size}. Set to 10.")
+                size = 10
+        except ValueError as e:
+            warnings.append(f"Could not parse 'size' parameter: {e.args[0]}")
+    return size
+
+
+@main.route("/autocomplete", methods=["GET"])
+def autocomplete() -> Response:
+    """
+    Complete the beginning of a label to concepts.
+
+    The 'prefix' parameter is the text typed so far, case is ignored.
+    The 'size' parameter limits the number of labels, at most MAX_COMPLETIONS.
+    Every label is returned with the IRIs of all of its concepts.
+    """
+    trie_file = current_app.config["AUTOMATON"]
+    if not trie_file:
+        abort(503, description="Autocompletion has not been configured.")
+    if "prefix" not in request.args:
+        abort(400, description="Expected 'prefix' parameter.")
+    warnings: List[str] = []
+    size = parse_size(request.args, MAX_COMPLETIONS, "labels", warnings)
+    try:
+        prefix_index = get_prefix_index(trie_file)
+    except FileNotFoundError as e:
+        current_app.logger.error(e)
+        abort(503, description="Autocompletion is not available.")
+    prefix = request.args["prefix"].strip()
+    completions = [
+        {"label": label, "concepts": [expand_id(concept) for concept in concepts]}
+        for label, concepts in prefix_index.complete(prefix, size)
+    ]
+    return jsonify({"prefix": prefix, "completions": completions, "warnings": warnings})
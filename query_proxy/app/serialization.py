@@ -0,0 +1,72 @@
+"""
+Serialization of the answers with orjson, if it is installed.
+
+orjson writes a page of 100 abstracts several times faster than the json module
+used by Flask. The output is compact UTF-8 instead of ASCII with escapes,
+keys are sorted like before.
+"""
+
+from typing import Any, Union, cast
+
+from flask import Flask, Response, current_app
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None  # type: ignore
+
+# Names of the serializers for the 'json_serializer' entry of config.json
+SERIALIZERS = ("orjson", "json")
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    def _options(self, indent: bool = False) -> int:
+        options = 0
+        if self.sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        if indent:
+            options |= orjson.OPT_INDENT_2
+        return options
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        options = self._options(indent="indent" in kwargs)
+        return orjson.dumps(obj, default=self.default, option=options).decode()
+
+    def loads(self, s: Union[str, bytes], **kwargs: Any) -> Any:
+        return orjson.loads(s)
+
+    def response(self, *args: Any, **kwargs: Any) -> Response:
+        """Same as DefaultJSONProvider.response, without decoding and encoding again."""
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        options = self._options(indent) | orjson.OPT_APPEND_NEWLINE
+        return cast(Flask, self._app).response_class(
+            orjson.dumps(obj, default=self.default, option=options),
+            mimetype=self.mimetype,
+        )
+
+
+def json_mimetype() -> str:
+    """The mimetype of the answers of the current application."""
+    return cast(DefaultJSONProvider, current_app.json).mimetype
+
+
+def init_serializer(app: Flask) -> None:
+    """
+    Replace the JSON provider of the application with the configured one.
+    The json module is used, if orjson is not installed.
+    """
+    serializer = app.config.get("JSON_SERIALIZER") or "orjson"
+    if serializer not in SERIALIZERS:
+        raise ValueError(
+            f"Unknown JSON serializer '{serializer}'. Expected one of: "
+            + ", ".join(SERIALIZERS)
+        )
+    if serializer == "orjson":
+        if orjson is None:
+            app.logger.warning(
+                "orjson is not installed, answers are serialized slowly."
+            )
+        else:
+            app.json = OrjsonProvider(app)
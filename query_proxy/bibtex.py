@@ -11,26 +11,43 @@ import logging
 import os
 import shutil
 import sys
+from contextlib import ExitStack
 from datetime import datetime
 from pathlib import Path
-from typing import Any, Dict, Iterator
+from typing import Any, Dict, Iterator, Optional, Set, Tuple
 from urllib.parse import quote
 
 import elasticsearch
 import spacy
 from elasticsearch.exceptions import ConnectionTimeout
-from elasticsearch.helpers import streaming_bulk
 from tqdm import tqdm
 
 from parsers import bibtex
-from query_proxy.elastic_import import INDEX, setup
-from query_proxy.tagger import Tagger
+from query_proxy.bulk import DEAD_LETTER_FILE, BulkSink
+from query_proxy.concept_stats import ConceptStatistics
+from query_proxy.elastic_import import INDEX, bulk_load, document_count, setup
+from query_proxy.profiling import ENV_DIRECTORY, EVERY_ARCHIVE, Profiler
+from query_proxy.progress import PROGRESS_FILE, Checkpoint, ProgressStore
+from query_proxy.tagger import Tagger, concept_ids, expand_concepts, load_ancestors
+from query_proxy.telemetry import Telemetry
 
 logger = logging.getLogger("bibtex")
 
 
 class BibtexProcessor:
-    def __init__(self, trie_file: Path):
+    def __init__(
+        self,
+        trie_file: Path,
+        ancestor_file: Optional[Path] = None,
+        counts_file: Optional[Path] = None,
+        cooccurrence_file: Optional[Path] = None,
+        telemetry: Optional[Telemetry] = None,
+        profiler: Optional[Profiler] = None,
+        progress_file: Path = PROGRESS_FILE,
+        bulk: Optional[BulkSink] = None,
+        bulk_load: bool = False,
+        force_merge: Optional[int] = None,
+    ):
         self.logger = logging.getLogger("bibtex")
         dt = datetime.now()
         fh = logging.FileHandler(f"{dt.strftime('%Y%m%d-%H%M%S')}.log")
@@ -41,6 +58,18 @@ class BibtexProcessor:
         fh.setFormatter(formatter)
         self.logger.addHandler(fh)
         self.nlp = Tagger.setup_pipeline(trie_file)
+        self.ancestors: Dict[str, Tuple[str, ...]] = dict()
+        if ancestor_file is not None:
+            self.ancestors = load_ancestors(ancestor_file)
+        self.statistics = ConceptStatistics(counts_file, cooccurrence_file)
+        self.telemetry = telemetry if telemetry is not None else Telemetry()
+        self.profiler = (
+            profiler if profiler is not None else Profiler.from_env(every=EVERY_ARCHIVE)
+        )
+        self.progress = ProgressStore(progress_file)
+        self.bulk = bulk if bulk is not None else BulkSink()
+        self.bulk_load = bulk_load
+        self.force_merge = force_merge
 
     def process_archives(self, path: Path) -> None:
         cleanup = None
@@ -49,6 +78,8 @@ class BibtexProcessor:
             raise FileNotFoundError(f"Directory {path} does not exist.")
         try:
             conn = setup()
+            if self.statistics.counts is not None:
+                self.statistics.begin(document_count(conn))
         except (
             elasticsearch.exceptions.RequestError,
             elasticsearch.exceptions.ConnectionError,
@@ -57,47 +88,102 @@ class BibtexProcessor:
             print("There have been errors. Please check the log.", file=sys.stderr)
             return
         bibrefs = path.glob("*.bib")
-        for bibref in tqdm(bibrefs):
-            total, _, free = shutil.disk_usage(".")
-            if free / total < 0.05:
-                self.logger.error(
-                    "Only %s percent of disk space left. Will not attempt to import %s."
-                    + " Stopping now.",
-                    "{:.2f}".format(free / total * 100),
-                    bibref,
-                )
-                break
+        with ExitStack() as stack:
+            if self.bulk_load:
+                stack.enter_context(bulk_load(conn, force_merge=self.force_merge))
+            for bibref in tqdm(bibrefs):
+                total, _, free = shutil.disk_usage(".")
+                if free / total < 0.05:
+                    self.logger.error(
+                        "Only %s percent of disk space left. Will not attempt to import %s."
+                        + " Stopping now.",
+                        "{:.2f}".format(free / total * 100),
+                        bibref,
+                    )
+                    break
 
-            try:
-                for ok, action in streaming_bulk(
-                    index=INDEX,
-                    client=conn,
-                    actions=self.index(bibref),
-                    raise_on_error=False,
-                    request_timeout=60,
-                ):
-                    if not ok and action["index"]["status"] != 409:
-                        self.logger.warning(action)
-            except ConnectionTimeout as e:
-                self.logger.warning(
-                    "Timeout occurred while processing BibTeX file %s", bibref
-                )
-                self.logger.warning(e)
+                # Files that have been changed since are indexed again
+                stat = bibref.stat()
+                signature = f"{stat.st_size}-{stat.st_mtime_ns}"
+                if self.progress.is_done(str(bibref), signature):
+                    self.telemetry.count("archives_skipped")
+                    continue
+                with self.telemetry.archive_report(str(bibref)):
+                    checkpoint = Checkpoint(
+                        self.progress,
+                        str(bibref),
+                        signature,
+                        statistics=self.statistics,
+                    )
+                    completed = False
+                    with self.profiler.profile(f"archive-{bibref.name}"):
+                        try:
+                            with self.telemetry.time(
+                                "bulk"
+                            ), self.telemetry.count_retries(self.bulk):
+                                for ok, action in self.bulk.index(
+                                    conn,
+                                    self.telemetry.timed(
+                                        self.index(bibref, checkpoint), "prepare"
+                                    ),
+                                    index=INDEX,
+                                ):
+                                    self.telemetry.count_bulk(ok, action)
+                                    checkpoint.acknowledge(
+                                        ok, action["index"].get("status")
+                                    )
+                                    if not ok and action["index"]["status"] != 409:
+                                        self.logger.warning(action)
+                            completed = True
+                        except ConnectionTimeout as e:
+                            self.logger.warning(
+                                "Timeout occurred while processing BibTeX file %s",
+                                bibref,
+                            )
+                            self.logger.warning(e)
+                        finally:
+                            checkpoint.save()
+                    if not (completed and checkpoint.finish()):
+                        self.telemetry.count("archives_interrupted")
+        self.telemetry.finish()
         if cleanup is not None:
             cleanup()
 
-    def index(self, archive: str) -> Iterator[Dict[str, Any]]:
+    def index(
+        self, archive: Path, checkpoint: Optional[Checkpoint] = None
+    ) -> Iterator[Dict[str, Any]]:
         with open(archive, "rt", encoding="utf-8") as data:
-            for entry in bibtex.parse(data):
+            parsed = self.telemetry.timed(bibtex.parse(data), "parse")
+            for position, entry in enumerate(parsed):
+                self.telemetry.count("articles_parsed")
+                # Indexed before the last run was interrupted
+                if checkpoint is not None and checkpoint.skip(
+                    position, entry.get("id")
+                ):
+                    self.telemetry.count("articles_resumed")
+                    continue
                 # Cleanse the text of character combinations that could be
                 # mistaken for MarkDown URLs. This will prevent the
                 # Mapper Annotated Text plugin from throwing an IllegalArgumentException.
-                if "title" in entry:
-                    doc = self.nlp(entry["title"].replace("](", "] ("))
-                    entry["title"] = annotate(doc)
-                if "abstract" in entry:
-                    doc = self.nlp(entry["abstract"].replace("](", "] ("))
-                    entry["abstract"] = annotate(doc)
+                concepts: Set[str] = set()
+                with self.telemetry.time("tag"):
+                    if "title" in entry:
+                        doc = self.nlp(entry["title"].replace("](", "] ("))
+                        entry["title"] = annotate(doc)
+                        concepts.update(concept_ids(doc))
+                    if "abstract" in entry:
+                        doc = self.nlp(entry["abstract"].replace("](", "] ("))
+                        entry["abstract"] = annotate(doc)
+                        concepts.update(concept_ids(doc))
+                self.telemetry.count("documents_tagged")
+                self.telemetry.tick()
+                # Exact matches on a keyword field can be cached as filters
+                if concepts:
+                    entry["concepts"] = sorted(concepts)
+                    if self.ancestors:
+                        entry["ancestors"] = sorted(
+                            expand_concepts(concepts, self.ancestors)
+                        )
                 if "doi" in entry and "url" not in entry:
                     doi = entry["doi"]
                     if doi.startswith("http://") or doi.startswith("https://"):
@@ -106,6 +192,13 @@ class BibtexProcessor:
                         entry["url"] = "https://dx.doi.org/" + doi
                 doc = {"_op_type": "index", "_index": INDEX, "_id": entry["id"]}
                 doc["_source"] = entry
+                # Counted once Elasticsearch has acknowledged the document
+                if checkpoint is not None:
+                    checkpoint.sent(
+                        position, doc["_id"], concepts, entry.get("ancestors", ())
+                    )
+                else:
+                    self.statistics.add(concepts, entry.get("ancestors", ()))
                 yield doc
 
 
@@ -138,6 +231,83 @@ if __name__ == "__main__":
         type=Path,
         help="Path to a pickled automaton to be used for tagging",
     )
+    PARSER.add_argument(
+        "-a",
+        "--ancestors",
+        type=Path,
+        help="Path to the pickled ancestors of all concepts for query expansion",
+    )
+    PARSER.add_argument(
+        "-c",
+        "--counts",
+        type=Path,
+        help="Path to the table of documents per concept to be updated",
+    )
+    PARSER.add_argument(
+        "-m",
+        "--cooccurrences",
+        type=Path,
+        help="Path to the matrix of documents per pair of concepts to be updated",
+    )
+    PARSER.add_argument(
+        "-r",
+        "--reports",
+        type=Path,
+        help="Directory for JSON reports on the throughput of every file and the run",
+    )
+    PARSER.add_argument(
+        "--interval",
+        type=float,
+        default=30.0,
+        help="Seconds between progress summaries on the console, 0 disables them",
+    )
+    PARSER.add_argument(
+        "--trace-memory",
+        action="store_true",
+        help="Record the peak memory usage with tracemalloc (slow)",
+    )
+    PARSER.add_argument(
+        "--profile",
+        type=Path,
+        help="Directory for cProfile output of every n-th archive, "
+        + f"defaults to ${ENV_DIRECTORY}",
+    )
+    PARSER.add_argument(
+        "--profile-every",
+        type=int,
+        default=EVERY_ARCHIVE,
+        help="Profile every n-th archive",
+    )
+    PARSER.add_argument(
+        "--progress",
+        type=Path,
+        default=PROGRESS_FILE,
+        help="SQLite database of the files and references already indexed",
+    )
+    PARSER.add_argument(
+        "--bulk-threads",
+        type=int,
+        default=2,
+        help="Bulk requests sent to Elasticsearch at the same time",
+    )
+    PARSER.add_argument(
+        "--dead-letter",
+        type=Path,
+        default=DEAD_LETTER_FILE,
+        help="JSON lines file for the documents Elasticsearch did not accept",
+    )
+    PARSER.add_argument(
+        "--bulk-load",
+        action="store_true",
+        help="Switch off refreshes and replicas of the index while importing, "
+        + "see 'bulk_load_settings' of config.json",
+    )
+    PARSER.add_argument(
+        "--force-merge",
+        type=int,
+        metavar="SEGMENTS",
+        help="Merge the index into this many segments per shard afterwards",
+    )
     ARGS = PARSER.parse_args()
     AUTOMATON = Path(ARGS.automaton)
     if not AUTOMATON.exists():
@@ -146,8 +316,26 @@ if __name__ == "__main__":
     if not AUTOMATON.is_file():
         print(f"ERROR: Input argument {AUTOMATON} is not a file.", file=sys.stderr)
         sys.exit(1)
+    if ARGS.ancestors is not None and not ARGS.ancestors.is_file():
+        print(f"ERROR: Input file {ARGS.ancestors} does not exist.", file=sys.stderr)
+        sys.exit(1)
     try:
-        Bibtex = BibtexProcessor(ARGS.automaton)
+        Bibtex = BibtexProcessor(
+            ARGS.automaton,
+            ARGS.ancestors,
+            ARGS.counts,
+            ARGS.cooccurrences,
+            Telemetry(ARGS.reports, ARGS.interval, ARGS.trace_memory),
+            (
+                Profiler(ARGS.profile, ARGS.profile_every)
+                if ARGS.profile is not None
+                else Profiler.from_env(every=ARGS.profile_every)
+            ),
+            ARGS.progress,
+            BulkSink(ARGS.bulk_threads, dead_letter=ARGS.dead_letter),
+            ARGS.bulk_load,
+            ARGS.force_merge,
+        )
     except OSError as e:
         if str(e).startswith("[E050]"):
             logger.error(
@@ -0,0 +1,301 @@
+"""
+Bulk indexing of the indexing tools with back-pressure and retries.
+
+The actions are cut into chunks by size in bytes. The size is adapted to the
+observed response times, so that a bulk request takes about target_seconds.
+Several chunks are sent at the same time by a pool of threads, but only a
+bounded number of them may wait, so that parsing and tagging pause when
+Elasticsearch cannot keep up. The results are returned in the order of the
+actions, like the ones of streaming_bulk.
+
+Actions rejected by Elasticsearch (429) are sent again with exponential
+back-off. Actions that still fail, except for version conflicts, are written
+to a dead-letter file as JSON lines, which can be sent again with
+
+    python -m query_proxy.bulk dead-letter.jsonl
+"""
+
+import argparse
+import json
+import logging
+import random
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Deque, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import elasticsearch
+from elasticsearch.helpers import expand_action
+
+DEAD_LETTER_FILE = Path("dead-letter.jsonl")
+MB = 1024**2
+
+logger = logging.getLogger("bulk")
+
+Result = Tuple[bool, Dict[str, Any]]
+
+
+class Chunk:
+    """Actions together with the lines of their bulk request."""
+
+    def __init__(self) -> None:
+        self.actions: List[Dict[str, Any]] = []
+        self.lines: List[List[str]] = []
+        self.size = 0
+
+    def add(self, action: Dict[str, Any], lines: List[str]) -> None:
+        self.actions.append(action)
+        self.lines.append(lines)
+        # The newlines separating the lines are counted as well
+        self.size += sum(len(line.encode("utf-8")) + 1 for line in lines)
+
+    def subset(self, indices: List[int]) -> "Chunk":
+        """The chunk of the actions at indices, e.g. the rejected ones."""
+        chunk = Chunk()
+        for i in indices:
+            chunk.add(self.actions[i], self.lines[i])
+        return chunk
+
+    def body(self) -> str:
+        return "".join(line + "\n" for lines in self.lines for line in lines)
+
+
+class BulkSink:
+    """
+    Parameters
+    ----------
+    threads : int
+        Bulk requests sent at the same time.
+    queue_size : int, optional
+        Chunks waiting for their results, at least threads. Defaults to
+        twice the number of threads.
+    target_seconds : float
+        The duration of a bulk request the chunk size is adapted to.
+    chunk_bytes : int
+        The initial size of a chunk, it stays within min_bytes and max_bytes.
+    max_actions : int
+        Actions per chunk at most, regardless of their size.
+    max_retries : int
+        How often rejected actions are sent again.
+    initial_backoff : float
+        Seconds before the first retry, doubled for every further one.
+    max_backoff : float
+        Seconds between retries at most.
+    request_timeout : float
+        Timeout of a single bulk request.
+    dead_letter : Path, optional
+        JSON lines file for the actions that failed, None drops them.
+    """
+
+    def __init__(
+        self,
+        threads: int = 2,
+        queue_size: Optional[int] = None,
+        target_seconds: float = 2.0,
+        chunk_bytes: int = 5 * MB,
+        min_bytes: int = 256 * 1024,
+        max_bytes: int = 50 * MB,
+        max_actions: int = 5000,
+        max_retries: int = 8,
+        initial_backoff: float = 1.0,
+        max_backoff: float = 60.0,
+        request_timeout: float = 60.0,
+        dead_letter: Optional[Path] = DEAD_LETTER_FILE,
+    ) -> None:
+        self.threads = max(threads, 1)
+        self.queue_size = max(queue_size or 2 * self.threads, self.threads)
+        self.target_seconds = target_seconds
+        self.chunk_bytes = chunk_bytes
+        self.min_bytes = min_bytes
+        self.max_bytes = max_bytes
+        self.max_actions = max_actions
+        self.max_retries = max_retries
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.request_timeout = request_timeout
+        self.dead_letter = dead_letter
+        self.retries = 0
+        self.dead_letters = 0
+        self._lock = threading.Lock()
+
+    def index(
+        self,
+        client: elasticsearch.Elasticsearch,
+        actions: Iterable[Dict[str, Any]],
+        **kwargs: Any,
+    ) -> Iterator[Result]:
+        """
+        Send the actions and return a result per action in their order,
+        (ok, {op_type: item}) like streaming_bulk with raise_on_error=False.
+        Further keyword arguments, e.g. index, are passed to client.bulk().
+
+        Raises
+        ------
+        elasticsearch.exceptions.TransportError
+            When a bulk request failed as a whole, after the retries in case
+            of a timeout or a rejection.
+        """
+        pending: Deque["Future[List[Result]]"] = deque()
+        with ThreadPoolExecutor(self.threads) as pool:
+            try:
+                for chunk in self.chunks(client, actions):
+                    pending.append(pool.submit(self.send, client, chunk, kwargs))
+                    # Waiting here pauses the stages producing the actions
+                    while len(pending) >= self.queue_size or (
+                        pending and pending[0].done()
+                    ):
+                        yield from pending.popleft().result()
+                while pending:
+                    yield from pending.popleft().result()
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    def chunks(
+        self, client: elasticsearch.Elasticsearch, actions: Iterable[Dict[str, Any]]
+    ) -> Iterator[Chunk]:
+        serializer = client.transport.serializer
+        chunk = Chunk()
+        for action in actions:
+            metadata, source = expand_action(action)
+            lines = [serializer.dumps(metadata)]
+            if source is not None:
+                lines.append(serializer.dumps(source))
+            chunk.add(action, lines)
+            with self._lock:
+                limit = self.chunk_bytes
+            if chunk.size >= limit or len(chunk.actions) >= self.max_actions:
+                yield chunk
+                chunk = Chunk()
+        if chunk.actions:
+            yield chunk
+
+    def send(
+        self, client: elasticsearch.Elasticsearch, chunk: Chunk, kwargs: Dict[str, Any]
+    ) -> List[Result]:
+        """The results of the actions of the chunk, rejected ones are retried."""
+        results: List[Optional[Result]] = [None] * len(chunk.actions)
+        # Positions of the actions of the current attempt in chunk
+        indices = list(range(len(chunk.actions)))
+        attempt_chunk = chunk
+        for attempt in range(self.max_retries + 1):
+            items = self._request(client, attempt_chunk, kwargs, attempt)
+            rejected = []
+            for i, item in zip(indices, items):
+                status = next(iter(item.values())).get("status", 500)
+                if status == 429 and attempt < self.max_retries:
+                    rejected.append(i)
+                    continue
+                results[i] = (200 <= status < 300, item)
+            if not rejected:
+                break
+            self._rejected(len(rejected), attempt)
+            indices = rejected
+            attempt_chunk = chunk.subset(rejected)
+        for i, result in enumerate(results):
+            assert result is not None
+            ok, item = result
+            if not ok and next(iter(item.values())).get("status") != 409:
+                self.write_dead_letter(chunk.actions[i], item)
+        return [result for result in results if result is not None]
+
+    def _request(
+        self,
+        client: elasticsearch.Elasticsearch,
+        chunk: Chunk,
+        kwargs: Dict[str, Any],
+        attempt: int,
+    ) -> List[Dict[str, Any]]:
+        """The items of the response, the request is retried as a whole on 429."""
+        body = chunk.body()
+        while True:
+            start = time.perf_counter()
+            try:
+                response = client.bulk(
+                    body=body, request_timeout=self.request_timeout, **kwargs
+                )
+            except elasticsearch.exceptions.TransportError as e:
+                timeout = isinstance(e, elasticsearch.exceptions.ConnectionTimeout)
+                if (timeout or e.status_code == 429) and attempt < self.max_retries:
+                    self._rejected(len(chunk.actions), attempt)
+                    attempt += 1
+                    continue
+                raise
+            self._adapt(chunk.size, time.perf_counter() - start)
+            return response["items"]
+
+    def _rejected(self, actions: int, attempt: int) -> None:
+        """Shrink the chunks and back off before the next attempt."""
+        with self._lock:
+            self.retries += 1
+            self.chunk_bytes = max(self.chunk_bytes // 2, self.min_bytes)
+        backoff = min(self.initial_backoff * 2**attempt, self.max_backoff)
+        # Jitter keeps the threads from retrying at the same time
+        backoff *= random.uniform(0.5, 1.0)
+        logger.warning(
+            "%d actions rejected, retrying in %.1f seconds", actions, backoff
+        )
+        time.sleep(backoff)
+
+    def _adapt(self, size: int, seconds: float) -> None:
+        """Move the chunk size towards the one taking target_seconds."""
+        with self._lock:
+            # Small chunks, e.g. the last one of an archive, say little about the rate
+            if seconds <= 0 or (
+                size < self.chunk_bytes // 2 and seconds < self.target_seconds
+            ):
+                return
+            ideal = size / seconds * self.target_seconds
+            ideal = min(max(ideal, self.chunk_bytes / 2), self.chunk_bytes * 2)
+            self.chunk_bytes = int(min(max(ideal, self.min_bytes), self.max_bytes))
+
+    def write_dead_letter(self, action: Dict[str, Any], item: Dict[str, Any]) -> None:
+        with self._lock:
+            self.dead_letters += 1
+            if self.dead_letter is None:
+                return
+            result = next(iter(item.values()))
+            record = {
+                "time": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                "status": result.get("status"),
+                "error": result.get("error"),
+                "action": action,
+            }
+            with self.dead_letter.open("at", encoding="utf-8") as out:
+                out.write(json.dumps(record, default=str) + "\n")
+
+
+def read_dead_letters(path: Path) -> Iterator[Dict[str, Any]]:
+    """The actions of a dead-letter file."""
+    with path.open("rt", encoding="utf-8") as dead_letters:
+        for line in dead_letters:
+            if line.strip():
+                yield json.loads(line)["action"]
+
+
+if __name__ == "__main__":
+    from query_proxy.elastic_import import setup
+
+    PARSER = argparse.ArgumentParser("Send the actions of a dead-letter file again")
+    PARSER.add_argument("dead_letter", type=Path, help="The dead-letter file")
+    PARSER.add_argument(
+        "--remaining",
+        type=Path,
+        help="Dead-letter file for the actions that fail again, "
+        + "defaults to the input with the suffix .remaining.jsonl",
+    )
+    ARGS = PARSER.parse_args()
+    if not ARGS.dead_letter.is_file():
+        print(f"ERROR: Input file {ARGS.dead_letter} does not exist.", file=sys.stderr)
+        sys.exit(1)
+    REMAINING = ARGS.remaining or ARGS.dead_letter.with_suffix(".remaining.jsonl")
+    SINK = BulkSink(dead_letter=REMAINING)
+    for _ in SINK.index(setup(), read_dead_letters(ARGS.dead_letter)):
+        pass
+    if SINK.dead_letters:
+        print(f"{SINK.dead_letters} actions failed again, see {REMAINING}")
+        sys.exit(1)
@@ -0,0 +1,431 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Wed Oct 21 13:05:12 2026
+
+Statistics about the concepts of the indexed documents,
+collected while indexing and used by the proxy to plan its queries.
+"""
+
+import argparse
+import fcntl
+import heapq
+import os
+import struct
+import sys
+import threading
+from array import array
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
+
+# First line of a table of counts that covers all documents of the index
+COMPLETE_MARKER = "#complete"
+
+
+class ConceptCounts:
+    """
+    Number of documents per concept.
+
+    Documents are counted once for every concept found in them ('concepts' field)
+    and once for every concept or ancestor of a concept ('ancestors' field).
+    Documents that are indexed again are counted again, so the counts are
+    upper bounds. Only a complete table, which has been started together with
+    the index, has counted all of its documents. In particular, a concept with
+    a count of 0 in a complete table occurs in no document.
+
+    The counts are stored as tab-separated text with one line per concept:
+    ID, direct count and expanded count. Complete tables start with a line
+    COMPLETE_MARKER.
+    """
+
+    def __init__(self, complete: bool = False) -> None:
+        self.direct: Counter = Counter()
+        self.expanded: Counter = Counter()
+        self.complete = complete
+
+    def add(self, concepts: Iterable[str], ancestors: Iterable[str] = ()) -> None:
+        """Count a single document."""
+        self.direct.update(set(concepts))
+        self.expanded.update(set(ancestors))
+
+    def update(self, other: "ConceptCounts") -> None:
+        """
+        Merge the counts of e.g. another archive or process.
+        The result is only complete, if both tables are.
+        """
+        self.direct.update(other.direct)
+        self.expanded.update(other.expanded)
+        self.complete = self.complete and other.complete
+
+    def count(self, concept: str, expand: bool = False) -> int:
+        return self.expanded[concept] if expand else self.direct[concept]
+
+    @staticmethod
+    def load(path: Union[Path, str]) -> "ConceptCounts":
+        counts = ConceptCounts()
+        with open(path, "rt", encoding="utf-8") as table:
+            for line in table:
+                if line.rstrip("\n") == COMPLETE_MARKER:
+                    counts.complete = True
+                    continue
+                concept, direct, expanded = line.rstrip("\n").split("\t")
+                if direct != "0":
+                    counts.direct[concept] = int(direct)
+                if expanded != "0":
+                    counts.expanded[concept] = int(expanded)
+        return counts
+
+    def save(self, path: Union[Path, str]) -> None:
+        """Write the counts, replacing an existing file only when complete."""
+        temp = f"{path}.tmp"
+        with open(temp, "wt", encoding="utf-8") as table:
+            if self.complete:
+                table.write(COMPLETE_MARKER + "\n")
+            for concept in sorted(set(self.direct) | set(self.expanded)):
+                table.write(
+                    f"{concept}\t{self.direct[concept]}\t{self.expanded[concept]}\n"
+                )
+        os.replace(temp, path)
+
+
+class CooccurrenceCounter:
+    """
+    Counts how many documents mention two concepts together,
+    e.g. for a single archive. See CooccurrenceMatrix for a compact form.
+    """
+
+    def __init__(self) -> None:
+        self.rows: Dict[str, Counter] = defaultdict(Counter)
+
+    def add(self, concepts: Iterable[str]) -> None:
+        """Count a single document."""
+        unique = sorted(set(concepts))
+        for i, concept in enumerate(unique):
+            row = self.rows[concept]
+            for other in unique[:i]:
+                row[other] += 1
+                self.rows[other][concept] += 1
+
+    def update(self, matrix: "CooccurrenceMatrix") -> None:
+        """Add the counts of a matrix, e.g. of an interrupted archive."""
+        for concept in matrix.concepts:
+            self.rows[concept].update(matrix.row(concept))
+
+
+class CooccurrenceMatrix:
+    """
+    Sparse symmetric matrix of the number of documents mentioning two concepts,
+    stored in compressed sparse row (CSR) format.
+
+    Row i belongs to concept self.concepts[i]. Its columns are
+    self.indices[self.indptr[i]:self.indptr[i + 1]] with the counts at the same
+    positions of self.data, ordered from the most to the least frequent.
+    """
+
+    MAGIC = b"ADCOOC1\n"
+    HEADER = struct.Struct("<QQQ")
+
+    def __init__(
+        self, concepts: List[str], indptr: array, indices: array, data: array
+    ) -> None:
+        self.concepts = concepts
+        self.positions = {concept: i for i, concept in enumerate(concepts)}
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+
+    @staticmethod
+    def build(
+        concepts: List[str], row: Callable[[str], Counter]
+    ) -> "CooccurrenceMatrix":
+        """
+        Create a matrix row by row.
+
+        Parameters
+        ----------
+        concepts : List[str]
+            All concepts, sorted
+        row : Callable[[str], Counter]
+            Returns the counts of the co-occurring concepts of a concept
+        """
+        positions = {concept: i for i, concept in enumerate(concepts)}
+        indptr = array("Q", [0])
+        indices = array("I")
+        data = array("I")
+        for concept in concepts:
+            for other, count in sorted(
+                row(concept).items(), key=lambda item: (-item[1], item[0])
+            ):
+                indices.append(positions[other])
+                data.append(count)
+            indptr.append(len(indices))
+        return CooccurrenceMatrix(concepts, indptr, indices, data)
+
+    @staticmethod
+    def from_counter(counter: CooccurrenceCounter) -> "CooccurrenceMatrix":
+        concepts = sorted(concept for concept, row in counter.rows.items() if row)
+        return CooccurrenceMatrix.build(concepts, counter.rows.__getitem__)
+
+    def row(self, concept: str) -> Counter:
+        """The number of common documents with every co-occurring concept."""
+        i = self.positions.get(concept)
+        if i is None:
+            return Counter()
+        start, end = self.indptr[i], self.indptr[i + 1]
+        return Counter(
+            {
+                self.concepts[j]: count
+                for j, count in zip(self.indices[start:end], self.data[start:end])
+            }
+        )
+
+    def merge(self, other: "CooccurrenceMatrix") -> "CooccurrenceMatrix":
+        """
+        Add up the counts of two matrices, e.g. of separate archives or processes.
+        Only a single row of each is expanded at a time.
+        """
+        concepts = sorted(set(self.concepts) | set(other.concepts))
+
+        def row(concept: str) -> Counter:
+            counts = self.row(concept)
+            counts.update(other.row(concept))
+            return counts
+
+        return CooccurrenceMatrix.build(concepts, row)
+
+    def related(self, concepts: Iterable[str], size: int = 10) -> List[Tuple[str, int]]:
+        """
+        The concepts most frequently mentioned together with any of concepts.
+
+        Returns
+        -------
+        List[Tuple[str, int]]
+            Up to size concepts and their (summed) number of common documents.
+        """
+        query = set(concepts)
+        if len(query) == 1:
+            # Rows are already ordered by frequency
+            concept = next(iter(query))
+            i = self.positions.get(concept)
+            if i is None:
+                return []
+            start, end = self.indptr[i], min(self.indptr[i + 1], self.indptr[i] + size)
+            return [
+                (self.concepts[j], count)
+                for j, count in zip(self.indices[start:end], self.data[start:end])
+            ]
+        total: Counter = Counter()
+        for concept in query:
+            total.update(self.row(concept))
+        for concept in query:
+            total.pop(concept, None)
+        # Ties are broken by concept like in the rows
+        return heapq.nsmallest(
+            size, total.items(), key=lambda item: (-item[1], item[0])
+        )
+
+    def save(self, path: Union[Path, str]) -> None:
+        """Write the matrix, replacing an existing file only when complete."""
+        vocabulary = "\n".join(self.concepts).encode("utf-8")
+        temp = f"{path}.tmp"
+        with open(temp, "wb") as matrix:
+            matrix.write(self.MAGIC)
+            matrix.write(
+                self.HEADER.pack(len(self.concepts), len(self.indices), len(vocabulary))
+            )
+            matrix.write(vocabulary)
+            for values in (self.indptr, self.indices, self.data):
+                if sys.byteorder == "big":
+                    values = array(values.typecode, values)
+                    values.byteswap()
+                values.tofile(matrix)
+        os.replace(temp, path)
+
+    @staticmethod
+    def load(path: Union[Path, str]) -> "CooccurrenceMatrix":
+        with open(path, "rb") as matrix:
+            if matrix.read(len(CooccurrenceMatrix.MAGIC)) != CooccurrenceMatrix.MAGIC:
+                raise ValueError(f"{path} is not a co-occurrence matrix.")
+            rows, entries, length = CooccurrenceMatrix.HEADER.unpack(
+                matrix.read(CooccurrenceMatrix.HEADER.size)
+            )
+            vocabulary = matrix.read(length).decode("utf-8")
+            concepts = vocabulary.split("\n") if vocabulary else []
+            indptr = array("Q")
+            indptr.fromfile(matrix, rows + 1)
+            indices = array("I")
+            indices.fromfile(matrix, entries)
+            data = array("I")
+            data.fromfile(matrix, entries)
+        if sys.byteorder == "big":
+            for values in (indptr, indices, data):
+                values.byteswap()
+        return CooccurrenceMatrix(concepts, indptr, indices, data)
+
+
+class ConceptStatistics:
+    """
+    The statistics collected by the indexing tools.
+    They are continued across runs and written with the checkpoints
+    of the progress of the archives.
+
+    Rewriting the whole co-occurrence matrix at every checkpoint would take
+    longer the larger it gets, so the co-occurrences of an archive are written
+    to a shard of their own next to the matrix. The shard is merged into the
+    matrix once the archive is done, under a lock, so that indexers working on
+    different archives can share a matrix.
+    """
+
+    def __init__(
+        self,
+        counts_file: Optional[Path] = None,
+        cooccurrence_file: Optional[Path] = None,
+    ) -> None:
+        self.counts_file = counts_file
+        self.counts: Optional[ConceptCounts] = None
+        if counts_file is not None:
+            if counts_file.exists():
+                self.counts = ConceptCounts.load(counts_file)
+            else:
+                self.counts = ConceptCounts()
+        # Only the counts of the current archive are kept in memory
+        self.cooccurrence_file = cooccurrence_file
+        self.cooccurrences: Optional[CooccurrenceCounter] = None
+        if cooccurrence_file is not None:
+            self.cooccurrences = CooccurrenceCounter()
+        self.archive: Optional[str] = None
+
+    def begin(self, documents: int) -> None:
+        """
+        Called with the number of documents in the index before indexing.
+        A new table of an empty index counts all documents from now on.
+        """
+        counts = self.counts
+        if counts is not None and documents == 0:
+            if not counts.direct and not counts.expanded:
+                counts.complete = True
+
+    def add(self, concepts: Iterable[str], ancestors: Iterable[str] = ()) -> None:
+        """Count a single document."""
+        if self.counts is not None:
+            self.counts.add(concepts, ancestors)
+        if self.cooccurrences is not None:
+            self.cooccurrences.add(concepts)
+
+    def shard(self, archive: str) -> Path:
+        """The file of the co-occurrences of an archive that is not done yet."""
+        assert self.cooccurrence_file is not None
+        name = f"{self.cooccurrence_file.name}.{Path(archive).name}.part"
+        return self.cooccurrence_file.with_name(name)
+
+    def start(self, archive: str, resume: bool = False) -> None:
+        """Count the co-occurrences of archive, continuing its shard if resumed."""
+        if self.cooccurrence_file is None:
+            return
+        self.archive = archive
+        self.cooccurrences = CooccurrenceCounter()
+        shard = self.shard(archive)
+        if resume and shard.exists():
+            self.cooccurrences.update(CooccurrenceMatrix.load(shard))
+
+    def save(self) -> None:
+        """Write the counts and the shard of the current archive."""
+        if self.counts is not None and self.counts_file is not None:
+            self.counts.save(self.counts_file)
+        if self.cooccurrences is not None and self.archive is not None:
+            matrix = CooccurrenceMatrix.from_counter(self.cooccurrences)
+            matrix.save(self.shard(self.archive))
+
+    def finish(self) -> None:
+        """Merge the co-occurrences of the current archive into the matrix."""
+        if self.cooccurrences is None or self.cooccurrence_file is None:
+            return
+        with _locked(self.cooccurrence_file):
+            matrix = CooccurrenceMatrix.from_counter(self.cooccurrences)
+            if self.cooccurrence_file.exists():
+                matrix = CooccurrenceMatrix.load(self.cooccurrence_file).merge(matrix)
+            matrix.save(self.cooccurrence_file)
+        if self.archive is not None and self.shard(self.archive).exists():
+            self.shard(self.archive).unlink()
+        self.cooccurrences = CooccurrenceCounter()
+        self.archive = None
+
+
+@contextmanager
+def _locked(path: Path) -> Iterator[None]:
+    """Hold an exclusive lock on path across processes while in the block."""
+    with open(f"{path}.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+_LOCK = threading.Lock()
+_LOADED: Dict[str, Tuple[float, Any]] = dict()
+
+
+def _load_shared(path: Union[Path, str], loader: Callable[[str], Any]) -> Any:
+    """
+    Load a file once and share it between all threads.
+    It is read again when the file has been changed by the indexing tools.
+    Returns None, if the file does not exist.
+    """
+    key = str(path)
+    try:
+        modified = os.stat(key).st_mtime
+    except FileNotFoundError:
+        return None
+    with _LOCK:
+        if key not in _LOADED or _LOADED[key][0] != modified:
+            _LOADED[key] = (modified, loader(key))
+        return _LOADED[key][1]
+
+
+def get_concept_counts(path: Union[Path, str]) -> Optional[ConceptCounts]:
+    """The counts stored in a file, see _load_shared."""
+    return _load_shared(path, ConceptCounts.load)
+
+
+def get_cooccurrences(path: Union[Path, str]) -> Optional[CooccurrenceMatrix]:
+    """The co-occurrence matrix stored in a file, see _load_shared."""
+    return _load_shared(path, CooccurrenceMatrix.load)
+
+
+if __name__ == "__main__":
+    PARSER = argparse.ArgumentParser(
+        "Merge concept statistics written by parallel or separate indexing runs"
+    )
+    PARSER.add_argument(
+        "kind", choices=["counts", "cooccurrences"], help="Kind of statistics"
+    )
+    PARSER.add_argument("output", type=Path, help="Where the result is written to")
+    PARSER.add_argument("inputs", type=Path, nargs="+", help="Files to be merged")
+    ARGS = PARSER.parse_args()
+    for INPUT in ARGS.inputs:
+        if not INPUT.is_file():
+            print(f"ERROR: Input file {INPUT} does not exist.", file=sys.stderr)
+            sys.exit(1)
+    if ARGS.kind == "counts":
+        COUNTS = ConceptCounts.load(ARGS.inputs[0])
+        for INPUT in ARGS.inputs[1:]:
+            COUNTS.update(ConceptCounts.load(INPUT))
+        COUNTS.save(ARGS.output)
+    else:
+        MATRIX = CooccurrenceMatrix.load(ARGS.inputs[0])
+        for INPUT in ARGS.inputs[1:]:
+            MATRIX = MATRIX.merge(CooccurrenceMatrix.load(INPUT))
+        MATRIX.save(ARGS.output)
@@ -2,8 +2,21 @@ import json
 import sys
 from typing import Any, Dict
 
+from elasticsearch_dsl import connections
+
 CONFIG = "config.json"
 
+# Maps the keys of CONFIG to the keyword arguments of the Elasticsearch client
+CLIENT_OPTIONS = {
+    "es_maxsize": "maxsize",
+    "es_timeout": "timeout",
+    "es_max_retries": "max_retries",
+    "es_retry_on_timeout": "retry_on_timeout",
+    "es_sniff_on_start": "sniff_on_start",
+    "es_sniff_on_connection_fail": "sniff_on_connection_fail",
+    "es_sniffer_timeout": "sniffer_timeout",
+}
+
 
 def read_config() -> Dict[str, Any]:
     """
@@ -22,3 +35,38 @@ def read_config() -> Dict[str, Any]:
         return {}
 
     return conf
+
+
+def client_options(conf: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Translate the configuration into keyword arguments for the Elasticsearch client.
+
+    Parameters
+    ----------
+    conf : Dict[str, Any]
+        The configuration as returned by read_config().
+        Only 'es_hosts' and the keys of CLIENT_OPTIONS are considered.
+        Options that are missing or set to null keep the defaults
+        of the client library.
+
+    Returns
+    -------
+    Dict[str, Any]
+        Keyword arguments accepted by elasticsearch.Elasticsearch
+        as well as elasticsearch.AsyncElasticsearch.
+    """
+    options: Dict[str, Any] = {"hosts": conf.get("es_hosts", ["localhost"])}
+    for key, option in CLIENT_OPTIONS.items():
+        if conf.get(key) is not None:
+            options[option] = conf[key]
+    return options
+
+
+def configure_connections(conf: Dict[str, Any]) -> None:
+    """
+    Register the default connection of the Elasticsearch DSL.
+
+    The client itself is only created on first use, so neither importing
+    the application nor the ingest tools will wait for the network.
+    """
+    connections.configure(default=client_options(conf))
@@ -6,14 +6,16 @@ Created on Mon Sep  7 13:13:14 2020
 @author: tech
 """
 
+import logging
+from contextlib import contextmanager
 from datetime import datetime
-from typing import Dict
+from typing import Any, Dict, Iterator, Mapping, Optional
 
 import elasticsearch
 from elasticsearch_dsl import Date, Document, Keyword, Search, Short, Text, connections
 from elasticsearch_dsl.field import Field
 
-from query_proxy.config import read_config
+from query_proxy.config import configure_connections, read_config
 
 SETTINGS = read_config()
 INDEX = (
@@ -21,6 +23,17 @@ INDEX = (
     if "index" in SETTINGS and isinstance(SETTINGS["index"], str)
     else "pubmed"
 )
+# Index settings during a bulk load, updated by 'bulk_load_settings' of config.json
+BULK_LOAD_SETTINGS: Dict[str, Any] = {
+    "index.refresh_interval": "-1",
+    "index.number_of_replicas": 0,
+    "index.translog.flush_threshold_size": "2gb",
+}
+# The settings to restore are kept in the mapping while a bulk load is running
+RESTORE_KEY = "bulk_load_restore"
+FORCE_MERGE_TIMEOUT = 6 * 3600
+
+logger = logging.getLogger("elastic_import")
 
 
 class AnnotatedText(Field):
@@ -49,13 +62,20 @@ class Bibdoc(Document):
     issue = Keyword()
     pages = Keyword()
     date = Keyword()
+    # Publication date normalized to YYYY-MM-DD, used for sorting and ranges
+    pubdate = Date()
     year = Short()
     month = Keyword()
-    journal = Text()
+    # The keyword subfield is aggregated for the facets of a search
+    journal = Text(fields={"raw": Keyword()})
     pmid = Keyword()
     mesh = Keyword()
     version = Keyword()
     url = Keyword()
+    # IDs of all concepts annotated in title and abstract
+    concepts = Keyword(multi=True)
+    # The concepts together with all of their ancestors
+    ancestors = Keyword(multi=True)
     created_at = Date()
 
     class Index:
@@ -71,6 +91,9 @@ def setup() -> elasticsearch.Elasticsearch:
     Connect to the running Elasticsearch instance.
     Initialize the index, if it does not not already exists.
 
+    The client is configured by the 'es_*' entries of config.json,
+    the same way as the one of the proxy.
+
     Raises:
         elasticsearch.exceptions.RequestError: When the plugin for
         AnnotatedText is not installed.
@@ -80,6 +103,81 @@ def setup() -> elasticsearch.Elasticsearch:
         elasticsearch.exceptions.ConnectionError: When the
         search engine is not running
     """
-    conn = connections.create_connection(hosts=["localhost"])
+    configure_connections(SETTINGS)
+    conn = connections.get_connection()
     Bibdoc.init(using=conn)
     return conn
+
+
+def document_count(conn: elasticsearch.Elasticsearch, index: str = INDEX) -> int:
+    """The number of documents in the index, including the ones not refreshed yet."""
+    conn.indices.refresh(index=index)
+    return conn.count(index=index)["count"]
+
+
+def bulk_load_settings(conf: Mapping[str, Any]) -> Dict[str, Any]:
+    """BULK_LOAD_SETTINGS, updated by the 'bulk_load_settings' entry of conf."""
+    settings = dict(BULK_LOAD_SETTINGS)
+    settings.update(conf.get("bulk_load_settings") or {})
+    return settings
+
+
+@contextmanager
+def bulk_load(
+    conn: elasticsearch.Elasticsearch,
+    index: str = INDEX,
+    settings: Optional[Dict[str, Any]] = None,
+    force_merge: Optional[int] = None,
+) -> Iterator[None]:
+    """
+    Tune the index for a bulk load, e.g. of the baseline, while in the block.
+
+    Refreshes and replicas are switched off and the translog is flushed less
+    often. The original settings are restored when the block is left, also
+    on errors. They are kept in the _meta of the mapping in the meantime,
+    so that they are not lost if the process is killed: the next bulk load
+    restores them instead.
+
+    Parameters
+    ----------
+    conn : elasticsearch.Elasticsearch
+        The client, e.g. as returned by setup().
+    index : str
+        The index or alias to load.
+    settings : Dict[str, Any], optional
+        The settings during the load, defaults to the ones of config.json.
+    force_merge : int, optional
+        Merge the index into at most this many segments per shard after
+        the block has been left without an error.
+    """
+    if settings is None:
+        settings = bulk_load_settings(SETTINGS)
+    mapping = next(iter(conn.indices.get_mapping(index=index).values()))
+    restore = mapping["mappings"].get("_meta", {}).get(RESTORE_KEY)
+    if restore is not None:
+        logger.warning("Settings of an interrupted bulk load of %s found", index)
+    else:
+        restore = {}
+    current = next(
+        iter(conn.indices.get_settings(index=index, flat_settings=True).values())
+    )["settings"]
+    for key in settings:
+        # Settings that were not set explicitly are reset to their defaults
+        restore.setdefault(key, current.get(key))
+    conn.indices.put_mapping(index=index, body={"_meta": {RESTORE_KEY: restore}})
+    logger.info("Bulk load settings of %s: %s", index, settings)
+    conn.indices.put_settings(index=index, body=settings)
+    try:
+        yield
+    finally:
+        conn.indices.put_settings(index=index, body=restore)
+        conn.indices.put_mapping(index=index, body={"_meta": {}})
+        logger.info("Restored the settings of %s: %s", index, restore)
+        conn.indices.refresh(index=index)
+    if force_merge is not None:
+        logger.info("Merging %s into %d segments per shard", index, force_merge)
+        conn.indices.forcemerge(
+            index=index,
+            max_num_segments=force_merge,
+            request_timeout=FORCE_MERGE_TIMEOUT,
+        )
@@ -1,9 +1,13 @@
 import re
 
-from elasticsearch_dsl import Search, connections
+from elasticsearch_dsl import Search
 from flask import Flask
 
-from .config import read_config
+from .admission import AdmissionControl
+from .config import client_options, configure_connections, read_config
+from .metrics import Metrics
+from .profiling import Profiler
+from .slowlog import SlowLog
 
 
 class Config:
@@ -11,15 +15,60 @@ class Config:
 
     ANNOTATION_MATCHER = re.compile("\\[(.*?)\\]\\(.*?\\)")
 
-    conn = connections.create_connection(hosts=config["es_hosts"])
-    search = Search(using=conn)
+    # The client is created lazily on the first search
+    configure_connections(config)
+    CLIENT_OPTIONS = client_options(config)
+    search = Search(using="default")
     SEARCH = search.index(config["index"])
 
     FIELDS = config["fields"]
 
+    # Pickled automaton of the tagger, used for autocompletion
+    AUTOMATON = config.get("automaton")
+
+    # Documents per concept as counted by the indexing tools
+    CONCEPT_COUNTS = config.get("concept_counts")
+
+    # Documents per pair of concepts as counted by the indexing tools
+    COOCCURRENCES = config.get("cooccurrences")
+
+    # Milliseconds a request may spend searching, by default and at most
+    TIME_BUDGET = config.get("time_budget")
+    MAX_TIME_BUDGET = config.get("max_time_budget")
+    # Documents collected per shard by the fallback query before it stops early
+    TERMINATE_AFTER = config.get("terminate_after")
+
+    # Requests per second, burst and concurrent searches per client,
+    # requests beyond the concurrency wait in a queue, see admission.py
+    RATE_LIMIT = config.get("rate_limit")
+    RATE_BURST = config.get("rate_burst")
+    CLIENT_CONCURRENCY = config.get("client_concurrency")
+    QUEUE_SIZE = config.get("queue_size")
+    QUEUE_TIMEOUT = config.get("queue_timeout")
+    # Only these API keys identify a client, otherwise its address does
+    API_KEYS = config.get("api_keys")
+
+    # "orjson", if installed, or "json"
+    JSON_SERIALIZER = config.get("json_serializer")
+    # Answers of at least this many bytes are compressed, null switches it off
+    COMPRESSION_THRESHOLD = config.get("compression_threshold")
+
+    # Searches taking at least SLOW_LOG_THRESHOLD milliseconds are written to
+    # SLOW_LOG, a fraction of them with the profile of Elasticsearch, see slowlog.py
+    SLOW_LOG = config.get("slow_log")
+    SLOW_LOG_THRESHOLD = config.get("slow_log_threshold")
+    SLOW_LOG_PROFILE_RATE = config.get("slow_log_profile_rate")
+
+    # Fraction of searches that write their parsed queries to the log at level DEBUG
+    DEBUG_QUERY_SAMPLE_RATE = config.get("debug_query_sample_rate")
+
     @staticmethod
     def init_app(app: Flask) -> None:
-        pass
+        app.extensions["admission"] = AdmissionControl.from_config(app.config)
+        app.extensions["metrics"] = Metrics()
+        app.extensions["slow_log"] = SlowLog.from_config(app.config)
+        # Switched on by the environment, see profiling.py
+        app.extensions["profiler"] = Profiler.from_env()
 
 
 class DevelopmentConfig(Config):
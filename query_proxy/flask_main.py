@@ -1,26 +1,46 @@
+import atexit
 import logging
 import os
 from logging.handlers import RotatingFileHandler
 
 from flask import Flask
+from flask.logging import default_handler
 
 from .app import create_app
+from .app.asgi import AsgiApp
+from .logs import JsonFormatter, queue_logging
 
 
-def wsgi() -> Flask:
-    app = create_app(os.getenv("FLASK_CONFIG") or "default")
+def setup_logging(app: Flask) -> None:
     app.logger.setLevel(logging.DEBUG)
+    # Written by a background thread, see logs.py
+    app.logger.removeHandler(default_handler)
 
-    formatter = logging.Formatter(
-        "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-    )
     # File logs contain everything
     fh = RotatingFileHandler("requests.log", maxBytes=10 * 1024 ** 2, backupCount=100)
     fh.setLevel(logging.DEBUG)
-    fh.setFormatter(formatter)
-    app.logger.addHandler(fh)
+    fh.setFormatter(JsonFormatter())
+    # The console only shows problems
+    console = logging.StreamHandler()
+    console.setLevel(logging.WARNING)
+    console.setFormatter(
+        logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    )
+    listener = queue_logging(app.logger, fh, console)
+    atexit.register(listener.stop)
+
+
+def wsgi() -> Flask:
+    app = create_app(os.getenv("FLASK_CONFIG") or "default")
+    setup_logging(app)
     return app
 
 
+def asgi() -> AsgiApp:
+    app = create_app(os.getenv("FLASK_CONFIG") or "default")
+    setup_logging(app)
+    return AsgiApp(app)
+
+
 if __name__ == "query_proxy.flask_main":
     app = create_app(os.getenv("FLASK_CONFIG") or "default")
@@ -0,0 +1,225 @@
+"""
+Access to the dictionary of the tagger without loading spaCy.
+
+The pickled Aho-Corasick automaton, as written by preprocessing.onto2trie,
+maps every label to the IDs of its concepts. It is loaded once per process
+and shared read-only between all threads.
+"""
+
+import pickle
+import re
+import threading
+from bisect import bisect_left
+from collections import namedtuple
+from functools import cmp_to_key, lru_cache
+from pathlib import Path
+from typing import Dict, List, Tuple, Union
+
+from ahocorasick import Automaton
+
+Annotation = namedtuple("Annotation", ["name", "label", "start", "end"])
+
+WHITESPACE = re.compile(r"\s+")
+
+_LOCK = threading.Lock()
+_AUTOMATA: Dict[str, Automaton] = dict()
+_PREFIX_INDICES: Dict[str, "PrefixIndex"] = dict()
+
+
+def load_automaton(trie_file: Union[Path, str]) -> Automaton:
+    """Import a pickled automaton, at most once per process."""
+    key = str(trie_file)
+    with _LOCK:
+        if key not in _AUTOMATA:
+            with open(key, "rb") as trie:
+                _AUTOMATA[key] = pickle.load(trie)
+        return _AUTOMATA[key]
+
+
+class PrefixIndex:
+    """
+    Case-insensitive completion of labels.
+
+    The labels are kept in a sorted list, so that all labels starting with
+    a prefix are found by binary search. Labels only differing in case,
+    e.g. 'Humans' and 'humans', are merged.
+    """
+
+    def __init__(self, automaton: Automaton) -> None:
+        entries: Dict[str, Tuple[str, Tuple[str, ...]]] = dict()
+        for label, (_, ids) in automaton.items():
+            key = label.casefold()
+            if key in entries:
+                first, known = entries[key]
+                entries[key] = (
+                    min(first, label),
+                    known + tuple(i for i in ids if i not in known),
+                )
+            else:
+                entries[key] = (label, tuple(ids))
+        self.keys = sorted(entries)
+        self.entries = [entries[key] for key in self.keys]
+
+    def complete(
+        self, prefix: str, size: int = 10
+    ) -> List[Tuple[str, Tuple[str, ...]]]:
+        """
+        Find up to size labels starting with prefix in alphabetical order.
+
+        Returns
+        -------
+        List[Tuple[str, Tuple[str, ...]]]
+            Pairs of labels and the IDs of their concepts.
+        """
+        prefix = prefix.casefold()
+        completions: List[Tuple[str, Tuple[str, ...]]] = []
+        i = bisect_left(self.keys, prefix)
+        while i < len(self.keys) and len(completions) < size:
+            if not self.keys[i].startswith(prefix):
+                break
+            completions.append(self.entries[i])
+            i += 1
+        return completions
+
+
+def get_prefix_index(trie_file: Union[Path, str]) -> PrefixIndex:
+    """Build the PrefixIndex of an automaton on first use."""
+    key = str(trie_file)
+    automaton = load_automaton(key)
+    with _LOCK:
+        if key not in _PREFIX_INDICES:
+            _PREFIX_INDICES[key] = PrefixIndex(automaton)
+        return _PREFIX_INDICES[key]
+
+
+def find_annotations(automaton: Automaton, text: str) -> List[Annotation]:
+    """
+    Find all labels of the automaton in a text.
+    Labels have to be delimited by non-alphanumeric characters.
+    """
+    annotations = []
+    for end, (key, labels) in automaton.iter(text):
+        end += 1
+        if len(text) != end and text[end].isalnum():
+            continue
+        start = end - len(key) - 1
+        if start >= 0 and text[start].isalnum():
+            continue
+        annotations.append(Annotation(key, labels, start + 1, end))
+    return annotations
+
+
+def entity_sort(entity1: Annotation, entity2: Annotation) -> int:
+    """
+    A comparison function for Annotations.
+
+    Parameters
+    ----------
+    entity1 : Annotation
+        An Annotation.
+    entity2 : Annotation
+        Another Annotation.
+
+    Returns
+    -------
+    int
+        -1, if entity1 starts sooner
+            1, if entity1 starts later
+            the difference between the end of entity2 and entity1 otherwise.
+
+    """
+    if entity1.start < entity2.start:
+        return -1
+    if entity1.start > entity2.start:
+        return 1
+    return entity2.end - entity1.end
+
+
+def remove_overlap(entities: List[Annotation]) -> List[Annotation]:
+    """
+    Removes shortes matches.
+    E.g. when 'hydrogen peroxide' and 'hydrogen' have overlapping
+    annotations, 'hydrogen peroxide' is returned.
+
+    Parameters
+    ----------
+    entities : List[Annotation]
+        A list of entities extracted from a text.
+
+    Returns
+    -------
+    List[Annotation]
+        The widest annotations in case of an overlap.
+
+    """
+    filtered = []
+    start = -1
+    end = -1
+    # util.filter_spans got introduced in spaCy 2.1.4 (May 12, 2019)
+    # https://spacy.io/api/top-level#util.filter_spans
+    # We keep this function since it is older and tested.
+    for entity in entities:
+        # The first entity will never satisfy these conditions
+        if entity.start >= start and entity.start <= end:
+            continue
+
+        filtered.append(entity)
+        start = entity.start
+        end = entity.end
+    return filtered
+
+
+def disambiguate(annotations: List[Annotation]) -> List[Annotation]:
+    """
+    Restrict the candidates of ambiguous annotations to the concepts
+    that have been found unambiguously elsewhere in the same text.
+    """
+    uniques = set()
+    for i, anno in enumerate(annotations):
+        if len(anno.label) == 1:
+            uniques.update(anno.label)
+    for i, anno in enumerate(annotations):
+        if len(anno.label) == 1:
+            continue
+        candidates = uniques.intersection(anno.label)
+        if candidates:
+            annotations[i] = Annotation(
+                anno.name, tuple(candidates), anno.start, anno.end
+            )
+    return annotations
+
+
+@lru_cache(maxsize=10_000)
+def resolve_term(trie_file: str, term: str) -> Tuple[Tuple[Tuple[str, ...], ...], str]:
+    """
+    Recognize the concepts in a literal search term.
+
+    The same rules as for tagging documents apply, except for those requiring
+    part-of-speech tags. Results are cached per term.
+
+    Parameters
+    ----------
+    trie_file : str
+        Path to the pickled automaton
+    term : str
+        A literal part of a request
+
+    Returns
+    -------
+    Tuple[Tuple[Tuple[str, ...], ...], str]
+        The candidate concept IDs of every recognized span and
+        the rest of the term that did not belong to any span.
+    """
+    annotations = find_annotations(load_automaton(trie_file), term)
+    annotations.sort(key=cmp_to_key(entity_sort))
+    annotations = disambiguate(remove_overlap(annotations))
+    concepts = []
+    rest = []
+    last = 0
+    for annotation in annotations:
+        concepts.append(tuple(sorted(annotation.label)))
+        rest.append(term[last : annotation.start])
+        last = annotation.end
+    rest.append(term[last:])
+    leftover = WHITESPACE.sub(" ", " ".join(rest)).strip()
+    return tuple(concepts), leftover
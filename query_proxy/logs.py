@@ -0,0 +1,80 @@
+"""
+Logging of the proxy without blocking the requests.
+
+The records are put into a queue and written to the files by a background
+thread, which also formats them. requests.log holds one JSON object per line,
+searches are logged with their parameters and the durations of their stages.
+"""
+
+import copy
+import json
+import logging
+import queue
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Dict
+
+# Records waiting for the handlers at most, further ones are dropped
+QUEUE_SIZE = 10000
+
+
+class JsonFormatter(logging.Formatter):
+    """A JSON object per record, with the fields passed as extra={"fields": {...}}."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(
+                timespec="milliseconds"
+            ),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    Puts the records into the queue unformatted.
+
+    QueueHandler formats the records before putting them into the queue,
+    which folds the traceback into the message and drops exc_info.
+    Only the message is merged with its arguments here, as they might change
+    before the listener formats the record. Records that do not fit into the
+    queue are dropped, so that a stalled handler can not use up the memory.
+    """
+
+    def __init__(self, log_queue: "queue.Queue[logging.LogRecord]") -> None:
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def queue_logging(
+    logger: logging.Logger, *handlers: logging.Handler, queue_size: int = QUEUE_SIZE
+) -> QueueListener:
+    """
+    Let the handlers format and write the records of logger in a background
+    thread. Stopping the returned listener writes the remaining records.
+    """
+    log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(queue_size)
+    logger.addHandler(DeferredQueueHandler(log_queue))
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    return listener
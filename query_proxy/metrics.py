@@ -0,0 +1,138 @@
+"""
+Metrics of the search in the text format of Prometheus.
+
+Every search measures the durations of its stages in a Timings object,
+which is added to the histograms of Metrics and sent to the client
+in the Server-Timing header.
+"""
+
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Mapping, Optional, Sequence, Set, Tuple
+
+# Upper bounds of the histogram buckets in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+STAGES = ("parse", "build", "elasticsearch", "took", "fallback", "serialize", "wait")
+
+
+class Timings:
+    """The durations of the stages of a single request and what happened."""
+
+    def __init__(self) -> None:
+        self.stages: Dict[str, float] = {}
+        # 'fallback' and 'zero_hits'
+        self.events: Set[str] = set()
+        # The searches sent to Elasticsearch and their responses, for the slow log
+        self.searches: List[Tuple[Any, Any]] = []
+
+    def add(self, stage: str, seconds: float) -> None:
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def measure(self, stage: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start)
+
+    def server_timing(self) -> str:
+        """The value of the Server-Timing header, durations in milliseconds."""
+        return ", ".join(
+            f"{stage};dur={seconds * 1000:.1f}"
+            for stage, seconds in self.stages.items()
+        )
+
+
+class Histogram:
+    def __init__(self, buckets: Sequence[float] = BUCKETS) -> None:
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+    def render(self, name: str, labels: str) -> List[str]:
+        lines = []
+        for bound, count in zip(self.buckets, self.counts):
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {count}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {self.count}')
+        lines.append(f"{name}_sum{{{labels}}} {self.sum}")
+        lines.append(f"{name}_count{{{labels}}} {self.count}")
+        return lines
+
+
+class Metrics:
+    """The metrics of all requests served by a worker."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.stages = {stage: Histogram() for stage in STAGES}
+        self.counters: Counter = Counter(
+            requests=0, fallbacks=0, zero_hits=0, coalesced=0
+        )
+
+    def observe(self, timings: Timings, shared: bool = False) -> None:
+        with self._lock:
+            for stage, seconds in timings.stages.items():
+                self.stages[stage].observe(seconds)
+            self.counters["requests"] += 1
+            if "fallback" in timings.events:
+                self.counters["fallbacks"] += 1
+            if "zero_hits" in timings.events:
+                self.counters["zero_hits"] += 1
+            if shared:
+                self.counters["coalesced"] += 1
+
+    def render(self, admission: Optional[Mapping[str, int]] = None) -> str:
+        """
+        The metrics in the text format of Prometheus.
+
+        Parameters
+        ----------
+        admission : Mapping[str, int], optional
+            The statistics of the admission control.
+        """
+        name = "query_proxy_stage_seconds"
+        lines = [
+            f"# HELP {name} Duration of the stages of a search.",
+            f"# TYPE {name} histogram",
+        ]
+        with self._lock:
+            for stage, histogram in self.stages.items():
+                lines.extend(histogram.render(name, f'stage="{stage}"'))
+            counters = dict(self.counters)
+        descriptions = {
+            "requests": "Searches answered.",
+            "fallbacks": "Searches that ran the fallback query.",
+            "zero_hits": "Searches without any hit.",
+            "coalesced": "Searches answered with the result of an identical request.",
+        }
+        for counter, description in descriptions.items():
+            name = f"query_proxy_{counter}_total"
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name} {counters[counter]}")
+        if admission is not None:
+            name = "query_proxy_admission_total"
+            lines.append(
+                f"# HELP {name} Requests by decision of the admission control."
+            )
+            lines.append(f"# TYPE {name} counter")
+            for outcome in ("admitted", "queued", "rejected"):
+                lines.append(f'{name}{{outcome="{outcome}"}} {admission[outcome]}')
+            for gauge in ("active", "waiting"):
+                name = f"query_proxy_{gauge}_requests"
+                lines.append(f"# HELP {name} Searches that are {gauge} right now.")
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {admission[gauge]}")
+        return "\n".join(lines) + "\n"
@@ -16,32 +16,50 @@ import shutil
 import sys
 import tempfile
 import time
+from contextlib import ExitStack
 from datetime import datetime
 from ftplib import FTP, Error, error_perm
 from pathlib import Path
-from typing import Any, Dict, Iterator, List, Tuple
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
 from urllib.parse import quote
 
 import elasticsearch
 import requests
 import spacy
 from elasticsearch.exceptions import ConnectionTimeout
-from elasticsearch.helpers import streaming_bulk
 
 from parsers import pubmed
-from query_proxy.elastic_import import INDEX, setup
-from query_proxy.tagger import Tagger
+from query_proxy.bulk import DEAD_LETTER_FILE, BulkSink
+from query_proxy.concept_stats import ConceptStatistics
+from query_proxy.elastic_import import INDEX, bulk_load, document_count, setup
+from query_proxy.profiling import ENV_DIRECTORY, EVERY_ARCHIVE, Profiler
+from query_proxy.progress import PROGRESS_FILE, Checkpoint, ProgressStore
+from query_proxy.tagger import Tagger, concept_ids, expand_concepts, load_ancestors
+from query_proxy.telemetry import Telemetry
 
 MD5_MATCHER = re.compile(b"MD5\\(.+?\\)= ([0-9a-fA-F]{32})")
 NCBI_SERVER = "ftp.ncbi.nlm.nih.gov"
 BASELINE_DIR = "pubmed/baseline"
+DONE_FILE = Path("processed.log")
 UPDATE_DIR = "pubmed/updatefiles"
 
 logger = logging.getLogger("ncbi")
 
 
 class NcbiProcessor:
-    def __init__(self, trie_file: Path):
+    def __init__(
+        self,
+        trie_file: Path,
+        ancestor_file: Optional[Path] = None,
+        counts_file: Optional[Path] = None,
+        cooccurrence_file: Optional[Path] = None,
+        telemetry: Optional[Telemetry] = None,
+        profiler: Optional[Profiler] = None,
+        progress_file: Path = PROGRESS_FILE,
+        bulk: Optional[BulkSink] = None,
+        bulk_load: bool = False,
+        force_merge: Optional[int] = None,
+    ):
         self.logger = logging.getLogger("ncbi")
         dt = datetime.now()
         fh = logging.FileHandler(f"{dt.strftime('%Y%m%d-%H%M%S')}.log")
@@ -54,6 +72,20 @@ class NcbiProcessor:
         self.logger.debug("Setting up pipeline")
         self.nlp = Tagger.setup_pipeline(trie_file)
         self.logger.debug("Pipeline has been set up")
+        self.ancestors: Dict[str, Tuple[str, ...]] = dict()
+        if ancestor_file is not None:
+            self.ancestors = load_ancestors(ancestor_file)
+        self.statistics = ConceptStatistics(counts_file, cooccurrence_file)
+        self.telemetry = telemetry if telemetry is not None else Telemetry()
+        self.profiler = (
+            profiler if profiler is not None else Profiler.from_env(every=EVERY_ARCHIVE)
+        )
+        self.progress = ProgressStore(progress_file)
+        self.bulk = bulk if bulk is not None else BulkSink()
+        self.bulk_load = bulk_load
+        self.force_merge = force_merge
+        # Archives marked as done by earlier versions
+        self.progress.migrate(DONE_FILE)
 
     def list_ncbi_files(self, path: str) -> List[Tuple[str, Dict[str, str]]]:
         timeout = 60
@@ -120,15 +152,11 @@ class NcbiProcessor:
             and name[1]["type"] == "file"
             and name[0].endswith("xml.gz")
         )
-        done_file = Path("processed.log")
-        if done_file.exists():
-            with done_file.open("rt") as done:
-                processed = list(x.rstrip() for x in done)
-        else:
-            done_file.touch()
-            processed = []
+        processed = self.progress.done_archives()
         try:
             conn = setup()
+            if self.statistics.counts is not None:
+                self.statistics.begin(document_count(conn))
         except (
             elasticsearch.exceptions.RequestError,
             elasticsearch.exceptions.ConnectionError,
@@ -136,107 +164,185 @@ class NcbiProcessor:
             self.logger.error(e)
             print("There have been errors. Please check the log.", file=sys.stderr)
             return
-        for archive in archives:
-            total, _, free = shutil.disk_usage(".")
-            if free / total < 0.05:
-                self.logger.error(
-                    "Only %s percent of disk space left. Will not attempt to import %s."
-                    + " Stopping now.",
-                    "{:.2f}".format(free / total * 100),
-                    archive,
-                )
-                break
-            if archive in processed:
-                continue
-            if not archive + ".md5" in md5:
-                self.logger.warn("No md5 checksum available for %s", archive)
-            archive_url = f"https://{NCBI_SERVER}/{UPDATE_DIR if update else BASELINE_DIR}/{archive}"
-            self.logger.debug("Processing %s", archive_url)
-            for retry in [60, 120, 180, 240, 300]:
-                try:
-                    r = requests.get(archive_url, stream=True)
-                except requests.exceptions.ConnectionError as e:
-                    self.logger.warning(e)
-                    time.sleep(retry)
-                else:
+        with ExitStack() as stack:
+            if self.bulk_load:
+                stack.enter_context(bulk_load(conn, force_merge=self.force_merge))
+            for archive in archives:
+                total, _, free = shutil.disk_usage(".")
+                if free / total < 0.05:
+                    self.logger.error(
+                        "Only %s percent of disk space left. Will not attempt to import %s."
+                        + " Stopping now.",
+                        "{:.2f}".format(free / total * 100),
+                        archive,
+                    )
                     break
-            else:
-                # Connectivity issue persists, give up for now
-                break
-            with open(os.path.join(path, archive), "wb") as fd:
-                for chunk in r.iter_content(chunk_size=1_048_576):
-                    fd.write(chunk)
+                if archive in processed:
+                    self.telemetry.count("archives_skipped")
+                    continue
+                if not archive + ".md5" in md5:
+                    self.logger.warn("No md5 checksum available for %s", archive)
+                archive_url = f"https://{NCBI_SERVER}/{UPDATE_DIR if update else BASELINE_DIR}/{archive}"
+                self.logger.debug("Processing %s", archive_url)
+                with self.telemetry.archive_report(archive):
+                    # An interrupted archive is kept, its checksum is verified again
+                    if (
+                        self.progress.position(archive).position == 0
+                        or not os.path.exists(os.path.join(path, archive))
+                    ) and not self.download(archive_url, os.path.join(path, archive)):
+                        # Connectivity issue persists, give up for now
+                        break
+                    try:
+                        r = requests.get(archive_url + ".md5")
+                    except requests.exceptions.ConnectionError as e:
+                        self.logger.warning(e)
+                        continue
+                    match = MD5_MATCHER.match(r.content)
+                    md5sum = hashlib.md5()
+                    try:
+                        with open(os.path.join(path, archive), "rb") as compare_this:
+                            with self.telemetry.time("verify"):
+                                block = compare_this.read(4096)
+                                while len(block) != 0:
+                                    md5sum.update(block)
+                                    block = compare_this.read(4096)
+                    except Exception as e:
+                        self.logger.error(e)
+                    digest = md5sum.hexdigest()
+                    if match is None:
+                        self.logger.warning(
+                            "Could not find checksum in %s. Entry was: %s.",
+                            archive,
+                            r.content,
+                        )
+                        continue
+                    if digest != match.group(1).decode("utf-8"):
+                        self.logger.warning(
+                            "MD5 checksum of %s did not match. Expected: %s. Was: %s."
+                            + " Skipping the archive.",
+                            archive,
+                            match.group(1),
+                            digest,
+                        )
+                        self.telemetry.count("archives_failed")
+                        os.unlink(os.path.join(path, archive))
+                        # Updates should be done in a strictly ascending fashion
+                        # Try again later
+                        if update:
+                            break
+                        continue
+                    self.logger.debug("Indexing")
+                    checkpoint = Checkpoint(
+                        self.progress, archive, digest, statistics=self.statistics
+                    )
+                    if checkpoint.start.position:
+                        self.logger.info(
+                            "Resuming %s after %s at position %d",
+                            archive,
+                            checkpoint.start.last_id,
+                            checkpoint.start.position,
+                        )
+                    completed = False
+                    with self.profiler.profile(f"archive-{archive}"):
+                        try:
+                            with self.telemetry.time(
+                                "bulk"
+                            ), self.telemetry.count_retries(self.bulk):
+                                for ok, action in self.bulk.index(
+                                    conn,
+                                    self.telemetry.timed(
+                                        self.index(
+                                            os.path.join(path, archive), checkpoint
+                                        ),
+                                        "prepare",
+                                    ),
+                                    index=INDEX,
+                                ):
+                                    self.telemetry.count_bulk(ok, action)
+                                    checkpoint.acknowledge(
+                                        ok, action["index"].get("status")
+                                    )
+                                    if not ok and action["index"]["status"] != 409:
+                                        self.logger.warning(action)
+                            completed = True
+                        except ConnectionTimeout as e:
+                            self.logger.warning(
+                                "Timeout occurred while processing archive %s", archive
+                            )
+                            self.logger.warning(e)
+                        finally:
+                            checkpoint.save()
+                    if not (completed and checkpoint.finish()):
+                        # Continued at the last acknowledged citation by the next run
+                        self.telemetry.count("archives_interrupted")
+                        if update:
+                            break
+                        continue
+                    os.unlink(os.path.join(path, archive))
+        self.telemetry.finish()
+        if cleanup is not None:
+            cleanup()
+
+    def download(self, archive_url: str, destination: str) -> bool:
+        for retry in [60, 120, 180, 240, 300]:
             try:
-                r = requests.get(archive_url + ".md5")
+                with self.telemetry.time("download"):
+                    r = requests.get(archive_url, stream=True)
             except requests.exceptions.ConnectionError as e:
                 self.logger.warning(e)
-                continue
-            match = MD5_MATCHER.match(r.content)
-            md5sum = hashlib.md5()
-            try:
-                with open(os.path.join(path, archive), "rb") as compare_this:
-                    block = compare_this.read(4096)
-                    while len(block) != 0:
-                        md5sum.update(block)
-                        block = compare_this.read(4096)
-            except Exception as e:
-                self.logger.error(e)
-            digest = md5sum.hexdigest()
-            if match is None:
-                self.logger.warning(
-                    "Could not find checksum in %s. Entry was: %s.", archive, r.content
-                )
-                continue
-            if digest != match.group(1).decode("utf-8"):
-                self.logger.warning(
-                    "MD5 checksum of %s did not match. Expected: %s. Was: %s."
-                    + " Skipping the archive.",
-                    archive,
-                    match.group(1),
-                    digest,
-                )
-                os.unlink(os.path.join(path, archive))
-                # Updates should be done in a strictly ascending fashion
-                # Try again later
-                if update:
-                    break
-                continue
-            self.logger.debug("Indexing")
-            try:
-                for ok, action in streaming_bulk(
-                    index=INDEX,
-                    client=conn,
-                    actions=self.index(os.path.join(path, archive)),
-                    raise_on_error=False,
-                    request_timeout=60,
-                ):
-                    if not ok and action["index"]["status"] != 409:
-                        self.logger.warning(action)
-            except ConnectionTimeout as e:
-                self.logger.warning(
-                    "Timeout occurred while processing archive %s", archive
-                )
-                self.logger.warning(e)
-            with done_file.open("a") as done:
-                _ = done.write(f"{archive}\n")
-            os.unlink(os.path.join(path, archive))
-        if cleanup is not None:
-            cleanup()
+                time.sleep(retry)
+            else:
+                break
+        else:
+            return False
+        with open(destination, "wb") as fd:
+            chunks = r.iter_content(chunk_size=1_048_576)
+            for chunk in self.telemetry.timed(chunks, "download"):
+                fd.write(chunk)
+                self.telemetry.count("bytes_downloaded", len(chunk))
+        return True
 
-    def index(self, archive: str) -> Iterator[Dict[str, Any]]:
+    def index(
+        self, archive: str, checkpoint: Optional[Checkpoint] = None
+    ) -> Iterator[Dict[str, Any]]:
         with gzip.open(archive, "rt", encoding="utf-8") as data:
-            for entry in pubmed.parse(data):
+            # The concepts and ancestors are added as lists
+            parsed: Iterator[Dict[str, Any]] = self.telemetry.timed(
+                pubmed.parse(data), "parse"
+            )
+            for position, entry in enumerate(parsed):
+                self.telemetry.count("articles_parsed")
+                # Indexed before the last run was interrupted
+                if checkpoint is not None and checkpoint.skip(
+                    position, entry.get("PMID")
+                ):
+                    self.telemetry.count("articles_resumed")
+                    continue
                 if "action" in entry and entry["action"] == "delete":
+                    self.telemetry.count("articles_deleted")
                     continue
                 # Cleanse the text of character combinations that could be
                 # mistaken for MarkDown URLs. This will prevent the
                 # Mapper Annotated Text plugin from throwing an IllegalArgumentException.
-                if "title" in entry:
-                    doc = self.nlp(entry["title"].replace("](", "] ("))
-                    entry["title"] = annotate(doc)
-                if "abstract" in entry:
-                    doc = self.nlp(entry["abstract"].replace("](", "] ("))
-                    entry["abstract"] = annotate(doc)
+                concepts: Set[str] = set()
+                with self.telemetry.time("tag"):
+                    if "title" in entry:
+                        doc = self.nlp(entry["title"].replace("](", "] ("))
+                        entry["title"] = annotate(doc)
+                        concepts.update(concept_ids(doc))
+                    if "abstract" in entry:
+                        doc = self.nlp(entry["abstract"].replace("](", "] ("))
+                        entry["abstract"] = annotate(doc)
+                        concepts.update(concept_ids(doc))
+                self.telemetry.count("documents_tagged")
+                self.telemetry.tick()
+                # Exact matches on a keyword field can be cached as filters
+                if concepts:
+                    entry["concepts"] = sorted(concepts)
+                    if self.ancestors:
+                        entry["ancestors"] = sorted(
+                            expand_concepts(concepts, self.ancestors)
+                        )
                 doc = {
                     "_op_type": "index",
                     "_index": INDEX,
@@ -245,6 +351,13 @@ class NcbiProcessor:
                     "version_type": "external",
                 }
                 doc["_source"] = entry
+                # Counted once Elasticsearch has acknowledged the document
+                if checkpoint is not None:
+                    checkpoint.sent(
+                        position, doc["_id"], concepts, entry.get("ancestors", ())
+                    )
+                else:
+                    self.statistics.add(concepts, entry.get("ancestors", ()))
                 yield doc
 
 
@@ -275,9 +388,86 @@ if __name__ == "__main__":
         type=Path,
         help="Path to a pickled automaton to be used for tagging",
     )
+    PARSER.add_argument(
+        "-a",
+        "--ancestors",
+        type=Path,
+        help="Path to the pickled ancestors of all concepts for query expansion",
+    )
+    PARSER.add_argument(
+        "-c",
+        "--counts",
+        type=Path,
+        help="Path to the table of documents per concept to be updated",
+    )
+    PARSER.add_argument(
+        "-m",
+        "--cooccurrences",
+        type=Path,
+        help="Path to the matrix of documents per pair of concepts to be updated",
+    )
     PARSER.add_argument(
         "-u", "--update", help="Import daily update files", action="store_true"
     )
+    PARSER.add_argument(
+        "-r",
+        "--reports",
+        type=Path,
+        help="Directory for JSON reports on the throughput of every file and the run",
+    )
+    PARSER.add_argument(
+        "--interval",
+        type=float,
+        default=30.0,
+        help="Seconds between progress summaries on the console, 0 disables them",
+    )
+    PARSER.add_argument(
+        "--trace-memory",
+        action="store_true",
+        help="Record the peak memory usage with tracemalloc (slow)",
+    )
+    PARSER.add_argument(
+        "--profile",
+        type=Path,
+        help="Directory for cProfile output of every n-th archive, "
+        + f"defaults to ${ENV_DIRECTORY}",
+    )
+    PARSER.add_argument(
+        "--profile-every",
+        type=int,
+        default=EVERY_ARCHIVE,
+        help="Profile every n-th archive",
+    )
+    PARSER.add_argument(
+        "--progress",
+        type=Path,
+        default=PROGRESS_FILE,
+        help="SQLite database of the archives and citations already indexed",
+    )
+    PARSER.add_argument(
+        "--bulk-threads",
+        type=int,
+        default=2,
+        help="Bulk requests sent to Elasticsearch at the same time",
+    )
+    PARSER.add_argument(
+        "--dead-letter",
+        type=Path,
+        default=DEAD_LETTER_FILE,
+        help="JSON lines file for the documents Elasticsearch did not accept",
+    )
+    PARSER.add_argument(
+        "--bulk-load",
+        action="store_true",
+        help="Switch off refreshes and replicas of the index while importing, "
+        + "see 'bulk_load_settings' of config.json",
+    )
+    PARSER.add_argument(
+        "--force-merge",
+        type=int,
+        metavar="SEGMENTS",
+        help="Merge the index into this many segments per shard afterwards",
+    )
     ARGS = PARSER.parse_args()
     AUTOMATON = Path(ARGS.automaton)
     if not AUTOMATON.exists():
@@ -286,8 +476,26 @@ if __name__ == "__main__":
     if not AUTOMATON.is_file():
         print(f"ERROR: Input argument {AUTOMATON} is not a file.", file=sys.stderr)
         sys.exit(1)
+    if ARGS.ancestors is not None and not ARGS.ancestors.is_file():
+        print(f"ERROR: Input file {ARGS.ancestors} does not exist.", file=sys.stderr)
+        sys.exit(1)
     try:
-        Ncbi = NcbiProcessor(ARGS.automaton)
+        Ncbi = NcbiProcessor(
+            ARGS.automaton,
+            ARGS.ancestors,
+            ARGS.counts,
+            ARGS.cooccurrences,
+            Telemetry(ARGS.reports, ARGS.interval, ARGS.trace_memory),
+            (
+                Profiler(ARGS.profile, ARGS.profile_every)
+                if ARGS.profile is not None
+                else Profiler.from_env(every=ARGS.profile_every)
+            ),
+            ARGS.progress,
+            BulkSink(ARGS.bulk_threads, dead_letter=ARGS.dead_letter),
+            ARGS.bulk_load,
+            ARGS.force_merge,
+        )
     except OSError as e:
         if str(e).startswith("[E050]"):
             logger.error(
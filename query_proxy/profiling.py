@@ -0,0 +1,124 @@
+"""
+Profiling of a sample of the searches of the proxy and of the archives of the
+indexing tools with cProfile.
+
+Profiling is switched on by the QUERY_PROXY_PROFILE environment variable,
+which names the directory of the profiles, or by the --profile option of the
+indexing tools. Every n-th search or archive is profiled, n is set by
+QUERY_PROXY_PROFILE_EVERY or --profile-every. Only the newest
+QUERY_PROXY_PROFILE_KEEP profiles are kept. They can be read with
+`python -m pstats <file>` or any viewer of cProfile output.
+"""
+
+import cProfile
+import os
+import re
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Iterator, Mapping, Optional
+
+ENV_DIRECTORY = "QUERY_PROXY_PROFILE"
+ENV_EVERY = "QUERY_PROXY_PROFILE_EVERY"
+ENV_KEEP = "QUERY_PROXY_PROFILE_KEEP"
+# Default sampling of the indexing tools, an archive takes minutes
+EVERY_ARCHIVE = 10
+UNSAFE = re.compile(r"[^A-Za-z0-9_.-]+")
+
+
+class Profiler:
+    """
+    Parameters
+    ----------
+    directory : Path, optional
+        Where the profiles are written to, profiling is off if None.
+    every : int
+        Every n-th call of sample() returns a profile.
+    keep : int
+        The number of profiles kept in directory, older ones are deleted.
+    """
+
+    def __init__(
+        self, directory: Optional[Path] = None, every: int = 100, keep: int = 50
+    ) -> None:
+        self.directory = directory
+        if directory is not None:
+            directory.mkdir(parents=True, exist_ok=True)
+        self.every = max(every, 1)
+        self.keep = keep
+        self.count = 0
+        # Only a single profile may be active at a time
+        self._busy = False
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(
+        cls, every: int = 100, environ: Mapping[str, str] = os.environ
+    ) -> "Profiler":
+        """The profiler configured by the environment, every is the default."""
+        directory = environ.get(ENV_DIRECTORY)
+        return cls(
+            Path(directory) if directory else None,
+            every=int(environ.get(ENV_EVERY) or every),
+            keep=int(environ.get(ENV_KEEP) or 50),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.directory is not None
+
+    def sample(self) -> Optional[cProfile.Profile]:
+        """
+        A new profile, if this call is sampled. It has to be passed to
+        save() or discard() afterwards.
+        """
+        if self.directory is None:
+            return None
+        with self._lock:
+            self.count += 1
+            if self.count % self.every != 0 or self._busy:
+                return None
+            self._busy = True
+        return cProfile.Profile()
+
+    def save(self, profile: cProfile.Profile, name: str) -> Optional[Path]:
+        """Write the profile to the directory, with name in its file name."""
+        try:
+            if self.directory is None:
+                return None
+            timestamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+            path = self.directory / f"{timestamp}-{UNSAFE.sub('_', name)[:80]}.prof"
+            profile.dump_stats(str(path))
+            self._prune()
+            return path
+        finally:
+            self.discard(profile)
+
+    def discard(self, profile: cProfile.Profile) -> None:
+        with self._lock:
+            self._busy = False
+
+    def _prune(self) -> None:
+        if self.directory is None:
+            return
+        profiles = sorted(self.directory.glob("*.prof"))
+        for path in profiles[: max(len(profiles) - self.keep, 0)]:
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+    @contextmanager
+    def profile(self, name: str) -> Iterator[None]:
+        """Profile the block, if it is sampled."""
+        profile = self.sample()
+        if profile is None:
+            yield
+            return
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            self.save(profile, name)
@@ -0,0 +1,265 @@
+"""
+Progress of the indexing tools, so that an interrupted run can be resumed.
+
+The position of the last citation acknowledged by Elasticsearch is stored
+for every archive in an SQLite database, together with its ID. An archive is
+only marked as done once all of its citations have been acknowledged.
+When a run is resumed, the citations before the stored position are skipped
+right after parsing, so they are neither tagged nor sent again.
+
+The positions count all entries of an archive in the order of the parser,
+including deletions. streaming_bulk returns one result per action in the
+order of the actions, which is used to tell which citations have been
+acknowledged.
+
+The concept statistics only count acknowledged citations and are saved right
+before the position, so that a resumed run neither loses nor, apart from a
+crash between the two, repeats their counts. The co-occurrences of an archive
+are merged into the matrix once the archive is done.
+"""
+
+import logging
+import sqlite3
+from collections import deque
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Deque, Iterable, NamedTuple, Optional, Set, Tuple
+
+from query_proxy.concept_stats import ConceptStatistics
+
+PROGRESS_FILE = Path("progress.sqlite")
+# The last acknowledged position is written after this many results
+CHECKPOINT_EVERY = 500
+# Rewriting the co-occurrences of an archive is expensive, so it is done less often
+COOCCURRENCE_CHECKPOINT_EVERY = 20000
+
+logger = logging.getLogger("progress")
+
+
+class Position(NamedTuple):
+    """The number of entries of an archive that are done and the ID of the last one."""
+
+    position: int = 0
+    last_id: Optional[str] = None
+
+
+class ProgressStore:
+    """
+    Parameters
+    ----------
+    path : Path
+        The SQLite database, created if it does not exist.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._connection = sqlite3.connect(str(path))
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS archives ("
+                "name TEXT PRIMARY KEY, "
+                "signature TEXT, "
+                "position INTEGER NOT NULL DEFAULT 0, "
+                "last_id TEXT, "
+                "done INTEGER NOT NULL DEFAULT 0, "
+                "updated TEXT)"
+            )
+
+    def close(self) -> None:
+        self._connection.close()
+
+    def migrate(self, done_file: Path) -> int:
+        """
+        Mark the archives listed in processed.log, as written by earlier
+        versions, as done. Archives already in the store are left alone.
+
+        Returns
+        -------
+        int
+            The number of archives taken over.
+        """
+        if not done_file.exists():
+            return 0
+        with done_file.open("rt") as done:
+            names = [line.rstrip() for line in done if line.strip()]
+        with self._connection:
+            before = self._connection.total_changes
+            self._connection.executemany(
+                "INSERT OR IGNORE INTO archives (name, done, updated) VALUES (?, 1, ?)",
+                [(name, _now()) for name in names],
+            )
+            migrated = self._connection.total_changes - before
+        if migrated:
+            logger.info("Took over %d archives from %s", migrated, done_file)
+        return migrated
+
+    def done_archives(self) -> Set[str]:
+        rows = self._connection.execute("SELECT name FROM archives WHERE done = 1")
+        return {name for (name,) in rows}
+
+    def is_done(self, name: str, signature: Optional[str] = None) -> bool:
+        """Whether the archive is done, and has not changed if signature is given."""
+        row = self._connection.execute(
+            "SELECT done, signature FROM archives WHERE name = ?", (name,)
+        ).fetchone()
+        if row is None or not row[0]:
+            return False
+        return signature is None or row[1] is None or row[1] == signature
+
+    def resume(self, name: str, signature: Optional[str] = None) -> Position:
+        """
+        The position to continue the archive at. It starts over, if the
+        signature, e.g. the checksum, of the archive has changed.
+        """
+        row = self._connection.execute(
+            "SELECT position, last_id, signature, done FROM archives WHERE name = ?",
+            (name,),
+        ).fetchone()
+        if row is not None and (signature is None or row[2] in (None, signature)):
+            if not row[3]:
+                return Position(row[0], row[1])
+        with self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO archives "
+                "(name, signature, position, last_id, done, updated) "
+                "VALUES (?, ?, 0, NULL, 0, ?)",
+                (name, signature, _now()),
+            )
+        return Position()
+
+    def acknowledge(self, name: str, position: Position) -> None:
+        with self._connection:
+            self._connection.execute(
+                "UPDATE archives SET position = ?, last_id = ?, updated = ? "
+                "WHERE name = ?",
+                (position.position, position.last_id, _now(), name),
+            )
+
+    def finish(self, name: str) -> None:
+        with self._connection:
+            self._connection.execute(
+                "UPDATE archives SET done = 1, updated = ? WHERE name = ?",
+                (_now(), name),
+            )
+
+    def position(self, name: str) -> Position:
+        row = self._connection.execute(
+            "SELECT position, last_id FROM archives WHERE name = ?", (name,)
+        ).fetchone()
+        return Position() if row is None else Position(row[0], row[1])
+
+
+class Checkpoint:
+    """
+    The progress of a single archive while it is indexed.
+
+    index() calls skip() for every parsed entry and sent() for every action
+    it yields, the loop over the bulk results calls acknowledge() for every result.
+
+    Parameters
+    ----------
+    store : ProgressStore
+        Where the acknowledged position is written to.
+    name : str
+        The archive.
+    signature : str, optional
+        Identifies the content of the archive, e.g. its checksum.
+    every : int, optional
+        The position is written after this many acknowledgements. Defaults
+        to CHECKPOINT_EVERY, or COOCCURRENCE_CHECKPOINT_EVERY if statistics
+        count co-occurrences.
+    statistics : ConceptStatistics, optional
+        Counts the concepts of the acknowledged citations and is saved
+        together with the position.
+    """
+
+    def __init__(
+        self,
+        store: ProgressStore,
+        name: str,
+        signature: Optional[str] = None,
+        every: Optional[int] = None,
+        statistics: Optional[ConceptStatistics] = None,
+    ) -> None:
+        self.store = store
+        self.name = name
+        if every is None:
+            every = CHECKPOINT_EVERY
+            if statistics is not None and statistics.cooccurrences is not None:
+                every = COOCCURRENCE_CHECKPOINT_EVERY
+        self.every = every
+        self.statistics = statistics
+        self.start = store.resume(name, signature)
+        self.acknowledged = self.start
+        if statistics is not None:
+            statistics.start(name, resume=self.start.position > 0)
+        self.failed = False
+        self._pending: Deque[Tuple[int, str, Iterable[str], Iterable[str]]] = deque()
+        self._unsaved = 0
+
+    def skip(self, position: int, entry_id: Any = None) -> bool:
+        """Whether the entry at position has been acknowledged in an earlier run."""
+        if position >= self.start.position:
+            return False
+        if position == self.start.position - 1 and entry_id != self.start.last_id:
+            logger.warning(
+                "%s: expected %s at position %d, found %s",
+                self.name,
+                self.start.last_id,
+                position,
+                entry_id,
+            )
+        return True
+
+    def sent(
+        self,
+        position: int,
+        entry_id: str,
+        concepts: Iterable[str] = (),
+        ancestors: Iterable[str] = (),
+    ) -> None:
+        """An action has been handed to the bulk requests, with its concepts."""
+        self._pending.append((position, entry_id, concepts, ancestors))
+
+    def acknowledge(self, ok: bool = True, status: Optional[int] = None) -> None:
+        """
+        The oldest action that has been sent has been answered with status.
+        Rejections and errors of the server end the acknowledged part of the
+        archive, so that it is sent again when the run is resumed.
+        """
+        position, entry_id, concepts, ancestors = self._pending.popleft()
+        if not ok and status is not None and (status == 429 or status >= 500):
+            self.failed = True
+        if self.failed:
+            return
+        self.acknowledged = Position(position + 1, entry_id)
+        if self.statistics is not None:
+            self.statistics.add(concepts, ancestors)
+        self._unsaved += 1
+        if self._unsaved >= self.every:
+            self.save()
+
+    def save(self) -> None:
+        """Write the statistics and then the position they correspond to."""
+        if self._unsaved:
+            if self.statistics is not None:
+                self.statistics.save()
+            self.store.acknowledge(self.name, self.acknowledged)
+            self._unsaved = 0
+
+    def finish(self) -> bool:
+        """
+        Mark the archive as done after all of its actions have been answered,
+        unless some of them have to be sent again.
+        """
+        self.save()
+        if self.failed:
+            return False
+        if self.statistics is not None:
+            self.statistics.finish()
+        self.store.finish(self.name)
+        return True
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec="seconds")
@@ -0,0 +1,92 @@
+"""
+Coalescing of identical requests that are in flight at the same time.
+
+The first caller of a key executes the function, every caller that arrives
+with the same key before it has finished waits for and shares its result.
+Nothing is kept once the execution has finished, so results are never stale.
+"""
+
+import asyncio
+import functools
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+
+class _Call:
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """Coalesces calls across the threads of a worker."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+
+    def do(self, key: Hashable, function: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        Execute function, unless a call with the same key is already running.
+
+        Returns
+        -------
+        Tuple[Any, bool]
+            The result of the function and whether it has been shared
+            with another caller. Exceptions are raised in all callers.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if call is None:
+                call = _Call()
+                self._calls[key] = call
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+        try:
+            call.result = function()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+
+class AsyncSingleFlight:
+    """
+    Coalesces coroutines running in the same event loop.
+
+    The function runs as a task of its own, which every caller awaits through
+    asyncio.shield, so that cancelling one of the callers, including the first
+    one, does not cancel the call for the others.
+    """
+
+    def __init__(self) -> None:
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+
+    async def do(
+        self, key: Hashable, function: Callable[[], Awaitable[Any]]
+    ) -> Tuple[Any, bool]:
+        """See SingleFlight.do()"""
+        call = self._calls.get(key)
+        if call is not None:
+            return await asyncio.shield(call), True
+        call = asyncio.ensure_future(function())
+        self._calls[key] = call
+        call.add_done_callback(functools.partial(self._finished, key))
+        return await asyncio.shield(call), False
+
+    def _finished(self, key: Hashable, call: asyncio.Future) -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
+        # Retrieve the exception, so that it is not reported as unhandled
+        # when all callers have been cancelled
+        if not call.cancelled():
+            call.exception()
@@ -0,0 +1,264 @@
+"""
+Log of the searches that took longer than a threshold.
+
+Every slow search is written as a JSON line with its parameters, the durations
+of its stages, the queries sent to Elasticsearch and their 'took' and shard
+statistics. A sample of them is run again with 'profile' enabled and the
+profile is added to the record. All of this is done by a background thread,
+so the request only pays for putting the search into a queue.
+
+The most expensive shapes of queries, i.e. queries that only differ in their
+concepts, are listed by
+
+    python -m query_proxy.slowlog slow.log*
+"""
+
+import argparse
+import json
+import logging
+import queue
+import random
+import statistics
+import sys
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Mapping, Optional, Tuple
+
+from elasticsearch_dsl import Search
+from elasticsearch_dsl.response import Response as EsResponse
+
+from query_proxy.metrics import Timings
+
+MAX_BYTES = 10 * 1024**2
+BACKUP_COUNT = 10
+
+
+def query_shape(value: Any) -> Any:
+    """The query without its values, e.g. concepts, sizes and dates."""
+    if isinstance(value, dict):
+        return {key: query_shape(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [query_shape(item) for item in value]
+    return "?"
+
+
+def _jsonable(value: Any) -> Any:
+    if hasattr(value, "to_dict"):
+        return value.to_dict()
+    return value
+
+
+class SlowLog:
+    """
+    Parameters
+    ----------
+    path : Path
+        The log file, rotated at MAX_BYTES. It is only created on the first slow search.
+    threshold : float
+        Searches taking at least this many milliseconds are logged.
+    profile_rate : float
+        The fraction of slow searches that is run again with 'profile' enabled.
+    queue_size : int
+        Slow searches beyond this many waiting to be written are dropped.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        threshold: float = 1000.0,
+        profile_rate: float = 0.0,
+        queue_size: int = 100,
+    ) -> None:
+        self.threshold = threshold
+        self.profile_rate = profile_rate
+        self.dropped = 0
+        self._queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(queue_size)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._logger = logging.getLogger(f"query_proxy.slowlog.{path}")
+        self._logger.propagate = False
+        self._logger.setLevel(logging.INFO)
+        if not self._logger.handlers:
+            handler = RotatingFileHandler(
+                path, maxBytes=MAX_BYTES, backupCount=BACKUP_COUNT, delay=True
+            )
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            self._logger.addHandler(handler)
+
+    @classmethod
+    def from_config(cls, config: Mapping) -> Optional["SlowLog"]:
+        """The slow log configured by SLOW_LOG, None if it is switched off."""
+        if not config.get("SLOW_LOG"):
+            return None
+        threshold = config.get("SLOW_LOG_THRESHOLD")
+        return cls(
+            Path(config["SLOW_LOG"]),
+            threshold=1000.0 if threshold is None else threshold,
+            profile_rate=config.get("SLOW_LOG_PROFILE_RATE") or 0.0,
+        )
+
+    def observe(self, query: Dict, timings: Timings, seconds: float) -> bool:
+        """
+        Queue the search for the log, if it took at least the threshold.
+
+        Returns
+        -------
+        bool
+            Whether the search has been queued.
+        """
+        if seconds * 1000 < self.threshold:
+            return False
+        entry = {
+            "time": datetime.now(timezone.utc).isoformat(timespec="milliseconds"),
+            "milliseconds": round(seconds * 1000, 1),
+            "request": query.get("request"),
+            "parameters": {
+                key: value for key, value in query.items() if key != "request"
+            },
+            "stages": {
+                stage: round(value * 1000, 1) for stage, value in timings.stages.items()
+            },
+            "events": sorted(timings.events),
+            "searches": list(timings.searches),
+            "profile": random.random() < self.profile_rate,
+        }
+        self._start()
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+        return True
+
+    def _start(self) -> None:
+        # Started on first use, so that it also runs in forked workers
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._work, name="slowlog", daemon=True
+                )
+                self._thread.start()
+
+    def _work(self) -> None:
+        while True:
+            entry = self._queue.get()
+            try:
+                self._logger.info(json.dumps(self.record(entry), default=str))
+            except Exception:
+                logging.getLogger("query_proxy.slowlog").exception(
+                    "Could not log slow search %s", entry.get("request")
+                )
+            finally:
+                self._queue.task_done()
+
+    def record(self, entry: Dict[str, Any]) -> Dict[str, Any]:
+        """The JSON record of a queued search."""
+        searches: List[Tuple[Search, EsResponse]] = entry.pop("searches")
+        profile = entry.pop("profile")
+        record = dict(entry)
+        record["searches"] = []
+        for prepared_search, es_response in searches:
+            body = prepared_search.to_dict()
+            record["searches"].append(
+                {
+                    "query": body,
+                    "took": getattr(es_response, "took", None),
+                    "timed_out": getattr(es_response, "timed_out", None),
+                    "shards": _jsonable(getattr(es_response, "_shards", None)),
+                }
+            )
+        if searches:
+            # The first query is the most specific one, the fallback follows
+            record["shape"] = json.dumps(
+                query_shape(record["searches"][0]["query"].get("query", {})),
+                sort_keys=True,
+            )
+        if profile and searches:
+            record["profile"] = self.profile(searches[-1][0])
+        return record
+
+    @staticmethod
+    def profile(prepared_search: Search) -> Any:
+        """The profile of the search, run again."""
+        try:
+            es_response = prepared_search.extra(profile=True).execute()
+        except Exception as e:
+            return {"error": str(e)}
+        return _jsonable(getattr(es_response, "profile", None))
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Wait until the queued searches have been written."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.01)
+        for handler in self._logger.handlers:
+            handler.flush()
+        return True
+
+
+def read_records(paths: List[Path]) -> Iterator[Dict[str, Any]]:
+    for path in paths:
+        with path.open("rt", encoding="utf-8") as log:
+            for line in log:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def summarize(records: Iterator[Dict[str, Any]], top: int = 10) -> List[Dict]:
+    """
+    The shapes of queries with the most time spent in slow searches.
+
+    Returns
+    -------
+    List[Dict]
+        The shape, the number of searches, their total, median and maximum
+        milliseconds and the request of the slowest search for each shape.
+    """
+    durations: Dict[str, List[float]] = defaultdict(list)
+    slowest: Dict[str, Tuple[float, Any]] = {}
+    for record in records:
+        shape = record.get("shape", "")
+        milliseconds = record["milliseconds"]
+        durations[shape].append(milliseconds)
+        if shape not in slowest or milliseconds > slowest[shape][0]:
+            slowest[shape] = (milliseconds, record.get("request"))
+    summary = [
+        {
+            "shape": shape,
+            "count": len(values),
+            "total": sum(values),
+            "median": statistics.median(values),
+            "max": max(values),
+            "example": slowest[shape][1],
+        }
+        for shape, values in durations.items()
+    ]
+    summary.sort(key=lambda entry: entry["total"], reverse=True)
+    return summary[:top]
+
+
+if __name__ == "__main__":
+    PARSER = argparse.ArgumentParser(
+        "List the shapes of queries that take the most time in the slow log"
+    )
+    PARSER.add_argument("logs", type=Path, nargs="+", help="Slow logs, e.g. slow.log*")
+    PARSER.add_argument("--top", type=int, default=10, help="Number of shapes")
+    ARGS = PARSER.parse_args()
+    for LOG in ARGS.logs:
+        if not LOG.is_file():
+            print(f"ERROR: Input file {LOG} does not exist.", file=sys.stderr)
+            sys.exit(1)
+    for ENTRY in summarize(read_records(ARGS.logs), ARGS.top):
+        print(
+            f"{ENTRY['count']:>6} searches, total {ENTRY['total'] / 1000:.1f} s, "
+            f"median {ENTRY['median']:.0f} ms, max {ENTRY['max']:.0f} ms"
+        )
+        print(f"    shape:   {ENTRY['shape']}")
+        print(f"    slowest: {ENTRY['example']}")
@@ -9,16 +9,21 @@ Created on Fri Jun 19 11:21:10 2020
 import logging
 import pickle
 import re  # Only used in exception handling
-from collections import namedtuple
 from functools import cmp_to_key
 from pathlib import Path
-from typing import List, Union
+from typing import Dict, Iterable, List, Set, Tuple, Union
 
 import spacy
 from intervaltree import IntervalTree
 from spacy.tokens import Span
 
-Annotation = namedtuple("Annotation", ["name", "label", "start", "end"])
+from query_proxy.lexicon import (
+    Annotation,
+    disambiguate,
+    entity_sort,
+    find_annotations,
+    remove_overlap,
+)
 
 NEGATIVE_TAX = set(
     [
@@ -105,35 +110,14 @@ class Tagger:
             An instance of an Aho-Corasick automaton
 
         """
-        text = doc.text
-        annotations = []
-        for end, (key, labels) in self.automaton.iter(text):
-            end += 1
-            if len(text) != end and text[end].isalnum():
-                continue
-            start = end - len(key) - 1
-            if start >= 0 and text[start].isalnum():
-                continue
-            annotations.append(Annotation(key, labels, start + 1, end))
+        annotations = find_annotations(self.automaton, doc.text)
         annotations.sort(key=self.EntityKey)
         annotations = self.remove_overlap(annotations)
         annotations = self.disambiguate(annotations)
         return self.retokenize(doc, annotations)
 
     def disambiguate(self, annotations: List[Annotation]) -> List[Annotation]:
-        uniques = set()
-        for i, anno in enumerate(annotations):
-            if len(anno.label) == 1:
-                uniques.update(anno.label)
-        for i, anno in enumerate(annotations):
-            if len(anno.label) == 1:
-                continue
-            candidates = uniques.intersection(anno.label)
-            if candidates:
-                annotations[i] = Annotation(
-                    anno.name, tuple(candidates), anno.start, anno.end
-                )
-        return annotations
+        return disambiguate(annotations)
 
     def retokenize(
         self, doc: spacy.language.Doc, annotations: List[Annotation]
@@ -211,63 +195,13 @@ class Tagger:
         return doc
 
     def remove_overlap(self, entities: List[Annotation]) -> List[Annotation]:
-        """
-        Removes shortes matches.
-        E.g. when 'hydrogen peroxide' and 'hydrogen' have overlapping
-        annotations, 'hydrogen peroxide' is returned.
-
-        Parameters
-        ----------
-        entities : List[Annotation]
-            A list of entities extracted from a text.
-
-        Returns
-        -------
-        List[Annotation]
-            The widest annotations in case of an overlap.
-
-        """
-        filtered = []
-        start = -1
-        end = -1
-        # util.filter_spans got introduced in spaCy 2.1.4 (May 12, 2019)
-        # https://spacy.io/api/top-level#util.filter_spans
-        # We keep this function since it is older and tested.
-        for entity in entities:
-            # The first entity will never satisfy these conditions
-            if entity.start >= start and entity.start <= end:
-                continue
-
-            filtered.append(entity)
-            start = entity.start
-            end = entity.end
-        return filtered
+        """See query_proxy.lexicon.remove_overlap"""
+        return remove_overlap(entities)
 
     @staticmethod
     def entity_sort(entity1: Annotation, entity2: Annotation) -> int:
-        """
-        A comparison function for Annotations.
-
-        Parameters
-        ----------
-        entity1 : Annotation
-            An Annotation.
-        entity2 : Annotation
-            Another Annotation.
-
-        Returns
-        -------
-        int
-            -1, if entity1 starts sooner
-                1, if entity1 starts later
-                the difference between the end of entity2 and entity1 otherwise.
-
-        """
-        if entity1.start < entity2.start:
-            return -1
-        if entity1.start > entity2.start:
-            return 1
-        return entity2.end - entity1.end
+        """See query_proxy.lexicon.entity_sort"""
+        return entity_sort(entity1, entity2)
 
     @staticmethod
     def setup_pipeline(
@@ -284,3 +218,33 @@ class Tagger:
         nlp.add_pipe(tagger, after="tagger")
         logger.info("Pipeline complete")
         return nlp
+
+
+def concept_ids(doc: spacy.tokens.doc.Doc) -> Set[str]:
+    """
+    Collect the IDs of all concepts found in a document.
+    Every candidate of an ambiguous entity is included.
+    """
+    ids: Set[str] = set()
+    for ent in doc.ents:
+        ids.update(ent._.id_candidates)
+    return ids
+
+
+def load_ancestors(ancestor_file: Path) -> Dict[str, Tuple[str, ...]]:
+    """
+    Import the ancestors of all concepts from a pickled file,
+    as written by preprocessing.onto2trie.
+    """
+    with ancestor_file.open("rb") as closure:
+        return pickle.load(closure)
+
+
+def expand_concepts(
+    concepts: Iterable[str], ancestors: Dict[str, Tuple[str, ...]]
+) -> Set[str]:
+    """Add all ancestors to a collection of concept IDs."""
+    expanded = set(concepts)
+    for concept in list(expanded):
+        expanded.update(ancestors.get(concept, ()))
+    return expanded
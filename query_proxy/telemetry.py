@@ -0,0 +1,255 @@
+"""
+Counters and timers of the indexing tools.
+
+The stages of the pipeline are nested: streaming_bulk pulls the actions,
+which are parsed and tagged on demand. Every stage is therefore measured
+exclusively, i.e. without the time spent in the stages nested in it,
+so that the time of 'bulk' is the time spent waiting for Elasticsearch.
+
+A summary is printed periodically and a JSON report is written
+for every archive and for the whole run.
+"""
+
+import json
+import sys
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import IO, Any, Callable, Dict, Iterable, Iterator, List, Optional, TypeVar
+
+from query_proxy.bulk import BulkSink
+
+T = TypeVar("T")
+
+
+class _Frame:
+    """An open stage and the time spent in the stages nested in it."""
+
+    def __init__(self, start: float) -> None:
+        self.start = start
+        self.nested = 0.0
+
+
+class Telemetry:
+    """
+    Parameters
+    ----------
+    report_dir : Path, optional
+        Directory of the JSON reports, none are written if None.
+    interval : float
+        Seconds between two summaries printed to output, 0 disables them.
+    trace_memory : bool
+        Whether to record the peak of the memory allocated by Python
+        with tracemalloc. This slows down the run considerably.
+    """
+
+    def __init__(
+        self,
+        report_dir: Optional[Path] = None,
+        interval: float = 30.0,
+        trace_memory: bool = False,
+        output: IO[str] = sys.stderr,
+        clock: Callable[[], float] = time.perf_counter,
+    ) -> None:
+        self.report_dir = report_dir
+        if report_dir is not None:
+            report_dir.mkdir(parents=True, exist_ok=True)
+        self.interval = interval
+        self.trace_memory = trace_memory
+        self.output = output
+        self.clock = clock
+        self.started = datetime.now()
+        self.run = self._new_totals()
+        self.archive = self._new_totals()
+        self.archive_name: Optional[str] = None
+        self.archives: List[str] = []
+        self._stack: List[_Frame] = []
+        self._last_summary = clock()
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def _new_totals(self) -> Dict[str, Any]:
+        return {
+            "start": self.clock(),
+            "counters": Counter(),
+            "stages": Counter(),
+            "peak_memory": 0,
+        }
+
+    def count(self, counter: str, n: int = 1) -> None:
+        self.archive["counters"][counter] += n
+
+    @contextmanager
+    def time(self, stage: str) -> Iterator[None]:
+        """Measure the time spent in stage, without the time of nested stages."""
+        frame = _Frame(self.clock())
+        self._stack.append(frame)
+        try:
+            yield
+        finally:
+            self._stack.pop()
+            elapsed = self.clock() - frame.start
+            self.archive["stages"][stage] += elapsed - frame.nested
+            if self._stack:
+                self._stack[-1].nested += elapsed
+
+    def timed(self, iterable: Iterable[T], stage: str) -> Iterator[T]:
+        """Measure the time spent in producing every item of iterable."""
+        iterator = iter(iterable)
+        while True:
+            with self.time(stage):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def count_bulk(self, ok: bool, item: Dict[str, Dict[str, Any]]) -> None:
+        """Count the result of an action returned by streaming_bulk."""
+        if ok:
+            self.count("documents_indexed")
+            return
+        status = next(iter(item.values()), {}).get("status")
+        if status == 409:
+            self.count("version_conflicts")
+        elif status == 429:
+            self.count("bulk_rejected")
+        else:
+            self.count("bulk_failed")
+
+    @contextmanager
+    def count_retries(self, sink: BulkSink) -> Iterator[None]:
+        """Count the retries and dead letters of sink while in the block."""
+        retries, dead_letters = sink.retries, sink.dead_letters
+        try:
+            yield
+        finally:
+            if sink.retries > retries:
+                self.count("bulk_retries", sink.retries - retries)
+            if sink.dead_letters > dead_letters:
+                self.count("dead_letters", sink.dead_letters - dead_letters)
+
+    def tick(self) -> None:
+        """Print a summary, if the last one is older than the interval."""
+        if not self.interval:
+            return
+        now = self.clock()
+        if now - self._last_summary >= self.interval:
+            self._last_summary = now
+            print(self.summary(), file=self.output, flush=True)
+
+    def summary(self) -> str:
+        counters = self.archive["counters"]
+        stages = self.archive["stages"]
+        parts = [f"{self.archive_name or 'run'}:"]
+        parts.extend(f"{name} {value}" for name, value in sorted(counters.items()))
+        elapsed = self.clock() - self.archive["start"]
+        if elapsed > 0 and "documents_tagged" in counters:
+            parts.append(f"{counters['documents_tagged'] / elapsed:.1f} docs/s")
+        busy = sum(stages.values())
+        if busy > 0:
+            parts.append(
+                "time "
+                + ", ".join(
+                    f"{name} {seconds / busy:.0%}"
+                    for name, seconds in stages.most_common()
+                )
+            )
+        return " ".join(parts)
+
+    def start_archive(self, name: str) -> None:
+        # Counts outside of any archive, e.g. skipped archives, only go into the run
+        self._add_to_run()
+        self.archive = self._new_totals()
+        self.archive_name = name
+        if self.trace_memory and hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+
+    @contextmanager
+    def archive_report(self, name: str) -> Iterator[None]:
+        """Count and time the archive while in the block, also when it is skipped."""
+        self.start_archive(name)
+        try:
+            yield
+        finally:
+            self.finish_archive()
+
+    def finish_archive(self) -> Dict[str, Any]:
+        """Add the archive to the totals of the run and write its report."""
+        if self.trace_memory:
+            self.archive["peak_memory"] = tracemalloc.get_traced_memory()[1]
+        report = self._report(self.archive_name or "", self.archive)
+        if self.interval:
+            print(self.summary(), file=self.output, flush=True)
+        self._add_to_run()
+        if self.archive_name is not None:
+            self.archives.append(self.archive_name)
+            self._write(f"{safe_name(self.archive_name)}.json", report)
+        self.archive = self._new_totals()
+        self.archive_name = None
+        return report
+
+    def _add_to_run(self) -> None:
+        self.run["counters"].update(self.archive["counters"])
+        self.run["stages"].update(self.archive["stages"])
+        self.run["peak_memory"] = max(
+            self.run["peak_memory"], self.archive["peak_memory"]
+        )
+        self.archive["counters"].clear()
+        self.archive["stages"].clear()
+
+    def finish(self) -> Dict[str, Any]:
+        """Write the report of the whole run."""
+        if self.archive_name is not None:
+            self.finish_archive()
+        self._add_to_run()
+        report = self._report("run", self.run)
+        report["archives"] = self.archives
+        self._write("run.json", report)
+        if self.trace_memory:
+            tracemalloc.stop()
+        return report
+
+    def _report(self, name: str, totals: Dict[str, Any]) -> Dict[str, Any]:
+        seconds = self.clock() - totals["start"]
+        counters = totals["counters"]
+        stages = totals["stages"]
+        rates = {}
+        if seconds > 0:
+            for counter in ("articles_parsed", "documents_indexed"):
+                if counter in counters:
+                    rates[f"{counter}_per_second"] = counters[counter] / seconds
+        if stages.get("tag"):
+            rates["documents_tagged_per_second"] = (
+                counters["documents_tagged"] / stages["tag"]
+            )
+        if stages.get("download"):
+            rates["bytes_downloaded_per_second"] = (
+                counters["bytes_downloaded"] / stages["download"]
+            )
+        report: Dict[str, Any] = {
+            "name": name,
+            "started": self.started.isoformat(timespec="seconds"),
+            "seconds": seconds,
+            "counters": dict(counters),
+            "stages": dict(stages),
+            "rates": rates,
+        }
+        if self.trace_memory:
+            report["peak_memory"] = totals["peak_memory"]
+        return report
+
+    def _write(self, filename: str, report: Dict[str, Any]) -> None:
+        if self.report_dir is None:
+            return
+        path = self.report_dir / f"{self.started.strftime('%Y%m%d-%H%M%S')}-{filename}"
+        with path.open("wt", encoding="utf-8") as out:
+            json.dump(report, out, indent=2)
+
+
+def safe_name(name: str) -> str:
+    """The base name of an archive, usable as part of a file name."""
+    return Path(name).name.replace(" ", "_")
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 14:21:08 2026
+"""
+
+import asyncio
+import threading
+import time
+from typing import List
+
+import pytest
+
+from query_proxy.admission import AdmissionControl, Rejected
+from query_proxy.app import create_app
+from query_proxy.app.asgi import AsgiApp
+from tests.test_asgi import FakeAsyncElasticsearch, FakeElasticsearch, asgi_get
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_rate_limit() -> None:
+    clock = Clock()
+    admission = AdmissionControl(rate=2, burst=3, clock=clock)
+    for _ in range(3):
+        admission.acquire("a")
+        admission.release("a")
+    with pytest.raises(Rejected) as e:
+        admission.acquire("a")
+    assert e.value.retry_after == pytest.approx(0.5)
+    # Other clients have their own bucket
+    admission.acquire("b")
+    clock.now = 0.5
+    admission.acquire("a")
+    assert admission.statistics() == {
+        "admitted": 5,
+        "queued": 0,
+        "rejected": 1,
+        "active": 2,
+        "waiting": 0,
+    }
+
+
+def test_concurrency_limit() -> None:
+    admission = AdmissionControl(concurrency=1, queue_size=1, queue_timeout=5)
+    admission.acquire("a")
+    admitted: List[bool] = []
+
+    def wait() -> None:
+        admission.acquire("a")
+        admitted.append(True)
+
+    waiter = threading.Thread(target=wait)
+    waiter.start()
+    while admission.statistics()["waiting"] == 0:
+        pass
+    # The queue is full
+    with pytest.raises(Rejected):
+        admission.acquire("a")
+    admission.release("a")
+    waiter.join()
+    assert admitted == [True]
+    assert admission.statistics()["queued"] == 1
+    admission.queue_timeout = 0.01
+    admission.queue_size = 2
+    with pytest.raises(Rejected):
+        asyncio.run(admission.acquire_async("a"))
+    assert admission.statistics()["waiting"] == 0
+
+
+def test_full_queue_spends_no_token() -> None:
+    admission = AdmissionControl(rate=1, burst=2, concurrency=1, clock=Clock())
+    admission.acquire("a")
+    with pytest.raises(Rejected) as e:
+        admission.acquire("a")
+    assert str(e.value) == "Too many concurrent requests."
+    admission.release("a")
+    # The rejected request has not used up the second token
+    admission.acquire("a")
+
+
+def test_async_waiters_are_woken() -> None:
+    admission = AdmissionControl(concurrency=1, queue_size=1, queue_timeout=5)
+
+    async def run() -> float:
+        admission.acquire("a")
+        waiter = asyncio.ensure_future(admission.acquire_async("a"))
+        await asyncio.sleep(0)
+        assert admission.statistics()["waiting"] == 1
+        start = time.monotonic()
+        # Released by another thread, e.g. a request of the WSGI application
+        threading.Thread(target=admission.release, args=("a",)).start()
+        await waiter
+        return time.monotonic() - start
+
+    assert asyncio.run(run()) < 1
+    assert admission.statistics()["active"] == 1
+    assert admission.statistics()["waiting"] == 0
+
+
+def test_too_many_requests() -> None:
+    app = create_app("testing")
+    app.config["SEARCH"] = app.config["SEARCH"].using(FakeElasticsearch())
+    app.extensions["admission"] = AdmissionControl(rate=1, burst=1, api_keys=["a"])
+    client = app.test_client()
+    assert client.get("/?request=humans").status_code == 200
+    response = client.get("/?request=humans")
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "1"
+    # Clients with a known API key are limited separately
+    assert client.get("/?request=humans", headers={"X-API-Key": "a"}).status_code == 200
+    # Unknown API keys do not give a client a new bucket
+    assert client.get("/?request=humans", headers={"X-API-Key": "b"}).status_code == 429
+    status, _ = asgi_get(AsgiApp(app, FakeAsyncElasticsearch()), "/", "request=humans")
+    assert status == 429
@@ -9,7 +9,7 @@ from os.path import join
 from pathlib import Path
 
 from query_proxy.ncbi import annotate
-from query_proxy.tagger import Tagger
+from query_proxy.tagger import Tagger, concept_ids
 
 
 def test_simple_annotations() -> None:
@@ -34,3 +34,10 @@ def test_ambiguous_annotation() -> None:
         annotations
         == "We can't rule out that the [mine](ENVO%3A00000076) won't explode."
     )
+
+
+def test_concept_ids() -> None:
+    trie_file = Path(join("tests", "resources", "mini-automaton.pickle"))
+    nlp = Tagger.setup_pipeline(trie_file, debug=True)
+    doc = nlp("Humans have a lot of bacteria living on them.")
+    assert concept_ids(doc) == {"NCBITaxon:9605", "NCBITaxon:2"}
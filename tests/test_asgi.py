@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 14:40:05 2026
+"""
+
+import asyncio
+from typing import Any, Dict, List, Tuple
+
+import pytest
+
+from query_proxy.app import create_app
+from query_proxy.app.asgi import AsgiApp
+
+HIT: Dict[str, Any] = {
+    "_index": "pubmed",
+    "_type": "_doc",
+    "_id": "12345",
+    "_score": 1.0,
+    "_source": {
+        "title": "[Humans](NCBITaxon%3A9605) and [bacteria](NCBITaxon%3A2)",
+        "author": ["Lorem Ipsum", "Dolor Sit"],
+        "journal": "Journal of Lorem Ipsum",
+        "year": 2020,
+    },
+}
+
+
+def search_result(body: Dict) -> Dict:
+    """Only the lenient fallback query finds a document."""
+    hits = [HIT] if "should" in body["query"]["bool"] else []
+    result = {
+        "took": 1,
+        "timed_out": False,
+        "_shards": {"total": 1, "successful": 1, "skipped": 0, "failed": 0},
+        "hits": {
+            "total": {"value": len(hits), "relation": "eq"},
+            "max_score": 1.0 if hits else None,
+            "hits": hits if body.get("size") != 0 else [],
+        },
+    }
+    if "aggs" in body:
+        source = HIT["_source"]
+        values = {"year": 2020.0, "journal": source["journal"], "mesh": None}
+        result["aggregations"] = {
+            name: {
+                "buckets": (
+                    [{"key": values[name], "doc_count": len(hits)}]
+                    if hits and values[name] is not None
+                    else []
+                )
+            }
+            for name in body["aggs"]
+        }
+    return result
+
+
+class FakeElasticsearch:
+    def __init__(self) -> None:
+        self.bodies: List[Dict[str, Any]] = []
+        self.params: List[Dict[str, Any]] = []
+
+    def search(self, index: str, body: Dict, **kwargs: Any) -> Dict:
+        self.bodies.append(body)
+        self.params.append(kwargs)
+        return search_result(body)
+
+
+class FakeAsyncElasticsearch:
+    async def search(self, index: str, body: Dict, **kwargs: Any) -> Dict:
+        await asyncio.sleep(0)
+        return search_result(body)
+
+
+def asgi_get(app: AsgiApp, path: str, query_string: str) -> Tuple[int, bytes]:
+    messages: List[Dict] = []
+
+    async def receive() -> Dict:
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message: Dict) -> None:
+        messages.append(message)
+
+    scope = {
+        "type": "http",
+        "method": "GET",
+        "path": path,
+        "query_string": query_string.encode("latin-1"),
+        "headers": [],
+        "client": ("127.0.0.1", 12345),
+    }
+    asyncio.run(app(scope, receive, send))
+    return messages[0]["status"], messages[1]["body"]
+
+
+@pytest.mark.parametrize(
+    "query_string",
+    [
+        "request=http://purl.obolibrary.org/obo/NCBITaxon_9605",
+        "request=http://purl.obolibrary.org/obo/NCBITaxon_9605;bacteria&size=5",
+        "request=humans&start=20&end=10&sort=desc&foo=bar",
+        "size=5",
+        "request=humans&end=500",
+        "request=humans&facets=true",
+        "request=humans&fields=title,foo,year&total=true",
+    ],
+)
+def test_asgi_matches_wsgi(query_string: str) -> None:
+    app = create_app("testing")
+    app.config["SEARCH"] = app.config["SEARCH"].using(FakeElasticsearch())
+    expected = app.test_client().get("/?" + query_string)
+    status, body = asgi_get(AsgiApp(app, FakeAsyncElasticsearch()), "/", query_string)
+    assert status == expected.status_code
+    assert body == expected.get_data()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 16:05:12 2026
+"""
+
+import io
+import json
+import threading
+from pathlib import Path
+
+from benchmarks.data import bibtex_entries, pubmed_xml, synthetic_concepts, taxonomy_dat
+from benchmarks.load import (
+    FakeElasticsearch,
+    Level,
+    logged_requests,
+    make_app,
+    synthetic_requests,
+)
+from benchmarks.suite import compare
+from parsers import bibtex, pubmed
+from preprocessing.ncbi_filter import taxonomy2dict
+
+
+def test_pubmed_xml() -> None:
+    articles = list(pubmed.parse(io.StringIO(pubmed_xml(200, labels=["Bacteria"]))))
+    citations = [article for article in articles if "title" in article]
+    assert len(citations) == 200
+    assert len(articles) > 200
+    assert all(citation["abstract"] for citation in citations)
+    assert any("Bacteria" in citation["abstract"] for citation in citations)
+
+
+def test_bibtex_entries() -> None:
+    entries = list(bibtex.parse(io.StringIO(bibtex_entries(10))))
+    assert len(entries) == 10
+    assert all(entry["abstract"] and entry["author"] for entry in entries)
+
+
+def test_taxonomy_dat(tmp_path: Path) -> None:
+    taxonomy_file = tmp_path / "taxonomy.dat"
+    taxonomy_file.write_text(taxonomy_dat(50))
+    entries = list(taxonomy2dict(taxonomy_file))
+    assert len(entries) == 50
+    assert all(entry["SCIENTIFIC NAME"] for entry in entries)
+
+
+def test_synthetic_concepts() -> None:
+    concepts = synthetic_concepts(10)
+    assert len(concepts) == 10
+    assert all(labels for labels in concepts.values())
+
+
+def test_compare() -> None:
+    baseline = {
+        "results": {
+            "fast": {"documents_per_second": 100.0, "peak_memory": 1000},
+            "small": {"documents_per_second": 100.0, "peak_memory": 1000},
+        }
+    }
+    results = {
+        "fast": {"documents_per_second": 80.0, "peak_memory": 1200},
+        "small": {"documents_per_second": 60.0, "peak_memory": 1400},
+        "new": {"documents_per_second": 1.0, "peak_memory": 1},
+    }
+    regressions = compare(results, baseline, 0.3)
+    assert len(regressions) == 2
+    assert all(regression.startswith("small") for regression in regressions)
+
+
+def test_logged_requests(tmp_path: Path) -> None:
+    log_file = tmp_path / "requests.log"
+    search = {
+        "time": "2026-10-19T12:00:00.000+00:00",
+        "level": "INFO",
+        "logger": "query_proxy.app",
+        "message": "search",
+        "request": "humans",
+        "parameters": {"size": 5, "end": 4, "expand": True, "fields": ["title"]},
+        "milliseconds": 12.5,
+    }
+    log_file.write_text(
+        "2026-10-19 12:00:00,000 - query_proxy.app - INFO - Original request: "
+        "http://purl.obolibrary.org/obo/NCBITaxon_2,soil water\n"
+        "2026-10-19 12:00:00,001 - query_proxy.app - DEBUG - Processed request: []\n"
+        + json.dumps(search)
+        + "\n"
+        + json.dumps(dict(search, message="Processed request: []"))
+        + "\n"
+    )
+    assert logged_requests(log_file) == [
+        "request=http://purl.obolibrary.org/obo/NCBITaxon_2,soil%20water",
+        "request=humans&size=5&expand=true&fields=title",
+    ]
+
+
+def test_synthetic_requests() -> None:
+    requests = synthetic_requests(100)
+    assert len(requests) == 100
+    assert all(request.startswith("request=http://") for request in requests)
+    assert len(set(requests)) < 100
+
+
+def test_fake_elasticsearch() -> None:
+    elasticsearch = FakeElasticsearch(latency=0, empty=0)
+    thread = threading.Thread(target=elasticsearch.serve_forever, daemon=True)
+    thread.start()
+    try:
+        app = make_app(elasticsearch.url, admission=False)
+        response = app.test_client().get("/?" + synthetic_requests(1)[0])
+        assert response.status_code == 200
+        assert response.get_json()["hits"]
+        assert "elasticsearch;dur=" in response.headers["Server-Timing"]
+    finally:
+        elasticsearch.shutdown()
+        elasticsearch.server_close()
+
+
+def test_percentile() -> None:
+    level = Level(4, 1.0, [i / 100 for i in range(1, 101)], {})
+    assert level.throughput == 100
+    assert level.percentile(50) == 0.5
+    assert level.percentile(99) == 0.99
+    assert level.percentile(100) == 1.0
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 21:03:48 2026
+"""
+
+import json
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Set, cast
+
+import pytest
+from elasticsearch import Elasticsearch
+from elasticsearch.exceptions import TransportError
+from elasticsearch.serializer import JSONSerializer
+
+from query_proxy.bulk import MB, BulkSink, Result, read_dead_letters
+
+
+class FakeTransport:
+    serializer = JSONSerializer()
+
+
+class FakeElasticsearch:
+    """Answers bulk requests, rejecting and failing the given IDs."""
+
+    def __init__(
+        self,
+        reject_once: Set[str] = set(),
+        fail: Set[str] = set(),
+        reject_requests: int = 0,
+        seconds: float = 0.0,
+    ) -> None:
+        self.transport = FakeTransport()
+        self.reject_once = set(reject_once)
+        self.fail = fail
+        self.reject_requests = reject_requests
+        self.seconds = seconds
+        self.requests: List[List[str]] = []
+        self.sizes: List[int] = []
+        self.lock = threading.Lock()
+
+    def bulk(self, body: str, request_timeout: float, **kwargs: Any) -> Dict:
+        with self.lock:
+            if self.reject_requests:
+                self.reject_requests -= 1
+                raise TransportError(429, "es_rejected_execution_exception")
+            lines = [json.loads(line) for line in body.splitlines()]
+            ids = [line["index"]["_id"] for line in lines[::2]]
+            self.requests.append(ids)
+            self.sizes.append(len(body.encode("utf-8")))
+        time.sleep(self.seconds)
+        items = []
+        for doc_id in ids:
+            if doc_id in self.fail:
+                status = 400
+            elif doc_id in self.reject_once:
+                self.reject_once.discard(doc_id)
+                status = 429
+            else:
+                status = 201
+            items.append({"index": {"_id": doc_id, "status": status}})
+        return {"items": items}
+
+
+def actions(n: int, pulled: List[str] = []) -> Iterator[Dict[str, Any]]:
+    for i in range(n):
+        pulled.append(str(i))
+        yield {
+            "_op_type": "index",
+            "_index": "pubmed",
+            "_id": str(i),
+            "title": "x" * 100,
+        }
+
+
+def sink(tmp_path: Path, **kwargs: Any) -> BulkSink:
+    kwargs.setdefault("initial_backoff", 0)
+    return BulkSink(dead_letter=tmp_path / "dead-letter.jsonl", **kwargs)
+
+
+def index(
+    bulk: BulkSink, client: FakeElasticsearch, actions: Iterable[Dict[str, Any]]
+) -> Iterator[Result]:
+    return bulk.index(cast(Elasticsearch, client), actions)
+
+
+def test_results_in_order(tmp_path: Path) -> None:
+    client = FakeElasticsearch(seconds=0.001)
+    results = list(
+        index(sink(tmp_path, threads=4, max_actions=7), client, actions(100))
+    )
+    assert [item["index"]["_id"] for _, item in results] == [str(i) for i in range(100)]
+    assert all(ok for ok, _ in results)
+    assert len(client.requests) == 15
+
+
+def test_rejected_actions_are_retried(tmp_path: Path) -> None:
+    client = FakeElasticsearch(reject_once={"3", "5"})
+    bulk = sink(tmp_path, max_actions=10)
+    results = list(index(bulk, client, actions(10)))
+    assert all(ok for ok, _ in results)
+    assert client.requests[1] == ["3", "5"]
+    assert bulk.retries == 1
+    assert not (tmp_path / "dead-letter.jsonl").exists()
+
+
+def test_rejected_requests_are_retried(tmp_path: Path) -> None:
+    client = FakeElasticsearch(reject_requests=2)
+    bulk = sink(tmp_path)
+    assert all(ok for ok, _ in index(bulk, client, actions(10)))
+    assert bulk.retries == 2
+
+
+def test_rejected_requests_give_up(tmp_path: Path) -> None:
+    client = FakeElasticsearch(reject_requests=5)
+    with pytest.raises(TransportError):
+        list(index(sink(tmp_path, max_retries=2), client, actions(10)))
+
+
+def test_failed_actions_are_dead_lettered(tmp_path: Path) -> None:
+    client = FakeElasticsearch(fail={"2"})
+    bulk = sink(tmp_path, max_retries=0)
+    results = list(index(bulk, client, actions(5)))
+    assert [ok for ok, _ in results] == [True, True, False, True, True]
+    assert bulk.dead_letters == 1
+    [action] = list(read_dead_letters(tmp_path / "dead-letter.jsonl"))
+    assert action["_id"] == "2"
+    # The dead letters can be sent again as they are
+    client = FakeElasticsearch()
+    assert all(ok for ok, _ in index(sink(tmp_path), client, [action]))
+    assert client.requests == [["2"]]
+
+
+def test_chunks_adapt_to_latency(tmp_path: Path) -> None:
+    client = FakeElasticsearch(seconds=0.02)
+    bulk = sink(
+        tmp_path,
+        threads=1,
+        target_seconds=0.01,
+        chunk_bytes=20000,
+        min_bytes=1000,
+        max_bytes=MB,
+    )
+    list(index(bulk, client, actions(1000)))
+    assert bulk.chunk_bytes < 20000
+    assert client.sizes[-2] < client.sizes[0]
+
+
+def test_back_pressure(tmp_path: Path) -> None:
+    pulled: List[str] = []
+    client = FakeElasticsearch(seconds=0.01)
+    results = index(
+        sink(tmp_path, threads=1, queue_size=2, max_actions=10),
+        client,
+        actions(1000, pulled),
+    )
+    next(results)
+    # Only the chunks that may wait for their results have been prepared
+    assert len(pulled) <= 30
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 14:48:51 2026
+"""
+
+import gzip
+import json
+
+import pytest
+
+from query_proxy.app import create_app
+from query_proxy.app.compression import brotli, choose_encoding
+from query_proxy.app.serialization import OrjsonProvider, orjson
+from tests.test_asgi import FakeElasticsearch
+
+
+def test_choose_encoding() -> None:
+    assert choose_encoding(None) is None
+    assert choose_encoding("identity") is None
+    assert choose_encoding("gzip, deflate") == "gzip"
+    assert choose_encoding("gzip;q=0") is None
+    assert choose_encoding("*;q=0.5, gzip;q=0") == ("br" if brotli else None)
+    if brotli is not None:
+        assert choose_encoding("gzip, br") == "br"
+        assert choose_encoding("gzip, br;q=0.9") == "gzip"
+
+
+def test_compressed_answer() -> None:
+    app = create_app("testing")
+    app.config["SEARCH"] = app.config["SEARCH"].using(FakeElasticsearch())
+    app.config["COMPRESSION_THRESHOLD"] = 10
+    client = app.test_client()
+    plain = client.get("/?request=humans")
+    assert "Content-Encoding" not in plain.headers
+    assert plain.headers["Vary"] == "Accept-Encoding"
+    compressed = client.get("/?request=humans", headers={"Accept-Encoding": "gzip"})
+    assert compressed.headers["Content-Encoding"] == "gzip"
+    assert gzip.decompress(compressed.get_data()) == plain.get_data()
+    app.config["COMPRESSION_THRESHOLD"] = 10000
+    small = client.get("/?request=humans", headers={"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in small.headers
+
+
+@pytest.mark.skipif(orjson is None, reason="orjson is not installed")
+def test_orjson_provider() -> None:
+    app = create_app("testing")
+    assert isinstance(app.json, OrjsonProvider)
+    answer = {"warnings": ["Ümlaut"], "hits": [{"year": 2020, "id": "1"}]}
+    with app.app_context():
+        body = app.json.response(answer).get_data()
+    expected = json.dumps(
+        answer, sort_keys=True, separators=(",", ":"), ensure_ascii=False
+    )
+    assert body == f"{expected}\n".encode("utf-8")
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Wed Oct 21 15:34:27 2026
+"""
+
+from pathlib import Path
+
+from query_proxy.app import create_app
+from query_proxy.concept_stats import (
+    ConceptCounts,
+    ConceptStatistics,
+    CooccurrenceCounter,
+    CooccurrenceMatrix,
+    get_concept_counts,
+)
+
+
+def test_counts_roundtrip(tmp_path: Path) -> None:
+    counts = ConceptCounts()
+    counts.add(["NCBITaxon:2", "NCBITaxon:9605"], ["NCBITaxon:2", "NCBITaxon:1"])
+    counts.add(["NCBITaxon:2", "NCBITaxon:2"], ["NCBITaxon:2", "NCBITaxon:1"])
+    other = ConceptCounts()
+    other.add(["ENVO:00000076"])
+    counts.update(other)
+    table = tmp_path / "counts.tsv"
+    counts.save(table)
+    loaded = get_concept_counts(table)
+    assert loaded is not None
+    assert loaded.count("NCBITaxon:2") == 2
+    assert loaded.count("NCBITaxon:1") == 0
+    assert loaded.count("NCBITaxon:1", expand=True) == 2
+    assert loaded.count("ENVO:00000076") == 1
+    assert get_concept_counts(tmp_path / "missing.tsv") is None
+
+
+def test_complete_counts(tmp_path: Path) -> None:
+    statistics = ConceptStatistics(tmp_path / "counts.tsv")
+    statistics.begin(documents=0)
+    statistics.add(["NCBITaxon:2"])
+    statistics.save()
+    assert ConceptCounts.load(tmp_path / "counts.tsv").complete
+    # A table of an index with documents counted before stays incomplete
+    statistics = ConceptStatistics(tmp_path / "other.tsv")
+    statistics.begin(documents=10)
+    statistics.save()
+    other = ConceptCounts.load(tmp_path / "other.tsv")
+    assert not other.complete
+    # Merged tables are only complete if all of them are
+    counts = ConceptCounts.load(tmp_path / "counts.tsv")
+    counts.update(other)
+    assert not counts.complete
+
+
+def test_cooccurrences(tmp_path: Path) -> None:
+    counter = CooccurrenceCounter()
+    counter.add(["a", "b", "c", "a"])
+    counter.add(["a", "b"])
+    counter.add(["d"])
+    matrix = CooccurrenceMatrix.from_counter(counter)
+    assert matrix.related(["a"]) == [("b", 2), ("c", 1)]
+    assert matrix.related(["a"], size=1) == [("b", 2)]
+    assert matrix.related(["d"]) == []
+    assert matrix.related(["b", "c"]) == [("a", 3)]
+    counter = CooccurrenceCounter()
+    counter.add(["c", "d"])
+    counter.add(["a", "c"])
+    counter.add(["a", "c"])
+    path = tmp_path / "cooccurrences.bin"
+    matrix.merge(CooccurrenceMatrix.from_counter(counter)).save(path)
+    merged = CooccurrenceMatrix.load(path)
+    assert merged.related(["a"]) == [("c", 3), ("b", 2)]
+    assert merged.related(["d"]) == [("c", 1)]
+
+
+def test_related(tmp_path: Path) -> None:
+    counter = CooccurrenceCounter()
+    counter.add(["NCBITaxon:2", "NCBITaxon:9605"])
+    counter.add(["NCBITaxon:2", "ENVO:00000076"])
+    counter.add(["NCBITaxon:2", "ENVO:00000076"])
+    CooccurrenceMatrix.from_counter(counter).save(tmp_path / "cooccurrences.bin")
+    app = create_app("testing")
+    app.config["COOCCURRENCES"] = str(tmp_path / "cooccurrences.bin")
+    response = app.test_client().get(
+        "/related?concepts=http://purl.obolibrary.org/obo/NCBITaxon_2,"
+        + "http://purl.obolibrary.org/obo/NCBITaxon_1"
+    )
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data["related"] == [
+        {"concept": "http://purl.obolibrary.org/obo/ENVO_00000076", "documents": 2},
+        {"concept": "http://purl.obolibrary.org/obo/NCBITaxon_9605", "documents": 1},
+    ]
+    assert data["warnings"] == [
+        "Concept http://purl.obolibrary.org/obo/NCBITaxon_1 "
+        + "does not occur in any document."
+    ]
+    app.config["COOCCURRENCES"] = None
+    assert app.test_client().get("/related?concepts=x").status_code == 503
+
+
+def test_related_ties() -> None:
+    counter = CooccurrenceCounter()
+    counter.add(["a", "y", "x"])
+    counter.add(["z", "q"])
+    matrix = CooccurrenceMatrix.from_counter(counter)
+    # Concepts with the same count are ordered alike for one and several concepts
+    assert matrix.related(["a"]) == [("x", 1), ("y", 1)]
+    assert matrix.related(["a", "z"]) == [("q", 1), ("x", 1), ("y", 1)]
+    assert matrix.related(["a", "z"], size=2) == [("q", 1), ("x", 1)]
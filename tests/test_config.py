@@ -0,0 +1,23 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 10:12:31 2026
+"""
+
+from query_proxy.config import client_options
+
+
+def test_client_options() -> None:
+    conf = {
+        "es_hosts": ["node1", "node2"],
+        "es_maxsize": 8,
+        "es_timeout": 5,
+        "es_sniffer_timeout": None,
+        "index": "pubmed",
+    }
+    options = client_options(conf)
+    assert options == {"hosts": ["node1", "node2"], "maxsize": 8, "timeout": 5}
+
+
+def test_client_defaults() -> None:
+    assert client_options({}) == {"hosts": ["localhost"]}
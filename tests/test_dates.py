@@ -0,0 +1,25 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Tue Oct 20 14:48:09 2026
+"""
+
+from parsers.dates import normalize_date, parse_medline_date
+
+
+def test_normalize_date() -> None:
+    assert normalize_date("2020") == "2020-01-01"
+    assert normalize_date("2020", "feb", "29") == "2020-02-29"
+    assert normalize_date("2021", "02", "29") == "2021-02-01"
+    assert normalize_date("2019", "Winter") == "2019-12-01"
+    assert normalize_date("2019", "September") == "2019-09-01"
+    assert normalize_date(None, "jan") is None
+
+
+def test_medline_date() -> None:
+    assert parse_medline_date("1998 Dec-1999 Jan") == "1998-12-01"
+    assert parse_medline_date("2000 Spring") == "2000-03-01"
+    assert parse_medline_date("1976-1977") == "1976-01-01"
+    assert parse_medline_date("2005 Jan 15-21") == "2005-01-15"
+    assert parse_medline_date("Summer 2003") == "2003-06-01"
+    assert parse_medline_date("Not a date") is None
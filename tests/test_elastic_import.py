@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 21:48:15 2026
+"""
+
+from typing import Any, Dict, List, Tuple, cast
+
+import pytest
+from elasticsearch import Elasticsearch
+
+from query_proxy.elastic_import import (
+    BULK_LOAD_SETTINGS,
+    RESTORE_KEY,
+    bulk_load,
+    bulk_load_settings,
+)
+
+
+class FakeIndices:
+    def __init__(self, settings: Dict[str, Any]) -> None:
+        self.settings = dict(settings)
+        self.meta: Dict[str, Any] = {}
+        self.calls: List[Tuple[str, Dict[str, Any]]] = []
+
+    def get_mapping(self, index: str) -> Dict:
+        return {"pubmed-1": {"mappings": {"_meta": self.meta}}}
+
+    def put_mapping(self, index: str, body: Dict) -> None:
+        self.meta = body["_meta"]
+
+    def get_settings(self, index: str, flat_settings: bool) -> Dict:
+        return {"pubmed-1": {"settings": dict(self.settings)}}
+
+    def put_settings(self, index: str, body: Dict) -> None:
+        for key, value in body.items():
+            if value is None:
+                self.settings.pop(key, None)
+            else:
+                self.settings[key] = value
+
+    def refresh(self, index: str) -> None:
+        self.calls.append(("refresh", {}))
+
+    def forcemerge(self, index: str, **kwargs: Any) -> None:
+        self.calls.append(("forcemerge", kwargs))
+
+
+class FakeElasticsearch:
+    def __init__(self, settings: Dict[str, Any]) -> None:
+        self.indices = FakeIndices(settings)
+
+
+ORIGINAL = {"index.number_of_replicas": "1", "index.number_of_shards": "1"}
+
+
+def client(settings: Dict[str, Any] = ORIGINAL) -> Tuple[Elasticsearch, FakeIndices]:
+    fake = FakeElasticsearch(settings)
+    return cast(Elasticsearch, fake), fake.indices
+
+
+def test_bulk_load_settings() -> None:
+    settings = bulk_load_settings(
+        {"bulk_load_settings": {"index.number_of_replicas": 1}}
+    )
+    assert settings["index.number_of_replicas"] == 1
+    assert (
+        settings["index.refresh_interval"]
+        == BULK_LOAD_SETTINGS["index.refresh_interval"]
+    )
+
+
+def test_settings_are_restored() -> None:
+    conn, indices = client()
+    with bulk_load(conn, settings=BULK_LOAD_SETTINGS):
+        assert indices.settings["index.refresh_interval"] == "-1"
+        assert indices.settings["index.number_of_replicas"] == 0
+        assert RESTORE_KEY in indices.meta
+    assert indices.settings == ORIGINAL
+    assert indices.meta == {}
+    assert indices.calls == [("refresh", {})]
+
+
+def test_settings_are_restored_on_errors() -> None:
+    conn, indices = client()
+    with pytest.raises(RuntimeError):
+        with bulk_load(conn, settings=BULK_LOAD_SETTINGS, force_merge=1):
+            raise RuntimeError
+    assert indices.settings == ORIGINAL
+    # The index is only merged after a successful load
+    assert [call for call, _ in indices.calls] == ["refresh"]
+
+
+def test_force_merge() -> None:
+    conn, indices = client()
+    with bulk_load(conn, settings=BULK_LOAD_SETTINGS, force_merge=1):
+        pass
+    assert indices.calls[-1][0] == "forcemerge"
+    assert indices.calls[-1][1]["max_num_segments"] == 1
+
+
+def test_interrupted_bulk_load() -> None:
+    conn, indices = client()
+    bulk = bulk_load(conn, settings=BULK_LOAD_SETTINGS)
+    bulk.__enter__()
+    # The process is killed, the next bulk load restores the original settings
+    with bulk_load(conn, settings=BULK_LOAD_SETTINGS):
+        assert indices.settings["index.number_of_replicas"] == 0
+    assert indices.settings == ORIGINAL
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Wed Oct 21 09:20:52 2026
+"""
+
+from os.path import join
+
+from query_proxy.app import create_app
+from query_proxy.lexicon import get_prefix_index, resolve_term
+
+TRIE_FILE = join("tests", "resources", "mini-automaton.pickle")
+
+
+def test_prefix_index() -> None:
+    prefix_index = get_prefix_index(TRIE_FILE)
+    completions = prefix_index.complete("HU", 2)
+    assert completions == [
+        ("Human", ("NCBITaxon:9606",)),
+        ("Humans", ("NCBITaxon:9605",)),
+    ]
+    assert prefix_index.complete("no such label") == []
+    assert get_prefix_index(TRIE_FILE) is prefix_index
+
+
+def test_autocomplete() -> None:
+    app = create_app("testing")
+    app.config["AUTOMATON"] = TRIE_FILE
+    response = app.test_client().get("/autocomplete?prefix=bacter")
+    assert response.get_json() == {
+        "prefix": "bacter",
+        "completions": [
+            {
+                "label": "Bacteria",
+                "concepts": ["http://purl.obolibrary.org/obo/NCBITaxon_2"],
+            }
+        ],
+        "warnings": [],
+    }
+
+
+def test_resolve_term() -> None:
+    concepts, rest = resolve_term(TRIE_FILE, "Humans and bacteria in groundwater")
+    assert concepts == (("NCBITaxon:9605",), ("NCBITaxon:2",))
+    assert rest == "and in groundwater"
+    # Labels have to be delimited
+    assert resolve_term(TRIE_FILE, "superhumans") == ((), "superhumans")
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 18:02:17 2026
+"""
+
+import json
+import logging
+from typing import List
+
+from query_proxy.app import create_app
+from query_proxy.logs import DeferredQueueHandler, JsonFormatter, queue_logging
+from tests.test_asgi import FakeElasticsearch
+
+
+class ListHandler(logging.Handler):
+    def __init__(self) -> None:
+        super().__init__()
+        self.lines: List[str] = []
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.lines.append(self.format(record))
+
+
+def test_json_formatter() -> None:
+    record = logging.LogRecord(
+        "query_proxy", logging.INFO, __file__, 1, "%s found", ("bacteria",), None
+    )
+    record.fields = {"milliseconds": 12.5}
+    entry = json.loads(JsonFormatter().format(record))
+    assert entry["message"] == "bacteria found"
+    assert entry["level"] == "INFO"
+    assert entry["milliseconds"] == 12.5
+
+
+def test_search_records() -> None:
+    app = create_app("testing")
+    app.config["SEARCH"] = app.config["SEARCH"].using(FakeElasticsearch())
+    app.config["DEBUG_QUERY_SAMPLE_RATE"] = 0
+    app.logger.setLevel(logging.DEBUG)
+    handler = ListHandler()
+    handler.setFormatter(JsonFormatter())
+    listener = queue_logging(app.logger, handler)
+    try:
+        client = app.test_client()
+        client.get("/?request=humans&size=5&expand=true")
+        app.config["DEBUG_QUERY_SAMPLE_RATE"] = 1
+        client.get("/?request=bacteria")
+    finally:
+        listener.stop()
+        app.logger.handlers = app.logger.handlers[:-1]
+    entries = [json.loads(line) for line in handler.lines]
+    searches = [entry for entry in entries if entry["message"] == "search"]
+    assert [search["request"] for search in searches] == ["humans", "bacteria"]
+    assert searches[0]["parameters"]["size"] == 5
+    assert searches[0]["parameters"]["expand"] is True
+    assert searches[0]["events"] == ["fallback"]
+    assert "elasticsearch" in searches[0]["stages"]
+    assert searches[0]["shared"] is False
+    dumps = [entry for entry in entries if entry["level"] == "DEBUG"]
+    # Only the strict query of the second search has been sampled
+    assert len(dumps) == 1
+    assert dumps[0]["message"].startswith("Processed request")
+
+
+def test_exceptions_keep_their_field() -> None:
+    logger = logging.getLogger("test_logs")
+    handler = ListHandler()
+    handler.setFormatter(JsonFormatter())
+    listener = queue_logging(logger, handler)
+    try:
+        try:
+            raise ValueError("broken")
+        except ValueError:
+            logger.exception("Exception on %s", "/", extra={"fields": {"status": 500}})
+    finally:
+        listener.stop()
+        logger.handlers = []
+    [entry] = [json.loads(line) for line in handler.lines]
+    assert entry["message"] == "Exception on /"
+    assert entry["status"] == 500
+    assert "ValueError: broken" in entry["exception"]
+
+
+def test_full_queue_drops_records() -> None:
+    logger = logging.getLogger("test_logs.full")
+    handler = ListHandler()
+    # Once the listener has stopped, nothing leaves the queue
+    listener = queue_logging(logger, handler, queue_size=2)
+    listener.stop()
+    try:
+        for i in range(5):
+            logger.warning("record %d", i)
+        [queue_handler] = logger.handlers
+        assert isinstance(queue_handler, DeferredQueueHandler)
+        assert queue_handler.dropped == 3
+    finally:
+        logger.handlers = []
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 15:12:36 2026
+"""
+
+from query_proxy.app import create_app
+from query_proxy.metrics import Metrics, Timings
+from tests.test_asgi import FakeElasticsearch
+
+
+def test_histograms() -> None:
+    timings = Timings()
+    timings.add("elasticsearch", 0.003)
+    timings.add("elasticsearch", 0.004)
+    timings.events.add("fallback")
+    assert timings.server_timing() == "elasticsearch;dur=7.0"
+    metrics = Metrics()
+    metrics.observe(timings)
+    metrics.observe(Timings(), shared=True)
+    text = metrics.render()
+    assert (
+        'query_proxy_stage_seconds_bucket{stage="elasticsearch",le="0.005"} 0' in text
+    )
+    assert 'query_proxy_stage_seconds_bucket{stage="elasticsearch",le="0.01"} 1' in text
+    assert 'query_proxy_stage_seconds_count{stage="elasticsearch"} 1' in text
+    assert "query_proxy_requests_total 2" in text
+    assert "query_proxy_fallbacks_total 1" in text
+    assert "query_proxy_coalesced_total 1" in text
+
+
+def test_metrics_endpoint() -> None:
+    app = create_app("testing")
+    app.config["SEARCH"] = app.config["SEARCH"].using(FakeElasticsearch())
+    client = app.test_client()
+    response = client.get("/?request=humans")
+    stages = [
+        part.split(";")[0] for part in response.headers["Server-Timing"].split(", ")
+    ]
+    assert stages == [
+        "parse",
+        "build",
+        "elasticsearch",
+        "took",
+        "serialize",
+        "fallback",
+    ]
+    response = client.get("/metrics")
+    assert response.mimetype == "text/plain"
+    text = response.get_data(as_text=True)
+    assert "query_proxy_requests_total 1" in text
+    assert "query_proxy_fallbacks_total 1" in text
+    assert "query_proxy_zero_hits_total 0" in text
+    assert 'query_proxy_admission_total{outcome="admitted"} 1' in text
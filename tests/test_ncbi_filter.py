@@ -7,6 +7,7 @@ Created on Tue Feb 16 18:52:51 2021
 """
 from os.path import join
 from pathlib import Path
+from typing import Dict
 
 from preprocessing import ncbi_filter
 
@@ -31,3 +32,11 @@ def test_taxonomy2dict() -> None:
     taxonomy_file = Path(join("tests", "resources", "taxonomy-mini.dat"))
     entries = list(ncbi_filter.taxonomy2dict(taxonomy_file))
     assert len(entries) == 14
+
+
+def test_parents() -> None:
+    taxonomy_file = Path(join("tests", "resources", "taxonomy-mini.dat"))
+    parents: Dict[str, str] = dict()
+    ncbi_filter.filter_ncbi_taxonomy(taxonomy_file, ["4932"], parents)
+    assert parents["4932"] == "4930"
+    assert "1" not in parents
@@ -30,3 +30,24 @@ def make_automaton() -> None:
     entries, _ = onto2trie.triples2dict(ontology)
     automaton = onto2trie.make_automaton(entries)
     assert "entity" in automaton
+
+
+def test_ancestor_closure() -> None:
+    onto_file = join("tests", "resources", "ad-test-mini.owl")
+    ontology = rdflib.Graph().parse(onto_file)
+    parents = onto2trie.triples2parents(ontology)
+    closure = onto2trie.ancestor_closure(parents, ["NCBITaxon:4932", "BFO:0000004"])
+    assert "BFO:0000004" not in closure
+    assert "NCBITaxon:4890" in closure["NCBITaxon:4932"]
+    assert "BFO:0000004" in closure["NCBITaxon:4932"]
+
+
+def test_ancestor_cycle() -> None:
+    parents = {"a": {"b"}, "b": {"c"}, "c": {"a"}}
+    closure = onto2trie.ancestor_closure(parents, ["a"])
+    assert closure == {"a": ("b", "c")}
+
+
+def test_expand_id() -> None:
+    iri = "http://purl.obolibrary.org/obo/BFO_0000040"
+    assert iri == onto2trie.expand_id(onto2trie.compact_id(iri))
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 19:05:12 2026
+"""
+
+import marshal
+from pathlib import Path
+
+from query_proxy.app import create_app
+from query_proxy.app.asgi import AsgiApp
+from query_proxy.profiling import ENV_DIRECTORY, ENV_EVERY, Profiler
+from tests.test_asgi import FakeAsyncElasticsearch, FakeElasticsearch, asgi_get
+
+
+def calls(path: Path) -> int:
+    """The number of function calls recorded in a profile."""
+    # A profile is the marshalled statistics of every function, as read by pstats
+    with path.open("rb") as profile:
+        statistics = marshal.load(profile)
+    return sum(calls for calls, *_ in statistics.values())
+
+
+def test_disabled_by_default() -> None:
+    profiler = Profiler.from_env(environ={})
+    assert not profiler.enabled
+    assert profiler.sample() is None
+
+
+def test_from_env(tmp_path: Path) -> None:
+    environ = {ENV_DIRECTORY: str(tmp_path / "profiles"), ENV_EVERY: "3"}
+    profiler = Profiler.from_env(environ=environ)
+    assert profiler.enabled
+    assert profiler.every == 3
+    assert (tmp_path / "profiles").is_dir()
+
+
+def test_every_nth_call_is_sampled(tmp_path: Path) -> None:
+    profiler = Profiler(tmp_path, every=3)
+    samples = []
+    for _ in range(6):
+        profile = profiler.sample()
+        samples.append(profile is not None)
+        if profile is not None:
+            profiler.discard(profile)
+    assert samples == [False, False, True, False, False, True]
+
+
+def test_single_profile_at_a_time(tmp_path: Path) -> None:
+    profiler = Profiler(tmp_path, every=1)
+    profile = profiler.sample()
+    assert profile is not None
+    assert profiler.sample() is None
+    profiler.discard(profile)
+    assert profiler.sample() is not None
+
+
+def test_profile_context(tmp_path: Path) -> None:
+    profiler = Profiler(tmp_path, every=1)
+    with profiler.profile("archive-pubmed21n0001.xml.gz"):
+        sorted(range(1000), reverse=True)
+    [path] = list(tmp_path.glob("*.prof"))
+    assert path.name.endswith("-archive-pubmed21n0001.xml.gz.prof")
+    assert calls(path) > 0
+
+
+def test_old_profiles_are_pruned(tmp_path: Path) -> None:
+    profiler = Profiler(tmp_path, every=1, keep=2)
+    for i in range(4):
+        with profiler.profile(f"archive-{i}"):
+            pass
+    names = sorted(path.name for path in tmp_path.glob("*.prof"))
+    assert [name[-len("archive-0.prof") :] for name in names] == [
+        "archive-2.prof",
+        "archive-3.prof",
+    ]
+
+
+def test_searches_are_profiled(tmp_path: Path) -> None:
+    app = create_app("testing")
+    app.config["SEARCH"] = app.config["SEARCH"].using(FakeElasticsearch())
+    app.extensions["profiler"] = Profiler(tmp_path, every=1)
+    response = app.test_client().get("/?request=humans,bacteria")
+    assert response.status_code == 200
+    [path] = list(tmp_path.glob("*.prof"))
+    assert path.name.endswith("-request-humans_bacteria.prof")
+    assert calls(path) > 0
+    # The profile is not left active for the next request
+    assert app.extensions["profiler"].sample() is not None
+
+
+def test_asgi_searches_are_profiled(tmp_path: Path) -> None:
+    app = create_app("testing")
+    app.extensions["profiler"] = Profiler(tmp_path, every=1)
+    status, _ = asgi_get(AsgiApp(app, FakeAsyncElasticsearch()), "/", "request=humans")
+    assert status == 200
+    [path] = list(tmp_path.glob("*.prof"))
+    assert path.name.endswith("-request-humans.prof")
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 20:12:37 2026
+"""
+
+from pathlib import Path
+from typing import List
+
+from query_proxy.concept_stats import (
+    ConceptCounts,
+    ConceptStatistics,
+    CooccurrenceMatrix,
+)
+from query_proxy.progress import Checkpoint, Position, ProgressStore
+
+ARCHIVE = "pubmed21n0001.xml.gz"
+
+
+def index(checkpoint: Checkpoint, ids: List[str]) -> List[str]:
+    """Stand-in for the index() of the processors."""
+    sent = []
+    for position, entry_id in enumerate(ids):
+        if checkpoint.skip(position, entry_id):
+            continue
+        checkpoint.sent(position, entry_id)
+        sent.append(entry_id)
+    return sent
+
+
+def test_migrate(tmp_path: Path) -> None:
+    done_file = tmp_path / "processed.log"
+    done_file.write_text(f"{ARCHIVE}\npubmed21n0002.xml.gz\n")
+    store = ProgressStore(tmp_path / "progress.sqlite")
+    assert store.migrate(done_file) == 2
+    assert store.migrate(done_file) == 0
+    assert store.done_archives() == {ARCHIVE, "pubmed21n0002.xml.gz"}
+    assert store.is_done(ARCHIVE, "checksum")
+    assert store.migrate(tmp_path / "missing.log") == 0
+
+
+def test_resume_after_interruption(tmp_path: Path) -> None:
+    path = tmp_path / "progress.sqlite"
+    ids = [str(pmid) for pmid in range(100, 110)]
+    checkpoint = Checkpoint(ProgressStore(path), ARCHIVE, "checksum", every=2)
+    assert index(checkpoint, ids) == ids
+    # The connection times out after five results
+    for _ in range(5):
+        checkpoint.acknowledge(True, 201)
+    checkpoint.save()
+
+    store = ProgressStore(path)
+    assert not store.is_done(ARCHIVE)
+    assert store.position(ARCHIVE) == Position(5, "104")
+    checkpoint = Checkpoint(store, ARCHIVE, "checksum")
+    assert index(checkpoint, ids) == ids[5:]
+    for _ in range(5):
+        checkpoint.acknowledge(False, 409)
+    assert checkpoint.finish()
+    assert store.is_done(ARCHIVE)
+    assert ARCHIVE in store.done_archives()
+
+
+def test_changed_archive_starts_over(tmp_path: Path) -> None:
+    store = ProgressStore(tmp_path / "progress.sqlite")
+    checkpoint = Checkpoint(store, ARCHIVE, "old")
+    index(checkpoint, ["1", "2"])
+    checkpoint.acknowledge()
+    checkpoint.save()
+    assert Checkpoint(store, ARCHIVE, "old").start == Position(1, "1")
+    assert Checkpoint(store, ARCHIVE, "new").start == Position()
+
+
+def test_rejected_actions_are_not_acknowledged(tmp_path: Path) -> None:
+    store = ProgressStore(tmp_path / "progress.sqlite")
+    checkpoint = Checkpoint(store, ARCHIVE)
+    index(checkpoint, ["1", "2", "3", "4"])
+    checkpoint.acknowledge(True, 201)
+    # A mapping error would fail again, a rejection has to be retried
+    checkpoint.acknowledge(False, 400)
+    checkpoint.acknowledge(False, 429)
+    checkpoint.acknowledge(True, 201)
+    assert not checkpoint.finish()
+    assert not store.is_done(ARCHIVE)
+    assert store.position(ARCHIVE) == Position(2, "2")
+
+
+def test_statistics_follow_the_checkpoint(tmp_path: Path) -> None:
+    counts_file = tmp_path / "counts.tsv"
+    store = ProgressStore(tmp_path / "progress.sqlite")
+    statistics = ConceptStatistics(counts_file)
+    checkpoint = Checkpoint(store, ARCHIVE, every=2, statistics=statistics)
+    for position, concept in enumerate(
+        ["NCBITaxon:2", "NCBITaxon:2", "NCBITaxon:9605"]
+    ):
+        checkpoint.sent(position, str(position), [concept])
+    for _ in range(3):
+        checkpoint.acknowledge(True, 201)
+    # The process is killed: the counts match the saved position
+    assert store.position(ARCHIVE) == Position(2, "1")
+    counts = ConceptCounts.load(counts_file)
+    assert counts.count("NCBITaxon:2") == 2
+    assert counts.count("NCBITaxon:9605") == 0
+    checkpoint = Checkpoint(store, ARCHIVE, statistics=ConceptStatistics(counts_file))
+    assert index(checkpoint, ["0", "1", "2"]) == ["2"]
+
+
+def test_cooccurrences_are_merged_when_done(tmp_path: Path) -> None:
+    matrix_file = tmp_path / "cooccurrences.bin"
+    store = ProgressStore(tmp_path / "progress.sqlite")
+    statistics = ConceptStatistics(cooccurrence_file=matrix_file)
+    checkpoint = Checkpoint(store, ARCHIVE, every=1, statistics=statistics)
+    checkpoint.sent(0, "0", ["a", "b"])
+    checkpoint.acknowledge(True, 201)
+    # Checkpoints only write the shard of the archive
+    assert not matrix_file.exists()
+    assert statistics.shard(ARCHIVE).exists()
+    # The process is killed, the next run continues the shard
+    statistics = ConceptStatistics(cooccurrence_file=matrix_file)
+    checkpoint = Checkpoint(store, ARCHIVE, every=1, statistics=statistics)
+    checkpoint.sent(1, "1", ["a", "b"])
+    checkpoint.acknowledge(True, 201)
+    assert checkpoint.finish()
+    assert not statistics.shard(ARCHIVE).exists()
+    assert CooccurrenceMatrix.load(matrix_file).related(["a"]) == [("b", 2)]
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Tue Oct 20 09:31:44 2026
+"""
+
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple
+
+import pytest
+
+from query_proxy.singleflight import AsyncSingleFlight, SingleFlight
+
+
+def test_concurrent_calls_are_coalesced() -> None:
+    flight = SingleFlight()
+    release = threading.Event()
+    started = threading.Event()
+    calls = []
+
+    def search() -> str:
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return "answer"
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        futures = [pool.submit(flight.do, "key", search) for _ in range(8)]
+        started.wait(5)
+        # Give the other threads time to join the running call
+        release.wait(0.1)
+        release.set()
+        results = [future.result() for future in futures]
+    assert len(calls) == 1
+    assert all(result == "answer" for result, _ in results)
+    assert sum(1 for _, shared in results if not shared) == 1
+    # Nothing is kept after the call has finished
+    assert flight.do("key", lambda: "fresh") == ("fresh", False)
+
+
+def test_errors_are_raised() -> None:
+    flight = SingleFlight()
+
+    def fail() -> str:
+        raise ValueError("no connection")
+
+    with pytest.raises(ValueError):
+        flight.do("key", fail)
+    assert flight.do("key", lambda: "answer") == ("answer", False)
+
+
+def test_async_calls_are_coalesced() -> None:
+    flight = AsyncSingleFlight()
+    calls = []
+
+    async def search() -> str:
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "answer"
+
+    async def run() -> List[Tuple[str, bool]]:
+        return await asyncio.gather(*(flight.do("key", search) for _ in range(50)))
+
+    results = asyncio.run(run())
+    assert len(calls) == 1
+    assert [shared for _, shared in results].count(False) == 1
+    assert all(result == "answer" for result, _ in results)
+
+
+def test_cancelled_leader() -> None:
+    flight = AsyncSingleFlight()
+
+    async def search() -> str:
+        await asyncio.sleep(0.01)
+        return "answer"
+
+    async def run() -> Tuple[str, bool]:
+        leader = asyncio.ensure_future(flight.do("key", search))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(flight.do("key", search))
+        await asyncio.sleep(0)
+        leader.cancel()
+        # The other callers still get the result of the search
+        return await follower
+
+    assert asyncio.run(run()) == ("answer", True)
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 17:20:44 2026
+"""
+
+import json
+from pathlib import Path
+
+from query_proxy.app import create_app
+from query_proxy.app.asgi import AsgiApp
+from query_proxy.slowlog import SlowLog, query_shape, read_records, summarize
+from tests.test_asgi import FakeAsyncElasticsearch, FakeElasticsearch, asgi_get
+
+
+def test_query_shape() -> None:
+    query = {"bool": {"filter": [{"term": {"concepts": "NCBITaxon:2"}}], "size": 10}}
+    assert query_shape(query) == {
+        "bool": {"filter": [{"term": {"concepts": "?"}}], "size": "?"}
+    }
+
+
+def test_slow_searches_are_logged(tmp_path: Path) -> None:
+    log_file = tmp_path / "slow.log"
+    app = create_app("testing")
+    elasticsearch = FakeElasticsearch()
+    app.config["SEARCH"] = app.config["SEARCH"].using(elasticsearch)
+    slow_log = SlowLog(log_file, threshold=0, profile_rate=1)
+    app.extensions["slow_log"] = slow_log
+    response = app.test_client().get("/?request=humans,bacteria&size=5")
+    assert response.status_code == 200
+    assert slow_log.flush(timeout=5)
+    [record] = list(read_records([log_file]))
+    assert record["request"] == "humans,bacteria"
+    assert record["parameters"]["size"] == 5
+    assert "elasticsearch" in record["stages"]
+    assert record["events"] == ["fallback"]
+    # The strict query and the fallback query
+    assert len(record["searches"]) == 2
+    assert record["searches"][0]["took"] == 1
+    assert record["searches"][0]["shards"]["successful"] == 1
+    assert "?" in record["shape"]
+    # The fallback query has been run again with profile enabled
+    assert elasticsearch.bodies[-1]["profile"] is True
+    assert "profile" in record
+
+
+def test_fast_searches_are_not_logged(tmp_path: Path) -> None:
+    log_file = tmp_path / "slow.log"
+    app = create_app("testing")
+    app.config["SEARCH"] = app.config["SEARCH"].using(FakeElasticsearch())
+    slow_log = SlowLog(log_file, threshold=60000)
+    app.extensions["slow_log"] = slow_log
+    app.test_client().get("/?request=humans")
+    assert slow_log.flush(timeout=5)
+    assert not log_file.exists()
+
+
+def test_summarize(tmp_path: Path) -> None:
+    log_file = tmp_path / "slow.log"
+    records = [
+        {"shape": "a", "milliseconds": 1500, "request": "humans"},
+        {"shape": "a", "milliseconds": 2500, "request": "bacteria"},
+        {"shape": "b", "milliseconds": 1200, "request": "humans,bacteria"},
+    ]
+    log_file.write_text("".join(json.dumps(record) + "\n" for record in records))
+    summary = summarize(read_records([log_file]))
+    assert [entry["shape"] for entry in summary] == ["a", "b"]
+    assert summary[0]["count"] == 2
+    assert summary[0]["median"] == 2000
+    assert summary[0]["example"] == "bacteria"
+    assert len(summarize(read_records([log_file]), top=1)) == 1
+
+
+def test_asgi_slow_searches_are_logged(tmp_path: Path) -> None:
+    log_file = tmp_path / "slow.log"
+    app = create_app("testing")
+    slow_log = SlowLog(log_file, threshold=0)
+    app.extensions["slow_log"] = slow_log
+    status, _ = asgi_get(
+        AsgiApp(app, FakeAsyncElasticsearch()), "/", "request=humans&size=5"
+    )
+    assert status == 200
+    assert slow_log.flush(timeout=5)
+    [record] = list(read_records([log_file]))
+    assert record["request"] == "humans"
+    assert len(record["searches"]) == 2
+    assert "profile" not in record
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 15:41:19 2026
+"""
+
+import io
+import json
+from pathlib import Path
+from typing import Iterator
+
+from query_proxy.bulk import BulkSink
+from query_proxy.telemetry import Telemetry
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_nested_stages(tmp_path: Path) -> None:
+    clock = Clock()
+    output = io.StringIO()
+    telemetry = Telemetry(tmp_path, interval=10, output=output, clock=clock)
+    telemetry.count("archives_skipped")
+    telemetry.start_archive("/tmp/pubmed21n0001.xml.gz")
+
+    def documents() -> Iterator[int]:
+        for i in range(3):
+            clock.now += 1  # parsing
+            with telemetry.time("tag"):
+                clock.now += 2
+            telemetry.count("documents_tagged")
+            yield i
+
+    with telemetry.time("bulk"):
+        for item in telemetry.timed(documents(), "prepare"):
+            clock.now += 0.5  # waiting for Elasticsearch
+            telemetry.count_bulk(True, {"index": {"status": 201}})
+            telemetry.tick()
+    telemetry.count_bulk(False, {"index": {"status": 429}})
+    archive = telemetry.finish_archive()
+    assert archive["stages"] == {"tag": 6.0, "prepare": 3.0, "bulk": 1.5}
+    assert archive["counters"] == {
+        "documents_tagged": 3,
+        "documents_indexed": 3,
+        "bulk_rejected": 1,
+    }
+    assert archive["rates"]["documents_tagged_per_second"] == 0.5
+    run = telemetry.finish()
+    assert run["counters"]["archives_skipped"] == 1
+    assert run["archives"] == ["/tmp/pubmed21n0001.xml.gz"]
+    reports = sorted(path.name.split("-", 2)[-1] for path in tmp_path.iterdir())
+    assert reports == ["pubmed21n0001.xml.gz.json", "run.json"]
+    summaries = output.getvalue().splitlines()
+    assert summaries[0].startswith("/tmp/pubmed21n0001.xml.gz: documents_indexed 3")
+    with next(tmp_path.glob("*run.json")).open() as report:
+        assert json.load(report)["stages"]["bulk"] == 1.5
+
+
+def test_archive_report(tmp_path: Path) -> None:
+    telemetry = Telemetry(interval=0, clock=Clock())
+    sink = BulkSink(dead_letter=None)
+    for name in ["pubmed21n0001.xml.gz", "pubmed21n0002.xml.gz"]:
+        with telemetry.archive_report(name):
+            with telemetry.count_retries(sink):
+                sink.retries += 2
+            # The archive is skipped, e.g. as its checksum did not match
+            if name.endswith("1.xml.gz"):
+                telemetry.count("archives_failed")
+                continue
+    assert telemetry.archive_name is None
+    run = telemetry.finish()
+    assert run["archives"] == ["pubmed21n0001.xml.gz", "pubmed21n0002.xml.gz"]
+    assert run["counters"] == {"archives_failed": 1, "bulk_retries": 4}
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Tue Oct 20 11:02:17 2026
+"""
+
+import json
+from os.path import join
+from pathlib import Path
+from typing import Any, Dict
+
+from query_proxy.app import create_app
+from query_proxy.app.main.views import (
+    build_search,
+    order_by_selectivity,
+    parse_args,
+    parse_request,
+    parse_request_fallback,
+)
+from query_proxy.concept_stats import ConceptCounts
+from tests.test_asgi import FakeElasticsearch
+
+HUMAN = "http://purl.obolibrary.org/obo/NCBITaxon_9605"
+BACTERIA = "http://purl.obolibrary.org/obo/NCBITaxon_2"
+
+
+def test_concepts_are_filters() -> None:
+    queries = parse_request(f"{HUMAN};{BACTERIA}, groundwater")
+    assert [query.to_dict() for query in queries] == [
+        {
+            "bool": {
+                "filter": [{"term": {"concepts": "NCBITaxon:9605"}}],
+                "should": [
+                    {"term": {"title": "NCBITaxon:2"}},
+                    {"term": {"abstract": "NCBITaxon:2"}},
+                ],
+            }
+        },
+        {
+            "bool": {
+                "must": [
+                    {
+                        "multi_match": {
+                            "query": "groundwater",
+                            "fields": ["title", "abstract"],
+                        }
+                    }
+                ]
+            }
+        },
+    ]
+
+
+def test_fallback() -> None:
+    queries = parse_request_fallback(f"{HUMAN};{BACTERIA},{BACTERIA}")
+    assert [query.to_dict() for query in queries] == [
+        {"term": {"concepts": "NCBITaxon:9605"}},
+        {"term": {"concepts": "NCBITaxon:2"}},
+    ]
+
+
+def test_date_range() -> None:
+    query, warnings = parse_args(
+        {"request": "water", "from_date": "2021", "to_date": "2020-05"}
+    )
+    assert (query["from_date"], query["to_date"]) == ("2020-05", "2021")
+    assert len(warnings) == 1
+    query, warnings = parse_args({"from_date": "2020-05", "to_date": "2020"})
+    assert (query["from_date"], query["to_date"]) == ("2020-05", "2020")
+    assert not warnings
+    query, warnings = parse_args({"from_date": "2020-02-30", "to_date": "May"})
+    assert "from_date" not in query and "to_date" not in query
+    assert len(warnings) == 2
+
+
+def test_date_range_is_inclusive() -> None:
+    app = create_app("testing")
+    queries = parse_request("water")
+    with app.app_context():
+        for from_date, to_date, expected in [
+            ("2019", "2020", ("2019||/y", "2020||/y")),
+            ("2020-05", "2020-06", ("2020-05||/M", "2020-06||/M")),
+            ("2020-05-01", "2020-05-31", ("2020-05-01||/d", "2020-05-31||/d")),
+        ]:
+            query = {"from_date": from_date, "to_date": to_date}
+            body = build_search(queries, "must", query).to_dict()
+            date_range = body["query"]["bool"]["filter"][0]["range"]["pubdate"]
+            assert (date_range["gte"], date_range["lte"]) == expected
+        body = build_search(queries, "should", {"to_date": "2020"}).to_dict()
+        assert body["query"]["bool"]["filter"] == [
+            {
+                "range": {
+                    "pubdate": {
+                        "format": "yyyy-MM-dd||yyyy-MM||yyyy",
+                        "lte": "2020||/y",
+                    }
+                }
+            }
+        ]
+        assert body["query"]["bool"]["minimum_should_match"] == 1
+
+
+def test_expand() -> None:
+    query, warnings = parse_args({"request": HUMAN, "expand": "True"})
+    assert query["expand"] is True
+    queries = parse_request(query["request"], query["expand"])
+    assert queries[0].to_dict() == {
+        "bool": {"filter": [{"term": {"ancestors": "NCBITaxon:9605"}}]}
+    }
+
+
+def test_resolve() -> None:
+    trie_file = join("tests", "resources", "mini-automaton.pickle")
+    queries = parse_request("bacteria", trie_file=trie_file)
+    assert queries[0].to_dict() == {
+        "bool": {"filter": [{"term": {"concepts": "NCBITaxon:2"}}]}
+    }
+    queries = parse_request_fallback("bacteria in soil", trie_file=trie_file)
+    assert [query.to_dict() for query in queries] == [
+        {"term": {"concepts": "NCBITaxon:2"}},
+        {"multi_match": {"query": "in soil", "fields": ["title", "abstract"]}},
+    ]
+
+
+def test_order_by_selectivity() -> None:
+    counts = ConceptCounts()
+    counts.add(["NCBITaxon:9605", "NCBITaxon:2"])
+    counts.add(["NCBITaxon:2"])
+    request = f"water,{BACTERIA};{HUMAN}, {HUMAN}"
+    ordered, documents = order_by_selectivity(request, counts)
+    assert ordered == f" {HUMAN},{BACTERIA};{HUMAN},water"
+    assert documents == {"NCBITaxon:2": 2, "NCBITaxon:9605": 1}
+
+
+def test_skip_impossible_query(tmp_path: Path) -> None:
+    counts = ConceptCounts(complete=True)
+    counts.add(["NCBITaxon:2"])
+    counts.save(tmp_path / "counts.tsv")
+    client = FakeElasticsearch()
+    app = create_app("testing")
+    app.config["CONCEPT_COUNTS"] = str(tmp_path / "counts.tsv")
+    app.config["SEARCH"] = app.config["SEARCH"].using(client)
+    response = app.test_client().get(f"/?request={HUMAN},{BACTERIA}")
+    # Only the fallback has been executed
+    assert [list(body["query"]["bool"]) for body in client.bodies] == [["should"]]
+    assert response.get_json()["warnings"] == [
+        "No document contains all concepts. Documents per concept: "
+        + "NCBITaxon:9605: 0, NCBITaxon:2: 1"
+    ]
+
+
+def test_incomplete_counts_only_order(tmp_path: Path) -> None:
+    counts = ConceptCounts()
+    counts.add(["NCBITaxon:2"])
+    counts.save(tmp_path / "counts.tsv")
+    client = FakeElasticsearch()
+    app = create_app("testing")
+    app.config["CONCEPT_COUNTS"] = str(tmp_path / "counts.tsv")
+    app.config["SEARCH"] = app.config["SEARCH"].using(client)
+    response = app.test_client().get(f"/?request={BACTERIA},{HUMAN}")
+    # Documents indexed before the counts may contain the uncounted concept
+    assert [list(body["query"]["bool"]) for body in client.bodies] == [
+        ["must"],
+        ["should"],
+    ]
+    assert response.get_json()["warnings"] == []
+
+
+def test_budget_used_up_without_search(tmp_path: Path) -> None:
+    counts = ConceptCounts(complete=True)
+    counts.add(["NCBITaxon:2"])
+    counts.save(tmp_path / "counts.tsv")
+    client = FakeElasticsearch()
+    app = create_app("testing")
+    app.config["CONCEPT_COUNTS"] = str(tmp_path / "counts.tsv")
+    app.config["SEARCH"] = app.config["SEARCH"].using(client)
+    warning = "The time budget was used up before the fallback search could run."
+    response = app.test_client().get(f"/?request={HUMAN}&budget=1&facets=true")
+    assert response.status_code == 200
+    assert client.bodies == []
+    answer = response.get_json()
+    assert answer["documents"] == 0
+    assert answer["facets"] == {"year": [], "journal": [], "mesh": []}
+    assert answer["warnings"][-1] == warning
+    response = app.test_client().get(f"/?request={HUMAN}&budget=1&total=true")
+    assert response.status_code == 200
+    answer = response.get_json()
+    assert answer["hits"] == []
+    assert answer["total"] == {"value": 0, "relation": "eq"}
+    assert answer["warnings"][-1] == warning
+
+
+def test_facets() -> None:
+    client = FakeElasticsearch()
+    app = create_app("testing")
+    app.config["SEARCH"] = app.config["SEARCH"].using(client)
+    response = app.test_client().get(f"/?request={HUMAN}&facets=true&size=5")
+    assert [body["size"] for body in client.bodies] == [0, 0]
+    assert set(client.bodies[-1]["aggs"]) == {"year", "journal", "mesh"}
+    assert all(params["request_cache"] for params in client.params)
+    assert response.get_json() == {
+        "facets": {
+            "year": [{"value": 2020, "documents": 1}],
+            "journal": [{"value": "Journal of Lorem Ipsum", "documents": 1}],
+            "mesh": [],
+        },
+        "documents": 1,
+        "request": HUMAN,
+        "warnings": [],
+    }
+
+
+def test_response_modes() -> None:
+    client = FakeElasticsearch()
+    app = create_app("testing")
+    app.config["SEARCH"] = app.config["SEARCH"].using(client)
+    response = app.test_client().get(f"/?request={HUMAN}&fields=title,year,foo")
+    assert client.bodies[-1]["_source"] == ["title", "year"]
+    assert client.bodies[-1]["track_total_hits"] is False
+    answer = response.get_json()
+    assert answer["hits"] == [
+        {"id": "12345", "title": "Humans and bacteria", "year": 2020}
+    ]
+    assert answer["warnings"] == ["Unknown field 'foo'. Ignoring it."]
+    assert "total" not in answer
+    response = app.test_client().get(f"/?request={HUMAN}&ids_only=true&total=true")
+    assert client.bodies[-1]["_source"] is False
+    assert client.bodies[-1]["track_total_hits"] is True
+    answer = response.get_json()
+    assert answer["hits"] == [{"id": "12345"}]
+    assert answer["total"] == {"value": 1, "relation": "eq"}
+
+
+class TimedOutElasticsearch(FakeElasticsearch):
+    def search(self, index: str, body: Dict, **kwargs: Any) -> Dict:
+        result = super().search(index, body, **kwargs)
+        result["timed_out"] = True
+        return result
+
+
+def test_time_budget() -> None:
+    client = TimedOutElasticsearch()
+    app = create_app("testing")
+    app.config["TIME_BUDGET"] = 1000
+    app.config["MAX_TIME_BUDGET"] = 4000
+    app.config["TERMINATE_AFTER"] = 5000
+    app.config["SEARCH"] = app.config["SEARCH"].using(client)
+    response = app.test_client().get(f"/?request={HUMAN}")
+    strict, fallback = client.bodies
+    assert strict["timeout"] == "500ms" and "terminate_after" not in strict
+    assert 0 < int(fallback["timeout"][:-2]) <= 1000
+    assert fallback["terminate_after"] == 5000
+    assert response.get_json()["warnings"] == [
+        "The search was stopped early to stay within the time budget."
+        + " The results may be incomplete."
+    ]
+    response = app.test_client().get(f"/?request={HUMAN}&budget=9000")
+    assert client.bodies[-2]["timeout"] == "2000ms"
+    assert response.get_json()["warnings"][0] == (
+        "The time budget is not allowed to be larger than 4000 ms. Set to 4000 ms."
+    )
+
+
+def test_resolve_without_automaton(tmp_path: Path) -> None:
+    client = FakeElasticsearch()
+    app = create_app("testing")
+    app.config["AUTOMATON"] = str(tmp_path / "missing.pickle")
+    app.config["SEARCH"] = app.config["SEARCH"].using(client)
+    response = app.test_client().get("/?request=groundwater&resolve=true")
+    # The request is searched in the full text instead
+    assert response.status_code == 200
+    assert "multi_match" in json.dumps(client.bodies[0])
+    assert response.get_json()["warnings"] == [
+        "Concepts in literal strings can not be recognized."
+    ]